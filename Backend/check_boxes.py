@@ -63,6 +63,11 @@ def load_patterns(path_to_pattern: Union[str, Path]) -> dict:
     return patterns
 
 
+def get_class_ids_of_pattern(pattern: Dict[str, List[Dict[str, Any]]]) -> List[int]:
+    """Class ids that are referenced by any variant of a pattern."""
+    return sorted({el["class_id"] for vl in (pattern or dict()).values() for el in vl})
+
+
 def is_xyxy(bboxes: List[List[float]]) -> bool:
     scale_to_xywh = False
     for bbx in bboxes:
@@ -1,14 +1,15 @@
 # from fastapi_offline import FastAPIOffline as FastAPI
-from fastapi import File, UploadFile, HTTPException, Depends, Response
+from fastapi import File, UploadFile, HTTPException, Depends, Request, Response
 from fastapi.responses import JSONResponse
-import uvicorn
+from fastapi.concurrency import run_in_threadpool
 from prometheus_client import Counter, Gauge
 
-from requests.exceptions import ConnectionError
+from requests.exceptions import ConnectionError, Timeout
 
 import numpy as np
 from pathlib import Path
 import re
+from urllib.parse import urlsplit
 from PIL import Image
 
 # import os
@@ -19,17 +20,25 @@ from threading import Thread
 
 # custom packages
 from plot_pil import plot_bboxs, plot_bounds
-from check_boxes import check_boxes, get_patterns_from_config
+from check_boxes import check_boxes, get_patterns_from_config, get_class_ids_of_pattern
 from utils_image import image_to_base64, bytes_to_image_pil, save_image, image_pil_to_buffer
 
 from utils import get_config, read_mappings_from_csv, setup_logging, default_from_env
 
-from utils_communication import trigger_camera, request_model_inference
+from utils_communication import trigger_camera, request_model_inference, request_readiness, ServerOverloaded
 from utils_fastapi import (
     default_fastapi_setup,
     setup_prometheus_metrics,
-    AccessToken
+    setup_stage_metrics,
+    setup_admission_control,
+    setup_cancellation,
+    get_number_of_workers,
+    run_server,
+    start_workers,
+    AccessToken,
+    Deadline
 )
+from utils_shared_state import SharedState
 from utils_config import (
     get_basler_camera_parameter_from_config,
     get_image_parameter_from_config
@@ -58,6 +67,10 @@ logger = setup_logging(__name__)
 CONFIG = get_config()
 logger.debug(f"Configuration (CONFIG): {CONFIG}")
 
+if __name__ == "__main__":
+    # several worker processes: hand over to uvicorn before anything is loaded (the workers import "main:app")
+    start_workers("main:app", port=CONFIG.get("SERVER_PORT", 5051), workers=CONFIG.get("SERVER_WORKERS", 1))
+
 # get patterns to check the model prediction
 PATTERNS, DEFAULT_PATTERN_KEY = get_patterns_from_config(CONFIG)
 # naming & colors for the (predicted) classes
@@ -79,17 +92,55 @@ ENTRYPOINT_IMAGE = ENTRYPOINT + "latest"
 ENTRYPOINT_IMAGE_RAW = ENTRYPOINT + "image-raw"
 ENTRYPOINT_IMAGE_DRAW = ENTRYPOINT + "image-draw"
 
+
+
+def is_ready() -> bool:
+    # the Backend is ready once the Inference server is warmed up (/ready at the root of the Inference server)
+    address_inference = CONFIG["INFERENCE_URL"] if "INFERENCE_URL" in CONFIG else None
+    if not address_inference:
+        return True
+    url = urlsplit(address_inference)
+    return request_readiness(
+        f"{url.scheme}://{url.netloc}/ready",
+        timeout=CONFIG.get("INFERENCE_READY_TIMEOUT", 0.5),
+        token=CONFIG["INFERENCE_AUTH_TOKEN"] if "INFERENCE_AUTH_TOKEN" in CONFIG else None
+    )
+
+
 # create fastAPI object
 title = "Backend"
 summary = "Minimalistic server providing a REST api to orchestrate a containerized computer vision application."
-app = default_fastapi_setup(title, summary, root_path=CONFIG["GENERAL_ROOT_PATH"])
+app = default_fastapi_setup(title, summary, root_path=CONFIG["GENERAL_ROOT_PATH"], readiness=is_ready)
 
 
 # set up /metrics endpoint for prometheus
 EXECUTION_COUNTER, EXCEPTION_COUNTER, EXECUTION_TIMING = setup_prometheus_metrics(
     app,
-    entrypoints_to_track=[ENTRYPOINT_MAIN, ENTRYPOINT_CHECK_PATTERN, ENTRYPOINT_MAIN_WITH_CAMERA]
+    entrypoints_to_track=[ENTRYPOINT_MAIN, ENTRYPOINT_CHECK_PATTERN, ENTRYPOINT_MAIN_WITH_CAMERA],
+    buckets=CONFIG.get("METRICS_BUCKETS", None)
+)
+# latency per processing stage (backend_stage_duration_seconds{stage="..."})
+STAGE_TIMING = setup_stage_metrics(
+    "backend",
+    ["read", "camera", "inference", "decode", "draw", "pattern_check", "encode", "response"],
+    buckets=CONFIG.get("METRICS_BUCKETS", None)
+)
+# bounded number of requests in flight / in the queue; requests beyond fail fast with 503 (or 429) and Retry-After
+ADMISSION = setup_admission_control(
+    app,
+    "backend",
+    paths=[ENTRYPOINT_MAIN, ENTRYPOINT_MAIN_WITH_CAMERA],
+    max_in_flight=CONFIG.get("ADMISSION_MAX_IN_FLIGHT", 0),
+    max_queue=CONFIG.get("ADMISSION_MAX_QUEUE", 0),
+    max_queue_wait=CONFIG.get("ADMISSION_MAX_QUEUE_WAIT", 1),
+    retry_after=CONFIG.get("ADMISSION_RETRY_AFTER", 1),
+    status_code=CONFIG.get("ADMISSION_STATUS_CODE", 503),
+    buckets=CONFIG.get("METRICS_BUCKETS", None)
 )
+# requests whose deadline (header X-Deadline-Ms, e.g. the timeout of the Frontend) passed or whose client disconnected
+# are dropped before the expensive stages (backend_cancelled_requests, backend_cancelled_saved_seconds); the remaining
+# time is forwarded to the Inference server
+CANCELLATION = setup_cancellation(app, "backend")
 DECISION = {
     vl: Counter(
         name=f"pattern_check_decision_{vl}".lower(),
@@ -103,38 +154,56 @@ SAVED_IMAGES = Counter(
 )
 
 
-# initialize counter
-counter = 0
-# initialize global variables
-latest_image_raw = None
-latest_image_draw = None
+# latest images and request counter (shared by all worker processes if there are several)
+STATE = SharedState(
+    CONFIG.get("SERVER_SHARED_STATE_FOLDER", "/dev/shm/backend")
+    if get_number_of_workers(CONFIG.get("SERVER_WORKERS", 1)) > 1 else None
+)
+KEY_COUNTER = "counter"
+KEY_IMAGE_RAW = "latest_image_raw"
+KEY_IMAGE_DRAW = "latest_image_draw"
+
+
+def encode_image(image: Image) -> bytes:
+    image_quality = CONFIG["CAMERA_IMAGE_QUALITY"] if "CAMERA_IMAGE_QUALITY" in CONFIG else CONFIG["GENERAL_IMAGE_QUALITY"]
+    return image_pil_to_buffer(image, image_quality)
 
 
 @app.get(ENTRYPOINT_MAIN)
-@EXECUTION_TIMING[ENTRYPOINT_MAIN].time()
-@EXCEPTION_COUNTER[ENTRYPOINT_MAIN].count_exceptions()
+# Decorators do not work for async functions
 async def main(
+        request: Request,
         image: UploadFile = File(...),
         image_params: ImageParams = Depends(),
         settings: SettingsMain = Depends(),
         token = AccessToken
 ):
-    # wait for file transmission
-    image_bytes = await image.read()
-
-    return backend(
-        img_bytes=image_bytes,
-        image_params=image_params,
-        settings=settings
-    )
+    deadline = CANCELLATION.deadline(request.headers, request.is_disconnected)
+    with EXCEPTION_COUNTER[ENTRYPOINT_MAIN].count_exceptions(), EXECUTION_TIMING[ENTRYPOINT_MAIN].time():
+        # wait for file transmission
+        with STAGE_TIMING["read"].time():
+            image_bytes = await image.read()
+        await deadline.check_async("inference")
+
+        # blocking request to the Inference server, drawing, and encoding: keep the event loop free (admission control)
+        return await run_in_threadpool(
+            backend,
+            img_bytes=image_bytes,
+            image_params=image_params,
+            settings=settings,
+            deadline=deadline
+        )
 
 
 def backend(
         img_bytes,
         image_params: ImageParams = Depends(),
         settings: SettingsMain = Depends(),
+        deadline: Deadline = None
 ):
     t0 = default_timer()
+    if deadline is None:
+        deadline = Deadline()
 
     # join local parameter with config parameter
     image_params = ImageParams(
@@ -146,10 +215,16 @@ def backend(
     # setup return options
     return_options = ReturnValuesMain(settings.return_options)
 
+    pattern_key = settings.pattern_key
+    if pattern_key is None:
+        pattern_key = DEFAULT_PATTERN_KEY
+
     # ----- Inference backend
-    bboxes, scores, class_ids = [(0, 0, 0, 0)], [0], [0]  # initialize default values
+    bboxes, scores, class_ids = np.zeros((1, 4)), np.zeros(1), np.zeros(1, dtype=int)  # initialize default values
+    address_inference = CONFIG["INFERENCE_URL"] if "INFERENCE_URL" in CONFIG else None
+    if address_inference:
+        deadline.check("inference")
     try:
-        address_inference = CONFIG["INFERENCE_URL"] if "INFERENCE_URL" in CONFIG else None
         if address_inference:
             t3 = default_timer()
             logger.debug(f"Request model inference backend at {address_inference}")
@@ -157,24 +232,34 @@ def backend(
                 address=address_inference,
                 image_raw=img_bytes,
                 extension=image_params.format,
-                timeout=CONFIG["INFERENCE_TIMEOUT"],
+                # the Inference server drops the request once the Backend (or its caller) has given up
+                timeout=deadline.remaining(CONFIG["INFERENCE_TIMEOUT"]),
                 token=CONFIG["INFERENCE_AUTH_TOKEN"] if "INFERENCE_AUTH_TOKEN" in CONFIG else None,
+                # the inference server filters by score (and classes of the pattern) before returning the objects
+                settings=settings,
+                class_ids=get_class_ids_of_pattern(PATTERNS[pattern_key])
+                if CONFIG.get("INFERENCE_PATTERN_CLASSES_ONLY", True) and pattern_key in PATTERNS else None,
+                binary=CONFIG.get("INFERENCE_BINARY_RESULTS", True)
             )
-            bboxes, class_ids, scores = result["bboxes"], result["class_ids"], result["scores"]
+            # NumPy arrays (binary encoding: without copy; JSON: from lists)
+            bboxes = np.asarray(result["bboxes"], dtype=np.float32).reshape(-1, 4)
+            class_ids = np.asarray(result["class_ids"], dtype=int)
+            scores = np.asarray(result["scores"], dtype=np.float32)
 
             # log execution time
             t4 = default_timer()
+            STAGE_TIMING["inference"].observe(t4 - t3)
             logger.debug(f"Inference took {(t4 - t3) * 1000:.4g} ms; # bounding-boxes={len(bboxes)}")
-
-            # to numpy
-            scores = np.asarray(scores)
-            lg = scores >= settings.min_score
-            scores = scores[lg].tolist()
-            class_ids = np.asarray(class_ids)[lg].tolist()
-            bboxes = np.asarray(bboxes)[lg].round(3).tolist()
-            t5 = default_timer()
-            logger.debug(f"{sum(lg)}/{len(lg)} objects above minimum confidence score {settings.min_score} (took {(t5 - t4) * 1000:.4g} ms).")
-    except (TimeoutError, ConnectionError):
+    except ServerOverloaded as e:
+        # fail fast: the caller should retry later instead of waiting for a timeout
+        msg = f"Inference server is saturated: {e}"
+        logger.warning(msg)
+        raise HTTPException(
+            status_code=503,
+            detail=msg,
+            headers={"Retry-After": e.retry_after} if e.retry_after else None
+        )
+    except (TimeoutError, Timeout, ConnectionError):
         msg = "TimeoutError: Inference backend not responding."
         logger.error(msg)
         raise HTTPException(status_code=408, detail=msg)
@@ -191,16 +276,18 @@ def backend(
     t6 = default_timer()
 
     # img from bytes
+    deadline.check("decode")
     img = bytes_to_image_pil(img_bytes)
     t7 = default_timer()
+    STAGE_TIMING["decode"].observe(t7 - t6)
     logger.debug(f"Image object from bytes took {(t7 - t6) * 1000:.4g} ms")
 
-    # update global variable
-    global latest_image_raw
-    latest_image_raw  = img
+    # update latest image
+    STATE.set(KEY_IMAGE_RAW, img, serialize=encode_image)
 
     # ----- Plot bounding-boxes
     if ReturnValuesMain.IMAGE_DRAWN in return_options:
+        deadline.check("draw")
         img_draw = plot_bboxs(
             img.convert("RGB"),
             bboxes,
@@ -211,25 +298,19 @@ def backend(
         )
         # log execution time
         t8 = default_timer()
+        STAGE_TIMING["draw"].observe(t8 - t7)
         logger.debug(f"Plot bounding boxes took {(t8 - t7) * 1000:.4g} ms")
 
-        global latest_image_draw
-        latest_image_draw = img_draw
-
     # ----- Check bounding-box pattern
     decision = None
     pattern_name = None
     lg = None
-    pattern_key = settings.pattern_key
 
     note_to_saved_image = None
-    if pattern_key is None:
-        pattern_key = DEFAULT_PATTERN_KEY
-
-    if pattern_key and bboxes and PATTERNS:
+    if pattern_key and len(bboxes) > 0 and PATTERNS:
         t8 = default_timer()
         decision, pattern_name, lg = _check_pattern(
-            np.array(bboxes) / (img.size + img.size),
+            bboxes / (img.size + img.size),
             class_ids,
             PATTERNS[pattern_key]
         )
@@ -255,11 +336,15 @@ def backend(
         logger.debug(f"Pattern check took {(t9 - t8) * 1000:.4g} ms")
     elif not pattern_key:
         logger.info("No pattern provided to check bounding-boxes.")
-    elif not bboxes:
+    elif len(bboxes) == 0:
         logger.info("No bounding-boxes found.")
 
+    # update latest drawn image (after the pattern bounds were drawn into it)
+    if ReturnValuesMain.IMAGE_DRAWN in return_options:
+        STATE.set(KEY_IMAGE_DRAW, img_draw, serialize=encode_image)
+
     # save image
-    global counter
+    counter = STATE.increment(KEY_COUNTER)
     if note_to_saved_image or \
             (isinstance(CONFIG["GENERAL_SAVE_IMAGES"], str) and (CONFIG["GENERAL_SAVE_IMAGES"].lower() == "all")) or \
             (save_every_x and (counter % save_every_x == 0)):
@@ -291,28 +376,29 @@ def backend(
 
         image_quality = CONFIG["CAMERA_IMAGE_QUALITY"] \
             if "CAMERA_IMAGE_QUALITY" in CONFIG else CONFIG["GENERAL_IMAGE_QUALITY"]
-        if ReturnValuesMain.IMAGE in return_options:
-            content["images"]["img"] = image_to_base64(img, image_quality)
-        if ReturnValuesMain.IMAGE_DRAWN in return_options:
-            content["images"]["img_drawn"] = image_to_base64(img_draw, image_quality)
+        deadline.check("encode")
+        with STAGE_TIMING["encode"].time():
+            if ReturnValuesMain.IMAGE in return_options:
+                content["images"]["img"] = image_to_base64(img, image_quality)
+            if ReturnValuesMain.IMAGE_DRAWN in return_options:
+                content["images"]["img_drawn"] = image_to_base64(img_draw, image_quality)
 
     if ((ReturnValuesMain.BBOXES in return_options) or
             (ReturnValuesMain.CLASS_IDS in return_options) or
             (ReturnValuesMain.SCORES in return_options)):
         content["results"] = dict()
         if ReturnValuesMain.BBOXES in return_options:
-            content["results"]["bboxes"] = bboxes
+            content["results"]["bboxes"] = bboxes.round(1).tolist()
         if ReturnValuesMain.CLASS_IDS in return_options:
-            content["results"]["class_ids"] = class_ids
+            content["results"]["class_ids"] = class_ids.tolist()
         if ReturnValuesMain.SCORES in return_options:
-            content["results"]["scores"] = scores
+            content["results"]["scores"] = scores.round(3).tolist()
 
     t11 = default_timer()
+    STAGE_TIMING["response"].observe(t11 - t10)
+    deadline.finished()
     logger.debug(f"Building response took {(t11 - t10) * 1000:.4g} ms")
 
-    # increase global counter
-    counter += 1
-
     logger.debug(f"Call to {ENTRYPOINT_MAIN} took {(default_timer() - t0) * 1000:.4g} ms")
     return JSONResponse(content=content)
 
@@ -321,6 +407,7 @@ def backend(
 @EXECUTION_TIMING[ENTRYPOINT_MAIN_WITH_CAMERA].time()
 @EXCEPTION_COUNTER[ENTRYPOINT_MAIN_WITH_CAMERA].count_exceptions()
 def main_with_camera(
+        request: Request,
         camera_params: BaslerCameraSettings = Depends(),
         image_params: ImageParams = Depends(),
         settings: SettingsMain = Depends(),
@@ -328,6 +415,8 @@ def main_with_camera(
 ):
     # increment counter for /metrics endpoint
     EXECUTION_COUNTER[ENTRYPOINT_MAIN].inc()
+    # synchronous endpoint: the deadline is checked, client disconnects are not detected
+    deadline = CANCELLATION.deadline(request.headers)
 
     # join local parameter with config parameter
     image_params = ImageParams(
@@ -358,19 +447,21 @@ def main_with_camera(
         raise HTTPException(status_code=400, detail=msg)
 
     # ----- Camera
+    deadline.check("camera")
     try:
         # trigger camera
         t1 = default_timer()
         img_bytes = trigger_camera(
             camera_,
             image_params,
-            timeout=CONFIG["CAMERA_TIMEOUT"]
+            timeout=deadline.remaining(CONFIG["CAMERA_TIMEOUT"])
         )
 
         # log execution time
         t2 = default_timer()
+        STAGE_TIMING["camera"].observe(t2 - t1)
         logger.debug(f"Calling the camera ({camera_}) took {(t2 - t1) * 1000:.4g} ms")
-    except (TimeoutError, ConnectionError):
+    except (TimeoutError, Timeout, ConnectionError):
         msg = "TimeoutError: trigger_camera(...). Camera not responding."
         logger.error(msg)
         raise HTTPException(status_code=408, detail=msg)
@@ -382,14 +473,15 @@ def main_with_camera(
     return backend(
         img_bytes=img_bytes,
         image_params=ImageParams.model_validate(image_params.model_dump()),
-        settings=settings
+        settings=settings,
+        deadline=deadline
     )
 
 
 @app.post(ENTRYPOINT_CHECK_PATTERN)
 @EXECUTION_TIMING[ENTRYPOINT_CHECK_PATTERN].time()
 @EXCEPTION_COUNTER[ENTRYPOINT_CHECK_PATTERN].count_exceptions()
-async def check_pattern(request: PatternRequest, token = AccessToken):
+def check_pattern(request: PatternRequest, token = AccessToken):
     t0 = default_timer()
     # increment counter for /metrics endpoint
     EXECUTION_COUNTER[ENTRYPOINT_CHECK_PATTERN].inc()
@@ -430,6 +522,7 @@ def _check_pattern(
     t0 = default_timer()
     pattern_name, lg = check_boxes(bboxes, class_ids, pattern)
     dt = default_timer() - t0
+    STAGE_TIMING["pattern_check"].observe(dt)
 
     logger.debug(f"check_boxes(): pattern_name={pattern_name}, {sum(lg)}/{len(lg)} (lg={lg}); took {dt * 1000:.4g} ms")
 
@@ -442,32 +535,22 @@ def _check_pattern(
 
 @app.get(ENTRYPOINT_IMAGE_RAW)
 def return_latest_image_raw(token = AccessToken):
-    global latest_image_raw
-    return return_image(latest_image_raw)
+    return return_image(STATE.get(KEY_IMAGE_RAW))
 
 
-def return_image(image: Union[Image, None], token = AccessToken):
-    # Return the latest image
+def return_image(image: Union[Image, bytes, None], token = AccessToken):
+    # Return the latest image (already encoded if it was shared by another worker process)
     if image is not None:
-        image_quality = CONFIG["CAMERA_IMAGE_QUALITY"] if "CAMERA_IMAGE_QUALITY" in CONFIG else CONFIG["GENERAL_IMAGE_QUALITY"]
-        return Response(content=image_pil_to_buffer(image, image_quality), media_type="image/jpeg")
+        content = image if isinstance(image, bytes) else encode_image(image)
+        return Response(content=content, media_type="image/jpeg")
     else:
         return Response(content="No image captured yet", media_type="text/plain")
 
 
 @app.get(ENTRYPOINT_IMAGE_DRAW)
 def return_latest_image_draw(token = AccessToken):
-    global latest_image_draw
-    return return_image(latest_image_draw)
+    return return_image(STATE.get(KEY_IMAGE_DRAW))
 
 
 if __name__ == "__main__":
-    uvicorn.run(
-        app=app,
-        port=5051,
-        host="0.0.0.0",
-        access_log=True,
-        log_config=None,  # Uses the logging configuration in the application
-        ssl_keyfile=default_from_env("SSL_KEYFILE", None),  # "server.key"
-        ssl_certfile=default_from_env("SSL_CERTIFICATE", None),  # "server.crt"
-    )
+    run_server(app, port=CONFIG.get("SERVER_PORT", 5051))
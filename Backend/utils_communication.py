@@ -2,21 +2,29 @@ import requests
 import urllib.parse
 from timeit import default_timer
 
-from DataModels import CameraInfo, ResultInference
+from DataModels import CameraInfo, ResultInference, RawImageFormat, InferenceFilter, SettingsMain
 from DataModels_BaslerCameraAdapter import (
     BaslerCameraSettings,
     get_not_none_values,
     ImageParams
 )
-from utils import setup_logging, create_auth_headers
+from utils import setup_logging, create_auth_headers, create_deadline_headers
+from utils_result_encoding import MEDIA_TYPE_RESULTS, decode_results
 
-from typing import Union, Dict, List
+from typing import Union, Dict, List, Iterable
 
 
 # Setup logging
 logger = setup_logging(__name__)
 
 
+class ServerOverloaded(Exception):
+    """The server rejected the request because it is saturated (status code 503 or 429)."""
+    def __init__(self, message: str, retry_after: str = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
 def trigger_camera(
         camera_info: CameraInfo,
         image_params: ImageParams,
@@ -91,22 +99,64 @@ def request_camera(
     return content
 
 
+def request_readiness(address: str, timeout: float = 1, token: str = None) -> bool:
+    """True if the server at `address` (e.g. http://inference:5052/ready) reports that it is ready."""
+    try:
+        response = requests.get(address, headers=create_auth_headers(token), timeout=timeout)
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as ex:
+        logger.debug(f"request_readiness({address}): {ex}")
+        return False
+    return response.status_code == 200
+
+
 def request_model_inference(
         address: str,
         image_raw: bytes,
         extension: str,
         timeout: int = 5,  # seconds,
-        token: str = None
+        token: str = None,
+        raw_format: RawImageFormat = None,
+        settings: SettingsMain = None,
+        class_ids: Iterable[int] = None,
+        binary: bool = False
 ) -> ResultInference:
+    """
+    Sends an image file to the inference server. If `raw_format` is given, `image_raw` is an uncompressed frame
+    that is forwarded unchanged as application/octet-stream body (no encoding / decoding).
+    The inference server returns only the objects that are used: scores above `settings.min_score` (or the
+    per-class scores `settings.class_scores`), at most `settings.top_k` objects, and only `class_ids` (if given).
+    With `binary`, the results are requested in a compact binary encoding and returned as NumPy arrays (views of the
+    response body, no copy); servers that do not support it answer with JSON.
+    The `timeout` is sent as deadline (header X-Deadline-Ms), i.e. the inference server drops the request once the
+    caller has given up.
+    """
 
-    logger.debug(f"request_model_inference({address}, image={len(image_raw)}, extension={extension})")
+    logger.debug(f"request_model_inference({address}, image={len(image_raw)}, extension={extension}, raw_format={raw_format})")
 
-    # Send the POST request with the image
-    ext = extension.strip(".")
-    content = {"image": (f"image.{ext}", image_raw, f"image/{ext}")}
+    inference_filter = InferenceFilter(
+        min_score=settings.min_score if settings is not None else None,
+        class_scores=InferenceFilter.parse_class_scores(settings.class_scores) if settings is not None else None,
+        classes=sorted(class_ids) if class_ids is not None else None,
+        top_k=settings.top_k if settings is not None else None
+    )
+    params = inference_filter.to_params()
+    logger.debug(f"request_model_inference(): filter {params}")
 
     t0 = default_timer()
-    response = requests.post(address, files=content, headers=create_auth_headers(token), timeout=timeout)
+    # the content type depends on the body (requests sets the boundary of a multipart body itself)
+    headers = {ky: vl for ky, vl in (create_auth_headers(token) or dict()).items() if ky.lower() != "content-type"}
+    headers |= create_deadline_headers(timeout)
+    if binary:
+        headers["Accept"] = f"{MEDIA_TYPE_RESULTS}, application/json;q=0.5"
+    if raw_format is not None:
+        # Send the POST request with the pixels as body
+        headers |= {"Content-Type": "application/octet-stream"} | raw_format.to_headers()
+        response = requests.post(address, data=image_raw, headers=headers, params=params, timeout=timeout)
+    else:
+        # Send the POST request with the image
+        ext = extension.strip(".")
+        content = {"image": (f"image.{ext}", image_raw, f"image/{ext}")}
+        response = requests.post(address, files=content, headers=headers, params=params, timeout=timeout)
     status_code = response.status_code
 
     logger.info(
@@ -118,6 +168,17 @@ def request_model_inference(
 
     # Check the response
     if status_code == 200:
+        if response.headers.get("content-type", "").split(";")[0].strip() == MEDIA_TYPE_RESULTS:
+            (bboxes, class_ids, scores), _ = decode_results(response.content)
+            return {"bboxes": bboxes, "class_ids": class_ids, "scores": scores}
         return response.json()
+    elif status_code == 504:
+        # the deadline passed before the inference server got to the request
+        raise TimeoutError(f"Inference returned status code {status_code} with message {response.text}")
+    elif status_code in (429, 503):
+        raise ServerOverloaded(
+            f"Inference returned status code {status_code} with message {response.text}",
+            retry_after=response.headers.get("retry-after")
+        )
     else:
         raise Exception(f"Inference returned status code {status_code} with message {response.text}")
@@ -0,0 +1,105 @@
+import logging
+import os
+from pathlib import Path
+from threading import Condition, Lock, Thread
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from typing import Union, Optional, Callable, Any, Dict, Tuple
+
+
+class SharedState:
+    """
+    Small key-value state of the server, e.g. the latest images and the request counter.
+    Without a folder, the values are kept in memory of this process (single worker). With a folder (e.g. below
+    /dev/shm), the values are stored as files so that all worker processes of the server see the same state.
+    """
+    def __init__(self, folder: Union[str, Path, None] = None):
+        self.folder = Path(folder) if folder else None
+        if self.folder is not None:
+            self.folder.mkdir(parents=True, exist_ok=True)
+            if fcntl is None:
+                logging.warning("fcntl is not available: counters of the shared state are not synchronized.")
+
+        self._values = dict()
+        self._lock = Lock()
+        # values that are not written yet (per key only the latest one) and the thread that writes them
+        self._pending: Dict[str, Tuple[Any, Callable[[Any], bytes]]] = dict()
+        self._pending_changed = Condition(Lock())
+        self._writer: Optional[Thread] = None
+
+    @property
+    def shared(self) -> bool:
+        return self.folder is not None
+
+    def set(self, key: str, value: Any, serialize: Callable[[Any], bytes] = None) -> None:
+        """
+        Stores a value. Shared values are serialized to bytes (`serialize`) and written by a single background
+        thread, i.e. the caller is not blocked by encoding the value. A value that is replaced before it was written is
+        dropped without serializing it (last write wins). The caller must not modify the value afterward.
+        """
+        if not self.shared:
+            self._values[key] = value
+            return
+
+        with self._pending_changed:
+            self._pending[key] = (value, serialize)
+            self._pending_changed.notify()
+            if self._writer is None:
+                self._writer = Thread(target=self._write_pending, name="shared-state-writer", daemon=True)
+                self._writer.start()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Returns the value (shared: the serialized bytes) or None if it was not set yet."""
+        if not self.shared:
+            return self._values.get(key)
+
+        try:
+            with open(self.folder / key, "rb") as fid:
+                return fid.read()
+        except FileNotFoundError:
+            return None
+
+    def increment(self, key: str) -> int:
+        """Increments a counter and returns its previous value (atomic across threads and processes)."""
+        if not self.shared:
+            with self._lock:
+                value = self._values.get(key, 0)
+                self._values[key] = value + 1
+            return value
+
+        with self._lock, open(self.folder / f"{key}.counter", "a+") as fid:
+            if fcntl is not None:
+                fcntl.flock(fid, fcntl.LOCK_EX)
+            fid.seek(0)
+            text = fid.read().strip()
+            value = int(text) if text else 0
+            fid.seek(0)
+            fid.truncate()
+            fid.write(str(value + 1))
+            # (lock is released when the file is closed)
+        return value
+
+    def _write_pending(self) -> None:
+        while True:
+            with self._pending_changed:
+                while not self._pending:
+                    self._pending_changed.wait()
+                key = next(iter(self._pending))
+                value, serialize = self._pending.pop(key)
+            try:
+                self._write(key, value, serialize)
+            except Exception as ex:
+                logging.error(f"Failed to write '{key}' to the shared state: {ex}")
+
+    def _write(self, key: str, value: Any, serialize: Callable[[Any], bytes] = None) -> None:
+        data = serialize(value) if serialize is not None else value
+        # write to a temporary file and replace the previous file so that readers never see a partial file
+        path_to_file = self.folder / key
+        path_to_tmp = path_to_file.with_name(f".{key}.{os.getpid()}.tmp")
+        with open(path_to_tmp, "wb") as fid:
+            fid.write(data)
+        os.replace(path_to_tmp, path_to_file)
@@ -7,7 +7,7 @@ from pathlib import Path
 from DataModels_BaslerCameraAdapter import BaslerCameraSettings
 
 from typing_extensions import Annotated
-from typing import Optional, List, Dict, Tuple, Union, Literal
+from typing import Optional, List, Dict, Tuple, Union, Literal, ClassVar
 
 from utils import default_from_env
 from DataModels_BaslerCameraAdapter import BaslerCameraSettings
@@ -34,6 +34,55 @@ class ResultInference(BaseModel):
     scores: List[float]
 
 
+class InferenceFilter(BaseModel):
+    """Filters that the inference server applies to the detections (query parameters of /inference)."""
+    min_score: Optional[Annotated[float, Field(strict=False, le=1, ge=0)]] = None  # default: th_score of the model
+    class_scores: Optional[Dict[int, Annotated[float, Field(strict=False, le=1, ge=0)]]] = None  # min. score per class
+    classes: Optional[List[int]] = None  # class ids to keep (default: all)
+    top_k: Optional[Annotated[int, Field(strict=False, ge=1)]] = None  # maximum number of boxes (highest scores)
+
+    @staticmethod
+    def parse_class_scores(text: Union[str, None]) -> Union[Dict[int, float], None]:
+        """"0:0.6,3:0.4" -> {0: 0.6, 3: 0.4}"""
+        if not text:
+            return None
+        return {int(ky): float(vl) for ky, vl in (el.split(":") for el in text.split(",") if el.strip())}
+
+    def to_params(self) -> Dict[str, Union[float, int, str, List[int]]]:
+        params = self.model_dump(exclude_none=True)
+        if "class_scores" in params:
+            params["class_scores"] = ",".join(f"{ky}:{vl:g}" for ky, vl in params["class_scores"].items())
+        return params
+
+
+class RawImageFormat(BaseModel):
+    """Metadata of an uncompressed frame that is sent as application/octet-stream body (instead of an image file)."""
+    shape: Tuple[int, ...]  # (height, width) or (height, width, channels)
+    dtype: Literal["uint8", "uint16"] = "uint8"
+    channel_order: Literal["RGB", "BGR", "GRAY"] = "RGB"
+
+    # HTTP headers that carry the metadata
+    HEADER_SHAPE: ClassVar[str] = "X-Image-Shape"
+    HEADER_DTYPE: ClassVar[str] = "X-Image-Dtype"
+    HEADER_CHANNEL_ORDER: ClassVar[str] = "X-Image-Channel-Order"
+
+    def to_headers(self) -> Dict[str, str]:
+        return {
+            self.HEADER_SHAPE: ",".join(str(el) for el in self.shape),
+            self.HEADER_DTYPE: self.dtype,
+            self.HEADER_CHANNEL_ORDER: self.channel_order,
+        }
+
+    @classmethod
+    def from_headers(cls, headers: Dict[str, str]) -> "RawImageFormat":
+        info = {"shape": tuple(int(el) for el in headers.get(cls.HEADER_SHAPE, "").split(",") if el.strip())}
+        if cls.HEADER_DTYPE in headers:
+            info["dtype"] = headers[cls.HEADER_DTYPE].lower()
+        if cls.HEADER_CHANNEL_ORDER in headers:
+            info["channel_order"] = headers[cls.HEADER_CHANNEL_ORDER].upper()
+        return cls(**info)
+
+
 # ----- Camera
 class CameraInfo(BaslerCameraSettings):
     url: Union[str, Path]
@@ -57,6 +106,8 @@ class ReturnValuesMain(Flag):
 class SettingsMain(BaseModel):
     pattern_key: Optional[str] = None
     min_score: Optional[Annotated[float, Field(strict=False, le=1, ge=0)]] = 0.5
+    class_scores: Optional[str] = None  # minimum score per class id, e.g. "0:0.6,3:0.4"
+    top_k: Optional[Annotated[int, Field(strict=False, ge=1)]] = None  # maximum number of objects (highest scores)
     return_options: Optional[Annotated[int, Field(strict=False, le=int(~ReturnValuesMain(0)), ge=0)]] = int(~ReturnValuesMain(0))
     token: Optional[str] = None
 
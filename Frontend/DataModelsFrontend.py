@@ -8,7 +8,7 @@ from typing import Optional, Tuple
 
 class AppSettings(BaseModel):
     address_backend: str
-    timeout: Optional[int] = 10000  # ms?
+    timeout: Optional[int] = 10000  # ms
     data_folder: Path
     impress: Optional[ImpressInfo] = None
     title: Optional[str] = None
@@ -9,7 +9,7 @@ import logging
 
 from DataModels import ReturnValuesMain, SettingsMain
 from DataModels_BaslerCameraAdapter import BaslerCameraSettings, ImageParams
-from utils import create_auth_headers
+from utils import create_auth_headers, create_deadline_headers
 
 
 def build_url(
@@ -40,16 +40,17 @@ def request_backend(
         camera_params: BaslerCameraSettings,
         image_params: ImageParams,
         settings: SettingsMain,
-        timeout: int = 1000,
+        timeout: int = 1000,  # ms
         token: str = None
 ) -> Union[Dict[str, Any], None]:
 
     url = build_url(address, camera_params, image_params, settings)  # TODO: can be cached
-    headers = create_auth_headers(token)
+    # the backend drops the request once the timeout has passed (deadline)
+    headers = (create_auth_headers(token) or dict()) | create_deadline_headers(timeout / 1000)
     logging.debug(f"Request backend: GET {url}, headers={headers} ")
 
     t0 = default_timer()
-    response = requests.get(url=url, timeout=timeout, headers=create_auth_headers(token))
+    response = requests.get(url=url, timeout=timeout / 1000, headers=headers)
     status_code = response.status_code
 
     logging.info(
@@ -50,6 +50,7 @@ def get_config_from_environment_variables() -> Tuple[BaslerCameraSettings, Image
 
     app_settings = AppSettings(
         address_backend=config["BACKEND_URL_BACKEND"],
+        timeout=config["BACKEND_TIMEOUT"] if "BACKEND_TIMEOUT" in config else 10000,
         data_folder=config["GENERAL_DATA_FOLDER"],
         impress=impress,
         title=config["GENERAL_TITLE"] if "GENERAL_TITLE" in config else None,
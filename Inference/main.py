@@ -1,13 +1,16 @@
 # from fastapi_offline import FastAPIOffline as FastAPI
-from fastapi import File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
-import uvicorn
-from prometheus_client import Counter, Gauge
+from fastapi import File, UploadFile, HTTPException, Query, Request, Depends, WebSocket, WebSocketDisconnect, status
+from pydantic import ValidationError
+from fastapi.responses import JSONResponse, Response
+from prometheus_client import Counter, Gauge, Histogram
 
-from pathlib import Path
 import numpy as np
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Event, Thread
 
-import onnxruntime as ort
+from typing import Union, Optional, List, Tuple, Dict, Callable, Mapping
 
 from timeit import default_timer
 
@@ -16,14 +19,39 @@ from utils import get_config, setup_logging, set_env_variable, default_from_env
 from utils_fastapi import (
     default_fastapi_setup,
     setup_prometheus_metrics,
-    AccessToken
+    setup_stage_metrics,
+    setup_admission_control,
+    setup_cancellation,
+    request_metrics_suppressed,
+    run_server,
+    start_workers,
+    RequestMetric,
+    RequestCancelled,
+    Deadline,
+    AccessToken,
+    WebSocketAccessToken,
+    DEFAULT_LATENCY_BUCKETS
 )
 from utils_image_cv2 import (
-    scale_coordinates_to_image_size,
+    get_letterbox_transform,
     prepare_image,
     bytes_to_image_array,
-    postprocess
+    image_array_to_bytes,
+    decode_image_reduced,
+    raw_to_image_array,
+    postprocess_batch,
+    precision_to_type,
+    get_tiles,
+    get_tiles_with_content,
+    nms_class_aware,
+    DetectionFilter,
+    BufferPool
 )
+from utils_batching import MicroBatchScheduler
+from utils_model_registry import ModelRegistry, LoadedModel
+from utils_result_cache import ResultCache
+from DataModels import RawImageFormat, InferenceFilter
+from utils_result_encoding import MEDIA_TYPE_RESULTS, accepts_binary_results, encode_results, encode_results_list
 # from utils_image import bytes_to_image_pil
 
 # Setup logging
@@ -33,125 +61,949 @@ logger = setup_logging(__name__)
 CONFIG = get_config()
 logger.debug(f"Configuration (CONFIG): {CONFIG}")
 
-# get model path from config
-model_path = Path(CONFIG["MODEL_FOLDER_DATA"]) / CONFIG["MODEL_FILENAME"]
-path_to_model_file = model_path.with_suffix(".onnx")
-logger.info(f"Loading model from {path_to_model_file} (file exists: {path_to_model_file.exists()})")
+if __name__ == "__main__":
+    # several worker processes: hand over to uvicorn before anything is loaded (the workers import "main:app")
+    start_workers("main:app", port=CONFIG.get("SERVER_PORT", 5052), workers=CONFIG.get("SERVER_WORKERS", 1))
 
-# initialize ONNX session
-ONNX_SESSION = ort.InferenceSession(
-    path_to_model_file,
-    providers=CONFIG["ONNX_PROVIDERS"] if "ONNX_PROVIDERS" in CONFIG else None
-    # https://onnxruntime.ai/docs/execution-providers/
-)
+# model registry: lazily loaded ONNX sessions (session options and optimized-model cache: [onnx] section)
+REGISTRY = ModelRegistry(CONFIG)
+# load default model on start-up
+REGISTRY.get()
+# set once the models are warmed up (/ready)
+WARMUP_DONE = Event()
+# reload models if their files change (0: disabled)
+REGISTRY.start_watching(CONFIG.get("REGISTRY_WATCH_INTERVAL", 0))
 
-# log input shapes
-input_shapes = {el.name: el.shape for el in ONNX_SESSION.get_inputs()}
-logger.debug(f"Model input(s) {input_shapes}")
+# optional: results of identical requests (cleared if a model is replaced)
+RESULT_CACHE = ResultCache(
+    max_bytes=CONFIG.get("CACHE_MAX_BYTES", 2 ** 24),
+    ttl=CONFIG.get("CACHE_TTL", 60)
+) if CONFIG.get("CACHE_ENABLED", False) else None
+if RESULT_CACHE is not None:
+    REGISTRY.on_change(lambda model: RESULT_CACHE.invalidate(model.name))
 
 # entry points
 ENTRYPOINT_INFERENCE = "/inference"
+ENTRYPOINT_INFERENCE_BATCH = ENTRYPOINT_INFERENCE + "/batch"
+ENTRYPOINT_INFERENCE_STREAM = ENTRYPOINT_INFERENCE + "/stream"
+ENTRYPOINT_MODELS = "/models"
+ENTRYPOINT_MODEL_INFERENCE = ENTRYPOINT_MODELS + "/{model_name}" + ENTRYPOINT_INFERENCE
+ENTRYPOINT_MODEL_RELOAD = ENTRYPOINT_MODELS + "/{model_name}/reload"
 
 # setup of fastAPI server
 title = "Minimal-ONNX-Inference-Server"
 summary = "Minimalistic server providing a REST api to an ONNX session."
-app = default_fastapi_setup(title, summary)
+app = default_fastapi_setup(
+    title,
+    summary,
+    home_info=lambda: {
+        "Model": {
+            ky: {"hash": vl.model_hash, "loaded": vl.datetime_loaded, "load_time_ms": round(vl.load_time * 1000, 1)}
+            for ky, vl in REGISTRY.loaded_models().items()
+        }
+    },
+    readiness=WARMUP_DONE.is_set
+)
 
 # set up /metrics endpoint for prometheus
 EXECUTION_COUNTER, EXCEPTION_COUNTER, EXECUTION_TIMING = setup_prometheus_metrics(
     app,
-    entrypoints_to_track=[ENTRYPOINT_INFERENCE]
+    entrypoints_to_track=[ENTRYPOINT_INFERENCE, ENTRYPOINT_INFERENCE_BATCH],
+    buckets=CONFIG.get("METRICS_BUCKETS", None)
 )
-# additional custom metrics
-RESULTS = dict()  # initialize with empty dictionary
-EXECUTION_TIMING["onnx"] = Gauge(
-    name="ONNX_session_execution_time",
-    documentation=f"How long did the actual ONNX session call took?"
+# latency per processing stage (inference_stage_duration_seconds{stage="..."})
+STAGE_TIMING = setup_stage_metrics(
+    "inference",
+    ["read", "decode", "preprocess", "onnx", "postprocess", "merge", "response"],
+    buckets=CONFIG.get("METRICS_BUCKETS", None)
 )
+# bounded number of requests in flight / in the queue; requests beyond fail fast with 503 (or 429) and Retry-After
+ADMISSION = setup_admission_control(
+    app,
+    "inference",
+    paths=[ENTRYPOINT_INFERENCE, ENTRYPOINT_INFERENCE_BATCH, ENTRYPOINT_MODEL_INFERENCE],
+    max_in_flight=CONFIG.get("ADMISSION_MAX_IN_FLIGHT", 0),
+    max_queue=CONFIG.get("ADMISSION_MAX_QUEUE", 0),
+    max_queue_wait=CONFIG.get("ADMISSION_MAX_QUEUE_WAIT", 1),
+    retry_after=CONFIG.get("ADMISSION_RETRY_AFTER", 1),
+    status_code=CONFIG.get("ADMISSION_STATUS_CODE", 503),
+    buckets=CONFIG.get("METRICS_BUCKETS", None)
+)
+# requests whose deadline (header X-Deadline-Ms) passed or whose client disconnected are dropped before the
+# expensive stages (inference_cancelled_requests{stage="...", reason="..."}, inference_cancelled_saved_seconds)
+CANCELLATION = setup_cancellation(app, "inference")
+WARMUP_DURATION = Gauge(
+    name="warmup_duration_seconds",
+    documentation="How long did warming up a model take (all batch sizes and image sizes)?",
+    labelnames=["model"],
+    multiprocess_mode="mostrecent"
+)
+# sliced inference of high-resolution frames ([tiling] section)
+TILING_METRICS = {
+    "tiles": RequestMetric(Histogram(
+        name="tiling_tiles_per_frame",
+        documentation="Number of tiles inferred per frame (including the full frame).",
+        buckets=(1, 2, 4, 8, 12, 16, 24, 32, 48, 64, 96, 128)
+    )),
+    "skipped": RequestMetric(Counter(
+        name="tiling_tiles_skipped",
+        documentation="Counts the tiles that were not inferred because they have no content (uniform pixels)."
+    )),
+    "duration": RequestMetric(Histogram(
+        name="tiling_frame_duration_seconds",
+        documentation="Preprocessing, session call, postprocessing, and merging of all tiles of a frame in seconds.",
+        buckets=CONFIG.get("METRICS_BUCKETS", None) or DEFAULT_LATENCY_BUCKETS
+    ))
+}
+# WebSocket stream (ENTRYPOINT_INFERENCE_STREAM)
+STREAM_METRICS = {
+    "connections": Gauge(
+        name="stream_connections",
+        documentation="Number of open WebSocket streams.",
+        multiprocess_mode="livesum"
+    ),
+    "frames": Counter(
+        name="stream_frames",
+        documentation="Counts the frames of WebSocket streams that were answered with results."
+    ),
+    "errors": Counter(
+        name="stream_frame_errors",
+        documentation="Counts the frames of WebSocket streams that could not be processed."
+    ),
+    "latency": Histogram(
+        name="stream_frame_latency_seconds",
+        documentation="Time from receiving a frame on a WebSocket stream to sending its results in seconds.",
+        buckets=CONFIG.get("METRICS_BUCKETS", None) or DEFAULT_LATENCY_BUCKETS
+    )
+}
+# additional custom metrics (one family per metric, labelled by class id)
+RESULTS = {
+    "counter": Counter(
+        name="class_predictions",
+        documentation="Counts how often a class is predicted.",
+        labelnames=["class_id"]
+    ),
+    "score_max": Gauge(
+        name="class_score_max",
+        documentation="Maximum score of a class on the latest input.",
+        labelnames=["class_id"],
+        multiprocess_mode="mostrecent"
+    ),
+    "score_min": Gauge(
+        name="class_score_min",
+        documentation="Minimum score of a class on the latest input.",
+        labelnames=["class_id"],
+        multiprocess_mode="mostrecent"
+    )
+}
+
+# dedicated executor for decoding, preprocessing, and the ONNX session so that the event loop stays responsive
+EXECUTOR = ThreadPoolExecutor(
+    max_workers=CONFIG.get("EXECUTOR_MAX_WORKERS", 4),
+    thread_name_prefix="inference"
+)
+# limit the number of parallel session calls to avoid oversubscribing ORT's intra-op threads
+INFERENCE_SEMAPHORE = BoundedSemaphore(CONFIG.get("EXECUTOR_MAX_CONCURRENT_INFERENCES", 1))
+
+
+# reusable model-input tensors
+BUFFER_POOL = BufferPool()
+
+
+async def run_in_executor(func: Callable, *args, deadline: Deadline = None, stage: str = None):
+    if deadline is not None:
+        # checked when the executor starts the job: the executor may have a backlog
+        return await asyncio.get_running_loop().run_in_executor(EXECUTOR, run_checked, deadline, stage, func, *args)
+    return await asyncio.get_running_loop().run_in_executor(EXECUTOR, func, *args)
+
+
+def run_checked(deadline: Deadline, stage: str, func: Callable, *args):
+    deadline.check(stage)
+    return func(*args)
+
+
+async def get_model(name: str = None) -> LoadedModel:
+    model = REGISTRY.get_loaded(name)
+    if model is None:
+        try:
+            # loading blocks, i.e. do it in the executor
+            model = await run_in_executor(REGISTRY.get, name)
+        except KeyError as ex:
+            raise HTTPException(status_code=404, detail=ex.args[0])
+    return model
+
+
+def decode_and_prepare_image(
+        image_bytes: bytes,
+        model: LoadedModel,
+        out: np.ndarray = None
+) -> Tuple[np.ndarray, np.ndarray, Tuple[int, int]]:
+    # keep OpenCV's BGR format; the channels are swapped while preparing the model input
+    with STAGE_TIMING["decode"].time():
+        if CONFIG.get("MODEL_REDUCED_DECODING", True):
+            # decode large JPEGs directly at a reduced resolution that still covers the model input
+            img, shape_src = decode_image_reduced(
+                image_bytes,
+                model.settings.image_size,
+                model.settings.keep_aspect_ratio,
+                rgb=False
+            )
+        else:
+            img = bytes_to_image_array(image_bytes, rgb=False)
+            shape_src = img.shape[:2]
+    logger.debug(f"Image received: {shape_src} (decoded {img.shape})")
+    return img, prepare_model_input(img, model, bgr=True, out=out), shape_src
+
+
+def decode_image(image_bytes: bytes) -> np.ndarray:
+    # full resolution (tiles)
+    with STAGE_TIMING["decode"].time():
+        img = bytes_to_image_array(image_bytes, rgb=False)
+    if img is None:
+        raise ValueError("Image could not be decoded.")
+    return img
+
+
+def prepare_model_input(img: np.ndarray, model: LoadedModel, bgr: bool, out: np.ndarray = None) -> np.ndarray:
+    # preprocess image (into `out`, e.g. a slice of a batch tensor; otherwise the tensor is taken from BUFFER_POOL and
+    # must be released after the session call)
+    with STAGE_TIMING["preprocess"].time():
+        img_mdl = prepare_image(
+            img,
+            model.settings.image_size,
+            model.settings.precision,
+            bgr=bgr,
+            buffer_pool=BUFFER_POOL if out is None else None,
+            keep_ratio=model.settings.keep_aspect_ratio,
+            out=out
+        )
+    logger.debug(f"Image shape, config: {model.settings.image_size}, prepared {img_mdl.shape}")
+    return img_mdl
+
+
+def acquire_batch_input(model: LoadedModel, batch_size: int) -> np.ndarray:
+    """Model input tensor of a batch from BUFFER_POOL (release it after the session call); images go into slices."""
+    return BUFFER_POOL.acquire((batch_size, 3, *model.settings.image_size), precision_to_type(model.settings.precision))
+
+
+def prepare_tiles(img: np.ndarray, model: LoadedModel, bgr: bool) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Tiles of the image with content (and the full frame if configured) as one batch tensor (taken from BUFFER_POOL,
+    release it after the session call). Returns the tensor and the tile regions [x0, y0, x1, y1].
+    """
+    height, width = img.shape[:2]
+    tiles = get_tiles(
+        (height, width),
+        CONFIG.get("TILING_TILE_SIZE", None) or model.settings.image_size,
+        CONFIG.get("TILING_OVERLAP", 0.2)
+    )
+    min_std = CONFIG.get("TILING_MIN_STD", 0.01)
+    if min_std > 0:
+        n_tiles = len(tiles)
+        tiles = tiles[get_tiles_with_content(img, tiles, min_std)]
+        TILING_METRICS["skipped"].inc(n_tiles - len(tiles))
+    if CONFIG.get("TILING_FULL_FRAME", True) and (len(tiles) != 1 or tuple(tiles[0]) != (0, 0, width, height)):
+        # large objects
+        tiles = np.concatenate([tiles, [[0, 0, width, height]]], axis=0)
+
+    with STAGE_TIMING["preprocess"].time():
+        img_mdl = acquire_batch_input(model, len(tiles))
+        for i, (x0, y0, x1, y1) in enumerate(tiles):
+            prepare_image(
+                img[y0:y1, x0:x1],
+                model.settings.image_size,
+                model.settings.precision,
+                bgr=bgr,
+                keep_ratio=model.settings.keep_aspect_ratio,
+                out=img_mdl[i:(i + 1)]
+            )
+    logger.debug(f"Tiles of image {img.shape}: {len(tiles)}, prepared {img_mdl.shape}")
+    return img_mdl, tiles
+
+
+def run_tiled_inference(
+        img: np.ndarray,
+        model: LoadedModel,
+        detection_filter: DetectionFilter,
+        bgr: bool,
+        deadline: Deadline = None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Sliced inference: all tiles in one session call; the boxes (in pixels of `img`) are merged by NMS."""
+    t0 = default_timer()
+    img_mdl, tiles = prepare_tiles(img, model, bgr)
+    try:
+        results = run_inference(img_mdl, model, detection_filter, deadline) if len(tiles) > 0 else []
+    finally:
+        BUFFER_POOL.release(img_mdl)
+
+    with STAGE_TIMING["merge"].time():
+        # map the boxes of each tile to the image
+        bboxes = [np.zeros((0, 4), dtype=np.float32)] + [
+            get_letterbox_transform(
+                (y1 - y0, x1 - x0),
+                model.settings.image_size,
+                model.settings.keep_aspect_ratio
+            ).inverse(res[0]) + np.array([x0, y0, x0, y0], dtype=np.float32)
+            for (x0, y0, x1, y1), res in zip(tiles, results)
+        ]
+        bboxes = np.concatenate(bboxes, axis=0)
+        class_ids = np.concatenate([np.zeros(0, dtype=int)] + [res[1] for res in results]).astype(int)
+        scores = np.concatenate([np.zeros(0, dtype=np.float32)] + [res[2] for res in results])
+        # boxes of overlapping tiles (and of the full frame): class-aware NMS
+        keep = nms_class_aware(bboxes, class_ids, scores, model.settings.th_iou)
+        keep = keep[:detection_filter.limit(model.settings.max_detections)]
+    TILING_METRICS["tiles"].observe(len(tiles))
+    TILING_METRICS["duration"].observe(default_timer() - t0)
+    return bboxes[keep], class_ids[keep], scores[keep]
+
+
+def get_raw_image_format(headers: Mapping[str, str]) -> RawImageFormat:
+    """Shape, dtype, and channel order of an uncompressed frame (headers X-Image-Shape, ...)."""
+    try:
+        return RawImageFormat.from_headers(headers)
+    except (ValidationError, ValueError) as ex:
+        raise HTTPException(status_code=400, detail=f"Invalid raw image: {ex}")
+
+
+def read_raw_image(raw_format: RawImageFormat, body: bytes) -> Tuple[np.ndarray, bool]:
+    """Uncompressed frame (e.g. application/octet-stream body)."""
+    try:
+        # the pixels are wrapped without copy
+        img = raw_to_image_array(body, raw_format.shape, raw_format.dtype)
+    except ValueError as ex:
+        raise HTTPException(status_code=400, detail=f"Invalid raw image: {ex}")
+    logger.debug(f"Raw image received: {img.shape} ({raw_format.channel_order})")
+    return img, raw_format.channel_order == "BGR"
+
+
+def rescale_boxes(
+        bboxes: np.ndarray,
+        shape_img: Tuple[int, int],
+        model: LoadedModel,
+        shape_src: Tuple[int, int] = None
+) -> np.ndarray:
+    # inverse of the (cached) letterbox transformation that was used to prepare the image
+    transform = get_letterbox_transform(
+        shape_img,
+        model.settings.image_size,
+        model.settings.keep_aspect_ratio
+    )
+    bboxes = transform.inverse(bboxes)
+    # image was decoded at a reduced resolution: scale to the original resolution
+    if shape_src is not None and tuple(shape_src[:2]) != tuple(shape_img[:2]):
+        bboxes *= np.tile([shape_src[1] / shape_img[1], shape_src[0] / shape_img[0]], 2).astype(np.float32)
+    return bboxes
+
+
+def run_onnx_session(img_mdl: np.ndarray, model: LoadedModel, deadline: Deadline = None) -> List[np.ndarray]:
+    with INFERENCE_SEMAPHORE:
+        if deadline is not None:
+            # the session calls may have a backlog (max_concurrent_inferences)
+            deadline.check("onnx")
+        with STAGE_TIMING["onnx"].time():
+            results = model.run(img_mdl)
+    return results
+
+
+def get_inference_filter(
+        min_score: Optional[float] = Query(
+            None, ge=0, le=1, description="Minimum score of all classes (default: th_score of the model)."
+        ),
+        class_scores: Optional[str] = Query(
+            None, description="Minimum score per class id, e.g. '0:0.6,3:0.4' (overrides min_score)."
+        ),
+        classes: Optional[List[int]] = Query(
+            None, description="Class ids to keep (repeat the parameter for several classes; default: all)."
+        ),
+        top_k: Optional[int] = Query(None, ge=1, description="Maximum number of boxes (highest scores) per image.")
+) -> InferenceFilter:
+    try:
+        return InferenceFilter(
+            min_score=min_score,
+            class_scores=InferenceFilter.parse_class_scores(class_scores),
+            classes=classes,
+            top_k=top_k
+        )
+    except (ValidationError, ValueError) as ex:
+        raise HTTPException(status_code=400, detail=f"Invalid result filter: {ex}")
+
+
+def get_detection_filter(inference_filter: Union[InferenceFilter, None], model: LoadedModel) -> DetectionFilter:
+    if inference_filter is None:
+        inference_filter = InferenceFilter()
+    return DetectionFilter(
+        model.settings.th_score if inference_filter.min_score is None else inference_filter.min_score,
+        class_scores=inference_filter.class_scores,
+        classes=inference_filter.classes,
+        top_k=inference_filter.top_k,
+        th_model=model.settings.th_score
+    )
+
+
+def run_inference(
+        img_mdl: np.ndarray,
+        model: LoadedModel,
+        detection_filter: Union[DetectionFilter, List[DetectionFilter]] = None,
+        deadline: Deadline = None
+) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    # session call and postprocessing run in the same thread: the (reused) output buffers of the IOBinding are
+    # consumed before the next session call of this thread
+    results = run_onnx_session(img_mdl, model, deadline)
+    logger.debug(f"len(results)={len(results)}; results[0].shape={results[0].shape}")
+    with STAGE_TIMING["postprocess"].time():
+        return postprocess_batch(
+            results,
+            model.settings.th_score if detection_filter is None else detection_filter,
+            img_mdl.shape[0],
+            output_format=model.settings.output_format,
+            th_iou=model.settings.th_iou,
+            max_detections=model.settings.max_detections
+        )
+
+
+# optional: dynamic micro-batching of concurrent requests (one scheduler per model)
+BATCH_SCHEDULERS: Dict[str, MicroBatchScheduler] = dict()
+
+
+def get_batch_scheduler(name: str) -> Union[MicroBatchScheduler, None]:
+    if not CONFIG.get("BATCHING_ENABLED", False):
+        return None
+
+    def run_batch(img_mdl: np.ndarray, inference_filters: List[InferenceFilter]):
+        # resolve the model when the batch is executed (it might have been evicted in the meantime)
+        model = REGISTRY.get(name)
+        # every image of the batch is filtered as requested by its caller
+        return run_inference(img_mdl, model, [get_detection_filter(el, model) for el in inference_filters])
+
+    if name not in BATCH_SCHEDULERS:
+        BATCH_SCHEDULERS[name] = MicroBatchScheduler(
+            run_batch,
+            max_batch_size=CONFIG.get("BATCHING_MAX_BATCH_SIZE", 8),
+            max_wait_ms=CONFIG.get("BATCHING_MAX_WAIT_MS", 5),
+            executor=EXECUTOR,
+            name=name
+        )
+    return BATCH_SCHEDULERS[name]
+
+
+def warm_up(
+        model: LoadedModel,
+        batch_size: int = 1,
+        image_size: Tuple[int, int] = None,
+        max_iterations: int = 10,
+        tolerance: float = 0.1
+) -> int:
+    """
+    Runs the request path (decoding, preprocessing, session call, postprocessing) on a synthetic JPEG until two
+    consecutive runs differ by less than `tolerance` (ORT's lazy allocations, memory arena, OpenCV's thread pool).
+    Returns the number of runs.
+    """
+    height, width = image_size if image_size else model.settings.image_size
+    img = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    image_bytes = image_array_to_bytes(img)
+
+    def run_once():
+        if CONFIG.get("TILING_ENABLED", False):
+            # the tiles of a frame form the batch
+            for _ in range(batch_size):
+                run_tiled_inference(decode_image(image_bytes), model, get_detection_filter(None, model), bgr=True)
+            return
+
+        img_mdl = acquire_batch_input(model, batch_size)
+        try:
+            prepared = [decode_and_prepare_image(image_bytes, model, img_mdl[i:i + 1]) for i in range(batch_size)]
+            results = run_inference(img_mdl, model)
+        finally:
+            BUFFER_POOL.release(img_mdl)
+        for (img_, _, shape_src), (bboxes, _, _) in zip(prepared, results):
+            rescale_boxes(bboxes, img_.shape[:2], model, shape_src)
+
+    dt_prev = None
+    for i in range(max(int(max_iterations), 1)):
+        t0 = default_timer()
+        run_once()
+        dt = default_timer() - t0
+        logger.debug(f"Warm-up '{model.name}' (batch size {batch_size}, image {height}x{width}): run {i} took {dt * 1000:.4g} ms")
+
+        if dt_prev is not None and abs(dt - dt_prev) <= tolerance * dt_prev:
+            return i + 1
+        dt_prev = dt
+    return max(int(max_iterations), 1)
+
+
+def warm_up_models() -> None:
+    """
+    Warms up the configured models for all batch sizes and image sizes; sets WARMUP_DONE afterwards. If the warm-up
+    fails (e.g. the model cannot run), the service is not reported as ready. The synthetic requests are not recorded
+    in the request metrics.
+    """
+    def as_list(value) -> list:
+        # (environment variables may provide a single value instead of a list)
+        return value if isinstance(value, (list, tuple)) else [value]
+
+    try:
+        batch_sizes = set(as_list(CONFIG.get("WARMUP_BATCH_SIZES", None) or 1))
+        if CONFIG.get("BATCHING_ENABLED", False):
+            batch_sizes.add(CONFIG.get("BATCHING_MAX_BATCH_SIZE", 8))
+        image_sizes = CONFIG.get("WARMUP_IMAGE_SIZES", None) or [None]
+        if isinstance(image_sizes[0], int):
+            # a single image size [height, width]
+            image_sizes = [image_sizes]
+
+        for name in as_list(CONFIG.get("WARMUP_MODELS", None) or REGISTRY.default_name):
+            t0 = default_timer()
+            model = REGISTRY.get(name)
+            for batch_size in sorted(batch_sizes):
+                for image_size in image_sizes:
+                    with request_metrics_suppressed():
+                        n = warm_up(
+                            model,
+                            batch_size,
+                            image_size,
+                            max_iterations=CONFIG.get("WARMUP_MAX_ITERATIONS", 10),
+                            tolerance=CONFIG.get("WARMUP_TOLERANCE", 0.1)
+                        )
+                    logger.debug(f"Warm-up '{name}' (batch size {batch_size}, image size {image_size}): {n} runs")
+            dt = default_timer() - t0
+            WARMUP_DURATION.labels(model=name).set(dt)
+            logger.info(f"Model '{name}' warmed up in {dt * 1000:.4g} ms.")
+    except Exception as ex:
+        # /ready keeps reporting "not ready": no traffic should be routed to a model that cannot run
+        logger.exception(f"Warm-up failed; the service is not reported as ready: {ex}")
+        return
+    WARMUP_DONE.set()
+
+
+@app.get(ENTRYPOINT_MODELS)
+async def list_models(token = AccessToken):
+    loaded = REGISTRY.loaded_models()
+    return {
+        "default": REGISTRY.default_name,
+        "available": REGISTRY.available_models(),
+        "loaded": {ky: vl.info() for ky, vl in loaded.items()}
+    }
+
+
+@app.post(ENTRYPOINT_MODEL_RELOAD)
+async def reload_model(model_name: str, token = AccessToken):
+    # build and warm the new session in the executor; it is swapped in once it is ready
+    try:
+        model = await run_in_executor(REGISTRY.reload, model_name)
+    except KeyError as ex:
+        raise HTTPException(status_code=404, detail=ex.args[0])
+    except Exception as ex:
+        msg = f"Reloading model '{model_name}' failed; the active version is kept: {ex}"
+        logger.error(msg)
+        raise HTTPException(status_code=500, detail=msg)
+    return model.info()
+
 
 @app.post(ENTRYPOINT_INFERENCE)
 # Decorators do not work for async functions
-async def predict(image: UploadFile = File(...), token = AccessToken):
+async def predict(
+        request: Request,
+        image: UploadFile = File(None, description="Image file. Alternatively, send an uncompressed frame as "
+                                                   "application/octet-stream body (headers X-Image-Shape, "
+                                                   "X-Image-Dtype, X-Image-Channel-Order)."),
+        model: Optional[str] = Query(None, description="Name of the model (default model if not provided)."),
+        inference_filter: InferenceFilter = Depends(get_inference_filter),
+        token = AccessToken
+):
+    return await _predict(request, image, model, inference_filter)
+
+
+@app.post(ENTRYPOINT_MODEL_INFERENCE)
+async def predict_with_model(
+        model_name: str,
+        request: Request,
+        image: UploadFile = File(None),
+        inference_filter: InferenceFilter = Depends(get_inference_filter),
+        token = AccessToken
+):
+    return await _predict(request, image, model_name, inference_filter)
+
+
+async def infer(
+        image_bytes: bytes,
+        model: LoadedModel,
+        inference_filter: InferenceFilter,
+        raw_format: RawImageFormat = None,
+        deadline: Deadline = None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Decoding (or wrapping an uncompressed frame), preprocessing, session call (batched if enabled; tiles if
+    enabled), and postprocessing of one image. Returns the results with the boxes in pixels of the original image.
+    With a `deadline`, the remaining stages are dropped (RequestCancelled) once nobody waits for the results.
+    """
+    if deadline is not None:
+        await deadline.check_async("decode")
+
+    if CONFIG.get("TILING_ENABLED", False):
+        # the tiles need the full resolution, i.e. no reduced decoding; the tiles of a frame form a batch
+        if raw_format is not None:
+            img, bgr = read_raw_image(raw_format, image_bytes)
+        else:
+            img, bgr = await run_in_executor(decode_image, image_bytes, deadline=deadline, stage="decode"), True
+        if deadline is not None:
+            await deadline.check_async("onnx")
+        return await run_in_executor(
+            run_tiled_inference,
+            img,
+            model,
+            get_detection_filter(inference_filter, model),
+            bgr,
+            deadline
+        )
+
+    if raw_format is not None:
+        # uncompressed frame: no decoding
+        img, bgr = read_raw_image(raw_format, image_bytes)
+        img_mdl = await run_in_executor(prepare_model_input, img, model, bgr, deadline=deadline, stage="decode")
+        shape_src = img.shape[:2]
+    else:
+        # decode and preprocess image
+        img, img_mdl, shape_src = await run_in_executor(
+            decode_and_prepare_image, image_bytes, model, deadline=deadline, stage="decode"
+        )
+
+    t1 = default_timer()
+    try:
+        if deadline is not None:
+            await deadline.check_async("onnx")
+        batch_scheduler = get_batch_scheduler(model.name)
+        if batch_scheduler is not None:
+            # the scheduler returns the results of this image only
+            results = await batch_scheduler.submit(img_mdl, inference_filter, deadline)
+        else:
+            results, = await run_in_executor(
+                run_inference,
+                img_mdl,
+                model,
+                get_detection_filter(inference_filter, model),
+                deadline
+            )
+    finally:
+        BUFFER_POOL.release(img_mdl)
+    logger.debug(f"Inference took {(default_timer() - t1) * 1000:.3g} ms.")
+
+    bboxes, class_ids, scores = results
+    # re-scale boxes
+    logger.debug(f"Rescale boxes to original image size: img.shape={img.shape}, shape_src={shape_src}")
+    return rescale_boxes(bboxes, img.shape[:2], model, shape_src), class_ids, scores
+
+
+async def _predict(
+        request: Request,
+        image: Union[UploadFile, None],
+        model_name: Union[str, None],
+        inference_filter: InferenceFilter
+) -> Response:
     t0 = default_timer()
-    logger.debug(f"call {ENTRYPOINT_INFERENCE}")
+    logger.debug(f"call {ENTRYPOINT_INFERENCE} (model={model_name})")
+    # the caller gives up after the deadline (header X-Deadline-Ms)
+    deadline = CANCELLATION.deadline(request.headers, request.is_disconnected)
     # increment counter for /metrics endpoint
     EXECUTION_COUNTER[ENTRYPOINT_INFERENCE].inc()
 
-    with EXCEPTION_COUNTER[ENTRYPOINT_INFERENCE].count_exceptions() and EXECUTION_TIMING[ENTRYPOINT_INFERENCE].time():
-        if image.content_type.split("/")[0] != "image":
+    with EXCEPTION_COUNTER[ENTRYPOINT_INFERENCE].count_exceptions(), EXECUTION_TIMING[ENTRYPOINT_INFERENCE].time():
+        raw = request.headers.get("content-type", "").split(";")[0].strip() == "application/octet-stream"
+        if not raw and (image is None or image.content_type.split("/")[0] != "image"):
             raise HTTPException(status_code=400, detail="Uploaded file is not an image.")
 
-        # wait for file transmission
-        image_bytes = await image.read()
-        img = bytes_to_image_array(image_bytes)
-        logger.debug(f"Image received: {img.shape}")
-
-        # preprocess image
-        img_mdl = prepare_image(img, CONFIG["MODEL_IMAGE_SIZE"], CONFIG["MODEL_PRECISION"])
-        logger.debug(f"Image shape, config: {CONFIG['MODEL_IMAGE_SIZE']}, prepared {img_mdl.shape}")
-
-        t1 = default_timer()
-        input_name = ONNX_SESSION.get_inputs()[0].name
-        output_name = ONNX_SESSION.get_outputs()[0].name
-        with EXECUTION_TIMING["onnx"].time():
-            results = ONNX_SESSION.run(
-                output_names=[output_name],
-                input_feed={input_name: img_mdl}
+        model = await get_model(model_name)
+
+        # wait for transmission
+        with STAGE_TIMING["read"].time():
+            image_bytes = await (request.body() if raw else image.read())
+
+        cache_key = None
+        if RESULT_CACHE is not None:
+            # same bytes (and raw image format), same model version and settings, same result filter
+            cache_key = await run_in_executor(
+                RESULT_CACHE.make_key,
+                image_bytes,
+                model.model_hash,
+                model.settings.model_dump_json(),
+                inference_filter.model_dump_json(),
+                *[request.headers.get(el) for el in (
+                    RawImageFormat.HEADER_SHAPE, RawImageFormat.HEADER_DTYPE, RawImageFormat.HEADER_CHANNEL_ORDER
+                )]
             )
-        logger.debug(f"Inference took {(default_timer() - t1) / 1000:.3g} ms.")
+            results = RESULT_CACHE.get(cache_key)
+            if results is not None:
+                update_result_metrics(*results[1:])
+                logger.debug(f"Calling {ENTRYPOINT_INFERENCE} took {(default_timer() - t0) * 1000:.3g} ms (cached).")
+                return results_response(request, [results])
 
-        logger.debug(f"len(results)={len(results)}; results[0].shape={results[0].shape}")
+        bboxes, class_ids, scores = await infer(
+            image_bytes,
+            model,
+            inference_filter,
+            get_raw_image_format(request.headers) if raw else None,
+            deadline
+        )
 
-        bboxes, class_ids, scores = postprocess(results, CONFIG["MODEL_TH_SCORE"])
+        t2 = default_timer()
+        if cache_key is not None:
+            RESULT_CACHE.put(cache_key, model.name, (bboxes, class_ids, scores))
 
-        # re-scale boxes
-        logger.debug(f"Rescale boxes to original image size: img_mdl.shape={img_mdl.shape}, img.shape={img.shape}")
-        bboxes = scale_coordinates_to_image_size(bboxes, img_mdl.shape[2:], img.shape[:2])
+        # update metrics
+        update_result_metrics(class_ids, scores)
 
+        # package return values
+        response = results_response(request, [(bboxes, class_ids, scores)])
+        STAGE_TIMING["response"].observe(default_timer() - t2)
+        deadline.finished()
+        logger.debug(f"Calling {ENTRYPOINT_INFERENCE} took {(default_timer() - t0) * 1000:.3g} ms.")
+    return response
+
+
+@app.post(ENTRYPOINT_INFERENCE_BATCH)
+async def predict_batch(
+        request: Request,
+        images: List[UploadFile] = File(...),
+        model: Optional[str] = Query(None, description="Name of the model (default model if not provided)."),
+        inference_filter: InferenceFilter = Depends(get_inference_filter),
+        token = AccessToken
+):
+    t0 = default_timer()
+    logger.debug(f"call {ENTRYPOINT_INFERENCE_BATCH} with {len(images)} images")
+    deadline = CANCELLATION.deadline(request.headers, request.is_disconnected)
+    # increment counter for /metrics endpoint
+    EXECUTION_COUNTER[ENTRYPOINT_INFERENCE_BATCH].inc()
+
+    with EXCEPTION_COUNTER[ENTRYPOINT_INFERENCE_BATCH].count_exceptions(), EXECUTION_TIMING[ENTRYPOINT_INFERENCE_BATCH].time():
+        if any(el.content_type.split("/")[0] != "image" for el in images):
+            raise HTTPException(status_code=400, detail="At least one uploaded file is not an image.")
+
+        model_ = await get_model(model)
+
+        # wait for file transmission
+        with STAGE_TIMING["read"].time():
+            images_bytes = [await el.read() for el in images]
+        if CONFIG.get("TILING_ENABLED", False):
+            # the tiles of each image form a batch of their own
+            results_rescaled = await asyncio.gather(*[
+                infer(el, model_, inference_filter, deadline=deadline) for el in images_bytes
+            ])
+            t2 = default_timer()
+        else:
+            # decode and preprocess images in parallel (into the slices of one batch tensor)
+            await deadline.check_async("decode")
+            img_mdl = acquire_batch_input(model_, len(images_bytes))
+            try:
+                prepared = await asyncio.gather(*[
+                    run_in_executor(
+                        decode_and_prepare_image, el, model_, img_mdl[i:i + 1], deadline=deadline, stage="decode"
+                    ) for i, el in enumerate(images_bytes)
+                ], return_exceptions=True)
+                # (all images are processed before the tensor is released, even if one of them failed)
+                for el in prepared:
+                    if isinstance(el, BaseException):
+                        raise el
+                imgs = [el[0] for el in prepared]
+                shapes_src = [el[2] for el in prepared]
+
+                # one session call for all images
+                t1 = default_timer()
+                await deadline.check_async("onnx")
+                results = await run_in_executor(
+                    run_inference,
+                    img_mdl,
+                    model_,
+                    get_detection_filter(inference_filter, model_),
+                    deadline
+                )
+            finally:
+                BUFFER_POOL.release(img_mdl)
+            logger.debug(f"Inference of {len(imgs)} images took {(default_timer() - t1) * 1000:.3g} ms.")
+
+            t2 = default_timer()
+            # re-scale boxes
+            results_rescaled = [
+                (rescale_boxes(bboxes, img.shape[:2], model_, shape_src), class_ids, scores)
+                for img, shape_src, (bboxes, class_ids, scores) in zip(imgs, shapes_src, results)
+            ]
         # update metrics
-        for cls in class_ids:
-            if cls not in RESULTS:
-                # initialize on the fly
-                RESULTS[cls] = {
-                    "counter": Counter(
-                        name=f"class_{cls}_predictions",
-                        documentation=f"Counts how often class {cls} is predicted."
-                    ),
-                    "score_max": Gauge(
-                        name=f"class_{cls}_score_max",
-                        documentation=f"Maximum score for class {cls} on latest input."
-                    ),
-                    "score_min": Gauge(
-                        name=f"class_{cls}_score_min",
-                        documentation=f"Minium score for class {cls} on latest input."
+        for _, class_ids, scores in results_rescaled:
+            update_result_metrics(class_ids, scores)
+        # package return values (in input order)
+        response = results_response(request, results_rescaled, batch=True)
+        STAGE_TIMING["response"].observe(default_timer() - t2)
+        deadline.finished()
+        logger.debug(f"Calling {ENTRYPOINT_INFERENCE_BATCH} took {(default_timer() - t0) * 1000:.3g} ms.")
+    return response
+
+
+@app.websocket(ENTRYPOINT_INFERENCE_STREAM)
+async def predict_stream(
+        websocket: WebSocket,
+        model: Optional[str] = Query(None, description="Name of the model (default model if not provided)."),
+        binary: bool = Query(False, description=f"Send the results binary encoded ({MEDIA_TYPE_RESULTS})."),
+        inference_filter: InferenceFilter = Depends(get_inference_filter),
+        token = WebSocketAccessToken
+):
+    """
+    Continuous frame feed: every binary message is a frame (encoded image; uncompressed after a text message with the
+    raw image format, e.g. {"shape": [1080, 1440, 3], "dtype": "uint8", "channel_order": "BGR"}; {} switches back).
+    The results are sent in the order of the frames (JSON with the frame index, or binary encoded); a frame that
+    cannot be processed is answered by a JSON text message {"frame": i, "error": "..."}.
+    At most [stream] max_in_flight frames are processed at once; further frames are not read until results were sent.
+    Every frame passes the admission control of /inference (rejected frames are answered by an error with
+    "retry_after") and has the deadline of the header X-Deadline-Ms on connect, counted from its arrival.
+    """
+    model_ = await get_model(model)
+    # the raw image format may also be set on connect (headers X-Image-Shape, ...)
+    raw_format = get_raw_image_format(websocket.headers) if RawImageFormat.HEADER_SHAPE in websocket.headers else None
+    binary = binary or accepts_binary_results(websocket.headers.get("accept"))
+
+    await websocket.accept()
+    STREAM_METRICS["connections"].inc()
+    logger.debug(f"call {ENTRYPOINT_INFERENCE_STREAM} (model={model_.name})")
+
+    in_flight = asyncio.Semaphore(CONFIG.get("STREAM_MAX_IN_FLIGHT", 4))
+    # (frame index, time received, deadline, task; None if rejected by the admission control) in order of arrival;
+    # None: end of stream
+    pending: asyncio.Queue = asyncio.Queue()
+    disconnected = False
+
+    async def is_disconnected() -> bool:
+        return disconnected
+
+    async def receive_frames() -> Union[str, None]:
+        """Reads frames until the client disconnects; returns the reason to close the stream otherwise."""
+        nonlocal raw_format, disconnected
+        i = 0
+        try:
+            while True:
+                # backpressure: stop reading while the maximum number of frames is processed
+                await in_flight.acquire()
+                message = await websocket.receive()
+                t0 = default_timer()
+                if message["type"] == "websocket.disconnect":
+                    disconnected = True
+                    return None
+                if message.get("text") is not None:
+                    in_flight.release()
+                    try:
+                        fmt = json.loads(message["text"])
+                        raw_format = RawImageFormat(**fmt) if fmt else None
+                    except (ValidationError, ValueError, TypeError) as ex:
+                        return f"Invalid raw image format: {ex}"
+                    continue
+                # every frame has the deadline of the connection (header X-Deadline-Ms) from its arrival on and
+                # passes the same admission control as a request to /inference
+                deadline = CANCELLATION.deadline(websocket.headers, is_disconnected)
+                task = None
+                if ADMISSION is None or await ADMISSION.acquire():
+                    task = asyncio.ensure_future(
+                        infer(message["bytes"], model_, inference_filter, raw_format, deadline=deadline)
                     )
-                }
-            # increment counter
-            RESULTS[cls]["counter"].inc()
+                pending.put_nowait((i, t0, deadline, task))
+                i += 1
+        finally:
+            pending.put_nowait(None)
 
-        for cls in np.unique(class_ids):
-            # slice scores
-            lg = class_ids == cls
-            RESULTS[cls]["score_max"].set(scores[lg].max())
-            RESULTS[cls]["score_min"].set(scores[lg].min())
+    def release(task: Union[asyncio.Future, None]) -> None:
+        if task is not None and ADMISSION is not None:
+            ADMISSION.release()
+        in_flight.release()
+
+    receiver = asyncio.ensure_future(receive_frames())
+    connected = True
+    try:
+        while (item := await pending.get()) is not None:
+            i, t0, deadline, task = item
+            try:
+                completed = False
+                try:
+                    if task is None:
+                        message = {"text": json.dumps({
+                            "frame": i, "error": "Server is saturated, retry later.", "retry_after": ADMISSION.retry_after
+                        })}
+                    else:
+                        bboxes, class_ids, scores = await task
+                        update_result_metrics(class_ids, scores)
+                        message = {"bytes": encode_results(bboxes, class_ids, scores)} if binary else \
+                            {"text": json.dumps({"frame": i, **package_results(bboxes, class_ids, scores)})}
+                        completed = True
+                        STREAM_METRICS["frames"].inc()
+                except RequestCancelled as ex:
+                    # deadline of the frame passed (counted by inference_cancelled_requests)
+                    message = {"text": json.dumps({"frame": i, "error": str(ex)})}
+                except (HTTPException, ValueError) as ex:
+                    # invalid frame (e.g. not decodable)
+                    STREAM_METRICS["errors"].inc()
+                    message = {"text": json.dumps({"frame": i, "error": getattr(ex, "detail", str(ex))})}
+                except Exception as ex:
+                    logger.exception(f"{ENTRYPOINT_INFERENCE_STREAM}: frame {i} failed: {ex}")
+                    STREAM_METRICS["errors"].inc()
+                    message = {"text": json.dumps({"frame": i, "error": "Internal server error"})}
+
+                if connected:
+                    try:
+                        await websocket.send({"type": "websocket.send", **message})
+                        STREAM_METRICS["latency"].observe(default_timer() - t0)
+                        if completed:
+                            deadline.finished()
+                    except (WebSocketDisconnect, RuntimeError):
+                        # results of the remaining frames are discarded (their buffers are released by infer)
+                        connected = False
+                        disconnected = True
+            finally:
+                # the slots of a frame are released once its result was sent
+                release(task)
+        reason = await receiver
+        if reason is not None and connected:
+            # invalid control message (after answering the frames before it)
+            await websocket.close(code=status.WS_1007_INVALID_FRAME_PAYLOAD_DATA, reason=reason)
+    finally:
+        receiver.cancel()
+        # frames that were not answered (e.g. the handler was cancelled) hold slots of the admission control
+        while not pending.empty():
+            if (item := pending.get_nowait()) is not None:
+                release(item[3])
+        STREAM_METRICS["connections"].dec()
+
+
+def update_result_metrics(class_ids: np.ndarray, scores: np.ndarray) -> None:
+    classes, counts = np.unique(class_ids, return_counts=True)
+    for cls, n in zip(classes, counts):
+        label = str(cls)
+        # slice scores
+        lg = class_ids == cls
+        RESULTS["counter"].labels(class_id=label).inc(int(n))
+        RESULTS["score_max"].labels(class_id=label).set(scores[lg].max())
+        RESULTS["score_min"].labels(class_id=label).set(scores[lg].min())
 
-        # package return values
-        content = {
-            "bboxes": bboxes.round(1).tolist(),
-            "class_ids": class_ids.tolist(),
-            "scores": scores.round(3).tolist()
-        }
-        logger.debug(f"Calling {ENTRYPOINT_INFERENCE} took {(default_timer() - t0) / 1000:.3g} ms.")
-    return JSONResponse(content=content)
+
+def package_results(bboxes: np.ndarray, class_ids: np.ndarray, scores: np.ndarray) -> Dict[str, list]:
+    return {
+        "bboxes": bboxes.round(1).tolist(),
+        "class_ids": class_ids.tolist(),
+        "scores": scores.round(3).tolist()
+    }
+
+
+def results_response(
+        request: Request,
+        results: List[Tuple[np.ndarray, np.ndarray, np.ndarray]],
+        batch: bool = False
+) -> Response:
+    # content negotiation: compact binary encoding if the client accepts it (see utils_result_encoding), else JSON
+    if accepts_binary_results(request.headers.get("accept")):
+        return Response(content=encode_results_list(results), media_type=MEDIA_TYPE_RESULTS)
+
+    content = [package_results(*el) for el in results]
+    return JSONResponse(content=content if batch else content[0])
+
+
+# warm up in the background: /health responds immediately, /ready once the latency is stable
+if CONFIG.get("WARMUP_ENABLED", True):
+    Thread(target=warm_up_models, name="warm-up", daemon=True).start()
+else:
+    WARMUP_DONE.set()
 
 
 if __name__ == "__main__":
-    uvicorn.run(
-        app=app,
-        port=5052,
-        host="0.0.0.0",
-        access_log=True,
-        log_config=None,  # Uses the logging configuration in the application
-        ssl_keyfile=default_from_env("SSL_KEYFILE", None),  # "server.key"
-        ssl_certfile=default_from_env("SSL_CERTIFICATE", None),  # "server.crt"
-    )
+    run_server(app, port=CONFIG.get("SERVER_PORT", 5052))
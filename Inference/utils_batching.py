@@ -0,0 +1,151 @@
+import asyncio
+import logging
+from concurrent.futures import Executor
+from timeit import default_timer
+
+import numpy as np
+from prometheus_client import Gauge, Histogram
+
+from typing import Callable, List, Tuple, Any
+
+from utils_fastapi import Deadline, RequestCancelled
+
+
+BATCH_SIZE = Histogram(
+    name="batching_batch_size",
+    documentation="Number of images per batched ONNX session call.",
+    labelnames=["model"],
+    buckets=[1, 2, 4, 8, 16, 32, 64]
+)
+QUEUE_WAIT = Histogram(
+    name="batching_queue_wait_seconds",
+    documentation="Time a request waited in the queue until its batch was executed.",
+    labelnames=["model"]
+)
+THROUGHPUT = Gauge(
+    name="batching_throughput",
+    documentation="Achieved throughput (images per second) of the latest batched ONNX session call.",
+    labelnames=["model"],
+    multiprocess_mode="mostrecent"
+)
+
+
+class MicroBatchScheduler:
+    """
+    Collects concurrent inference requests for at most `max_wait_ms` milliseconds (or until `max_batch_size`
+    requests are queued), stacks the prepared images to a single batch, and calls the ONNX session only once.
+    `run_batch` receives the stacked images and the options of the requests (e.g. their result filters) and returns
+    one result per image of the batch (in order); every caller receives the result of its image. Requests whose
+    deadline passed (or whose client disconnected) while they were queued fail with RequestCancelled instead of
+    taking a slot of the batch.
+    """
+    def __init__(
+            self,
+            run_batch: Callable[[np.ndarray, List[Any]], List[Any]],
+            max_batch_size: int = 8,
+            max_wait_ms: float = 5,
+            executor: Executor = None,
+            name: str = ""
+    ):
+        self.run_batch = run_batch
+        self.name = name
+        # the (blocking) session call is executed in this executor (None: default executor of the event loop)
+        self.executor = executor
+        self.max_batch_size = max(int(max_batch_size), 1)
+        self.max_wait = max(float(max_wait_ms), 0) / 1000
+
+        self._queue: asyncio.Queue = None
+        self._task: asyncio.Task = None
+
+    def start(self):
+        # the queue and the worker task must be created inside the running event loop
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+            logging.info(
+                f"MicroBatchScheduler '{self.name}' started: max_batch_size={self.max_batch_size}, "
+                f"max_wait={self.max_wait * 1000:.3g} ms"
+            )
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, image: np.ndarray, options: Any = None, deadline: Deadline = None) -> Any:
+        """
+        Queue a prepared image (shape [1, C, H, W]) and wait for the results of the batch it was assigned to.
+        `options` are passed to `run_batch` along with the image. Raises RequestCancelled if the `deadline` passed
+        before the batch was executed.
+        """
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((image, options, future, default_timer(), deadline))
+        return await future
+
+    @staticmethod
+    async def _cancel_abandoned(batch: List[Tuple[np.ndarray, Any, asyncio.Future, float, Deadline]]) -> None:
+        for _, _, future, _, deadline in batch:
+            if deadline is None or future.done():
+                continue
+            try:
+                await deadline.check_async("onnx")
+            except RequestCancelled as ex:
+                future.set_exception(ex)
+
+    async def _collect(self) -> List[Tuple[np.ndarray, Any, asyncio.Future, float, Deadline]]:
+        # block until the first request arrives
+        batch = [await self._queue.get()]
+        t_deadline = default_timer() + self.max_wait
+        # fill up batch until it is full or the waiting time is exceeded
+        while len(batch) < self.max_batch_size:
+            timeout = t_deadline - default_timer()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _loop(self):
+        while True:
+            batch = await self._collect()
+            await self._cancel_abandoned(batch)
+            # drop requests that were cancelled in the meantime (e.g. client disconnected, deadline passed)
+            batch = [el for el in batch if not el[2].done()]
+            if not batch:
+                continue
+
+            t0 = default_timer()
+            for _, _, _, t_queued, _ in batch:
+                QUEUE_WAIT.labels(model=self.name).observe(t0 - t_queued)
+            BATCH_SIZE.labels(model=self.name).observe(len(batch))
+
+            try:
+                # stack images to one batch
+                images = np.concatenate([el[0] for el in batch], axis=0)
+                options = [el[1] for el in batch]
+                results = await asyncio.get_running_loop().run_in_executor(
+                    self.executor,
+                    self.run_batch,
+                    images,
+                    options
+                )
+            except Exception as ex:
+                for _, _, future, _, _ in batch:
+                    if not future.done():
+                        future.set_exception(ex)
+                continue
+
+            dt = default_timer() - t0
+            THROUGHPUT.labels(model=self.name).set(len(batch) / dt if dt > 0 else 0)
+            logging.debug(f"MicroBatchScheduler: batch of {len(batch)} took {dt * 1000:.4g} ms")
+
+            for (_, _, future, _, _), res in zip(batch, results):
+                if not future.done():
+                    future.set_result(res)
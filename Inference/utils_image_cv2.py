@@ -1,19 +1,134 @@
 import logging
+import threading
+from functools import lru_cache
 from pathlib import Path
 import cv2
 import numpy as np
 from datetime import datetime
 
-from typing import Union, Tuple, Literal
+from typing import Union, Tuple, List, Dict, Iterable, Literal
 
 
-def bytes_to_image_array(image_bytes: object) -> np.ndarray:
+def bytes_to_image_array(image_bytes: object, rgb: bool = True) -> np.ndarray:
     # Convert the bytes data to a numpy array
     np_arr = np.frombuffer(image_bytes, dtype=np.uint8)
     # Decode the image using OpenCV
     img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
     # convert color from OpenCV BGR format to RGB format
-    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    # (skip the conversion if the channel swap is done later, e.g. by prepare_image(..., bgr=True))
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB) if rgb else img
+
+
+def image_array_to_bytes(img: np.ndarray, extension: str = ".jpg", quality: int = 95) -> bytes:
+    # encode a BGR image (e.g. a synthetic image to warm up the decoding)
+    return cv2.imencode(extension, img, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+
+# DCT-domain downscaling while decoding a JPEG (libjpeg scaled decoding)
+REDUCED_DECODING_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def get_jpeg_size(image_bytes: bytes) -> Union[Tuple[int, int], None]:
+    """(height, width) from the frame header (SOF marker) of a JPEG file; None if it is not a JPEG file."""
+    if image_bytes[:2] != b"\xff\xd8":
+        return None
+
+    i, n = 2, len(image_bytes)
+    while i + 9 < n:
+        if image_bytes[i] != 0xFF:
+            return None
+        marker = image_bytes[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+        elif marker == 0x01 or 0xD0 <= marker <= 0xD8:  # markers without length
+            i += 2
+        elif 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):  # start of frame (not DHT, JPG, DAC)
+            return int.from_bytes(image_bytes[i + 5:i + 7], "big"), int.from_bytes(image_bytes[i + 7:i + 9], "big")
+        else:
+            i += 2 + int.from_bytes(image_bytes[i + 2:i + 4], "big")
+    return None
+
+
+def get_decoding_reduction(shape_src: Tuple[int, int], shape_dst: Tuple[int, int], keep_ratio: bool = False) -> int:
+    """
+    Largest JPEG downscale factor (1, 2, 4, 8) at which the decoded image is still at least as large as the resized
+    image of the letterbox transformation, i.e. the model input does not lose resolution.
+    """
+    factor = 1
+    for f in (2, 4, 8):
+        # both orientations: the image might be rotated according to its EXIF data
+        if all(
+                (-(-shape[0] // f) >= size_unpad[1]) and (-(-shape[1] // f) >= size_unpad[0])
+                for shape in (tuple(shape_src[:2]), tuple(shape_src[1::-1]))
+                for size_unpad in [get_letterbox_transform(shape, shape_dst, keep_ratio).size_unpad]
+        ):
+            factor = f
+    return factor
+
+
+def decode_image_reduced(
+        image_bytes: bytes,
+        shape_dst: Tuple[int, int],
+        keep_ratio: bool = False,
+        rgb: bool = True
+) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """
+    Decodes a JPEG directly at a reduced resolution that still covers the model input (other formats are decoded
+    at full resolution).
+
+    Parameters:
+        image_bytes (bytes): Encoded image.
+        shape_dst (Tuple[int, int]): Input size of the model (height, width).
+        keep_ratio (bool): Letterbox keeps the aspect ratio of the image.
+        rgb (bool): Convert from OpenCV's BGR format to RGB.
+
+    Returns:
+        Tuple[np.ndarray, Tuple[int, int]]: Decoded image and the (height, width) of the image at full resolution.
+    """
+    shape_src = get_jpeg_size(image_bytes)
+    factor = get_decoding_reduction(shape_src, shape_dst, keep_ratio) if shape_src else 1
+
+    img = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), REDUCED_DECODING_FLAGS[factor])
+    if img is None:
+        raise ValueError("Image could not be decoded.")
+
+    if factor == 1:
+        shape_src = img.shape[:2]
+    elif (-(-shape_src[0] // factor), -(-shape_src[1] // factor)) != img.shape[:2]:
+        # rotated according to its EXIF data
+        shape_src = shape_src[::-1]
+    logging.debug(f"decode_image_reduced(): {shape_src} decoded at 1/{factor}: {img.shape}")
+    return (cv2.cvtColor(img, cv2.COLOR_BGR2RGB) if rgb else img), tuple(shape_src)
+
+
+def raw_to_image_array(buffer: object, shape: Tuple[int, ...], dtype: Union[str, type] = np.uint8) -> np.ndarray:
+    """
+    Wraps an uncompressed frame (e.g. the body of an application/octet-stream request) without copy.
+
+    Parameters:
+        buffer (bytes): Pixel data (C-order).
+        shape (Tuple[int, ...]): (height, width) for gray-scale or (height, width, channels) with 1 or 3 channels.
+        dtype (str): Data type of the pixels (uint8 or uint16).
+
+    Returns:
+        np.ndarray: Read-only image of shape (height, width) or (height, width, 3).
+    """
+    dtype = np.dtype(dtype)
+    if dtype not in (np.uint8, np.uint16):
+        raise ValueError(f"Unsupported pixel type {dtype}. Options: uint8, uint16.")
+    if len(shape) not in (2, 3) or (len(shape) == 3 and shape[2] not in (1, 3)):
+        raise ValueError(f"Unsupported image shape {shape}. Expected (height, width) or (height, width, 1 | 3).")
+    if len(buffer) != int(np.prod(shape)) * dtype.itemsize:
+        raise ValueError(f"{len(buffer)} bytes do not match an image of shape {shape} and type {dtype}.")
+
+    img = np.frombuffer(buffer, dtype=dtype).reshape(shape)
+    # single channel as 2D image (view)
+    return img.reshape(shape[:2]) if img.ndim == 3 and img.shape[2] == 1 else img
 
 
 def load_image(path_to_image: Union[str, Path], imgsz: Tuple[int, int]) -> np.ndarray:
@@ -47,24 +162,32 @@ def adjust_image_channels(image: np.ndarray) -> np.ndarray:
     return image
 
 
-def letterbox(
-        img: np.ndarray,
-        new_shape: Tuple[int, int] = (640, 640),
-        color: Tuple[int, int, int] = (114, 114, 114),
+def letterbox_parameters(
+        shape: Tuple[int, int],
+        new_shape: Union[int, Tuple[int, int]] = (640, 640),
         auto: bool = True,
         scale_fill: bool = False,
         scale_up: bool = True,
-        stride: int = 32
-):
-    # Resize and pad image while meeting stride-multiple constraints
-    shape = img.shape[:2]  # current shape [height, width]
+        stride: int = 32,
+        keep_ratio: bool = False
+) -> Tuple[Tuple[int, int], Tuple[float, float], Tuple[float, float], Tuple[int, int, int, int]]:
+    """
+    Geometry of the letterbox transformation for an image of size `shape` (height, width).
+
+    Returns:
+        new_unpad (width, height) of the resized image, ratio, padding (dw, dh), and the border
+        (top, bottom, left, right) in pixels.
+    """
+    shape = tuple(shape[:2])  # current shape [height, width]
     if isinstance(new_shape, int):
         new_shape = (new_shape, new_shape)
 
     # Scale ratio (new / old)
     ratio = (new_shape[0] / shape[0], new_shape[1] / shape[1])
+    if keep_ratio:  # same ratio for both axes, i.e. keep aspect ratio and pad
+        ratio = (min(ratio), min(ratio))
     if not scale_up:  # only scale down, do not scale up (for better test mAP)
-        ratio = (min(el, 1.0) for el in ratio)
+        ratio = tuple(min(el, 1.0) for el in ratio)
 
     # Compute padding
     new_unpad = (int(round(shape[1] * ratio[1])), int(round(shape[0] * ratio[0])))
@@ -81,38 +204,283 @@ def letterbox(
     dw /= 2  # divide padding into 2 sides
     dh /= 2
 
-    if shape[::-1] != new_unpad:  # resize
-        img = cv2.resize(img, new_unpad, interpolation=cv2.INTER_LINEAR)
     top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
     left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    return new_unpad, ratio, (dw, dh), (top, bottom, left, right)
+
+
+def letterbox(
+        img: np.ndarray,
+        new_shape: Tuple[int, int] = (640, 640),
+        color: Tuple[int, int, int] = (114, 114, 114),
+        auto: bool = True,
+        scale_fill: bool = False,
+        scale_up: bool = True,
+        stride: int = 32
+):
+    # Resize and pad image while meeting stride-multiple constraints
+    shape = img.shape[:2]  # current shape [height, width]
+    new_unpad, ratio, (dw, dh), (top, bottom, left, right) = letterbox_parameters(
+        shape, new_shape, auto, scale_fill, scale_up, stride
+    )
+
+    if shape[::-1] != new_unpad:  # resize
+        img = cv2.resize(img, new_unpad, interpolation=cv2.INTER_LINEAR)
     img = cv2.copyMakeBorder(img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)  # add border
     return img, ratio, (dw, dh)
 
 
+# thread-local scratch buffers for the (uint8) letterboxed image
+_scratch = threading.local()
+
+
+def _get_scratch_buffer(shape: Tuple[int, ...], dtype=np.uint8) -> np.ndarray:
+    if not hasattr(_scratch, "buffers"):
+        _scratch.buffers = dict()
+    key = (tuple(shape), np.dtype(dtype))
+    if key not in _scratch.buffers:
+        _scratch.buffers[key] = np.empty(shape, dtype=dtype)
+    return _scratch.buffers[key]
+
+
+class LetterboxTransform:
+    """
+    Letterbox transformation from an image of size `shape_src` (height, width) to the model input size.
+    Resizing and padding are an affine map x_dst = scale * x_src + offset; it is realized as one resize written
+    directly into the padded output buffer. The inverse maps boxes from model space back to original pixels
+    (accounting for the padding).
+    Use get_letterbox_transform() to reuse the transformation of identical image sizes.
+    """
+    def __init__(
+            self,
+            shape_src: Tuple[int, int],
+            shape_dst: Tuple[int, int],
+            keep_ratio: bool = False,
+            color: Tuple[int, int, int] = (114, 114, 114)
+    ):
+        self.shape_src = tuple(shape_src[:2])
+        self.color = color
+        new_unpad, _, _, (top, bottom, left, right) = letterbox_parameters(
+            self.shape_src,
+            new_shape=shape_dst,
+            auto=False,
+            keep_ratio=keep_ratio
+        )
+        self.size_unpad = new_unpad  # (width, height) of the resized image
+        self.border = (top, bottom, left, right)
+        # output shape (height, width)
+        self.shape = (new_unpad[1] + top + bottom, new_unpad[0] + left + right)
+
+        # effective scale (x, y) of the resize and offset (x, y) due to the padding
+        self.scale = np.array([new_unpad[0] / self.shape_src[1], new_unpad[1] / self.shape_src[0]], dtype=np.float32)
+        self.offset = np.array([left, top], dtype=np.float32)
+        # 2x3 affine matrix (source -> model)
+        self.matrix = np.array(
+            [[self.scale[0], 0, self.offset[0]], [0, self.scale[1], self.offset[1]]],
+            dtype=np.float64
+        )
+
+    def apply(self, img: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        if out is None:
+            out = np.empty((*self.shape, *img.shape[2:]), dtype=img.dtype)
+
+        top, bottom, left, right = self.border
+        # fill border only
+        if (top + bottom + left + right) > 0:
+            color = self.fill_value(out)
+            out[:top], out[out.shape[0] - bottom:] = color, color
+            out[:, :left], out[:, out.shape[1] - right:] = color, color
+        # resize directly into the region of interest
+        roi = out[top:(top + self.size_unpad[1]), left:(left + self.size_unpad[0])]
+        if self.shape_src[::-1] != self.size_unpad:
+            cv2.resize(img, self.size_unpad, dst=roi, interpolation=cv2.INTER_LINEAR)
+        else:
+            np.copyto(roi, img)
+        return out
+
+    def fill_value(self, out: np.ndarray) -> Union[float, np.ndarray]:
+        """Padding color for the channels and the value range of `out` (the color is given for 8-bit images)."""
+        color = np.asarray(self.color, dtype=np.float64).reshape(-1)
+        if np.issubdtype(out.dtype, np.integer):
+            color = color * (np.iinfo(out.dtype).max / 255)
+        if out.ndim < 3:
+            # gray-scale: mean of the color channels
+            return float(color.mean())
+        return np.resize(color, out.shape[2])
+
+    def forward(self, bboxes: np.ndarray) -> np.ndarray:
+        """Maps boxes [[x0, y0, x1, y1], ...] from the original image to the model input."""
+        return bboxes * np.tile(self.scale, 2) + np.tile(self.offset, 2)
+
+    def inverse(self, bboxes: np.ndarray) -> np.ndarray:
+        """Maps boxes [[x0, y0, x1, y1], ...] from the model input back to pixels of the original image."""
+        bboxes_src = (np.asarray(bboxes, dtype=np.float32) - np.tile(self.offset, 2)) / np.tile(self.scale, 2)
+        # clip boxes that extend into the padding
+        height, width = self.shape_src
+        return np.clip(bboxes_src, 0, [width, height, width, height]).astype(np.float32, copy=False)
+
+
+@lru_cache(maxsize=32)
+def _get_letterbox_transform(
+        shape_src: Tuple[int, int],
+        shape_dst: Tuple[int, int],
+        keep_ratio: bool
+) -> LetterboxTransform:
+    return LetterboxTransform(shape_src, shape_dst, keep_ratio)
+
+
+def get_letterbox_transform(
+        shape_src: Tuple[int, int],
+        shape_dst: Tuple[int, int],
+        keep_ratio: bool = False
+) -> LetterboxTransform:
+    """Cached letterbox transformation keyed by (source shape, model shape)."""
+    return _get_letterbox_transform(tuple(shape_src[:2]), tuple(shape_dst), bool(keep_ratio))
+
+
+class BufferPool:
+    """
+    Pool of preallocated model-input tensors, one list of free buffers per (shape, dtype).
+    Buffers are handed out by acquire() and must be returned with release() once the tensor is no longer used
+    (i.e. after the session call). In steady state no new tensors are allocated.
+    """
+    def __init__(self):
+        self._free = dict()
+        self._lock = threading.Lock()
+
+    def acquire(self, shape: Tuple[int, ...], dtype) -> np.ndarray:
+        key = (tuple(shape), np.dtype(dtype))
+        with self._lock:
+            buffers = self._free.get(key)
+            if buffers:
+                return buffers.pop()
+        return np.empty(shape, dtype=dtype)
+
+    def release(self, buffer: np.ndarray) -> None:
+        if buffer is None:
+            return
+        key = (buffer.shape, buffer.dtype)
+        with self._lock:
+            self._free.setdefault(key, []).append(buffer)
+
+
 def prepare_image(
         image: np.ndarray,
         shape: Tuple[int, int],
-        precision: Literal["fp64", "fp32", "fp16", "int8"] = None
+        precision: Literal["fp64", "fp32", "fp16", "int8"] = None,
+        bgr: bool = False,
+        buffer_pool: BufferPool = None,
+        keep_ratio: bool = False,
+        out: np.ndarray = None
 ) -> np.ndarray:
+    """
+    Letterbox an image (HWC, uint8 or uint16) and write it normalized as CHW tensor with batch axis into a buffer of
+    the target precision. Resizing and padding happen in a thread-local buffer; the channel swap (if the image is
+    BGR), the channel move, the normalization, and the type conversion are fused in a single pass per channel.
+
+    Parameters:
+        image (np.ndarray): Image of shape (height, width, 3) or gray-scale image of shape (height, width).
+        shape (Tuple[int, int]): Input size of the model (height, width).
+        precision (str): Precision of the model input. Defaults to fp64 (like dividing by 255.0).
+        bgr (bool): True if the image is in OpenCV's BGR format, i.e. the channels are swapped to RGB.
+        buffer_pool (BufferPool): Take the output tensor from this pool. The caller must release it again.
+        keep_ratio (bool): Keep the aspect ratio of the image and pad instead of stretching it.
+        out (np.ndarray): Write into this tensor of shape (1, 3, height, width), e.g. a slice of a batch tensor.
+
+    Returns:
+        np.ndarray: Tensor of shape (1, 3, height, width).
+    """
     msg = f"prepare_image({image.shape}, {shape}, {precision})"
     logging.debug(msg)
 
-    # resize
-    img_sml = letterbox(image, new_shape=shape, stride=32)[0]
-    # move channels
-    img_mdl = np.moveaxis(img_sml, (2, 0, 1), (0, 1, 2))
-    # img_mdl = img_sml.transpose(2, 0, 1)  # bring color channels to front # BGR2RGB
-    # normalize image (and convert to float)
-    img_nrm = img_mdl / 255.0
-    # add batch axis
-    img_btc = img_nrm[np.newaxis, ...]
-    # convert image
-    img_out = img_btc.astype(precision_to_type(precision)) if precision is not None else img_btc
+    dtype = precision_to_type(precision) if precision is not None else np.float64
+
+    # resize + pad into scratch buffer (the transformation is cached per image size)
+    transform = get_letterbox_transform(image.shape[:2], shape, keep_ratio)
+    height, width = transform.shape
+    img_sml = transform.apply(image, out=_get_scratch_buffer((height, width, *image.shape[2:]), image.dtype))
+    # gray-scale images are resized only once and written to all three channels
+    gray = img_sml.ndim == 2
+    scale = 1 / np.iinfo(image.dtype).max if np.issubdtype(image.dtype, np.integer) else 1.0
+
+    # output tensor
+    shape_out = (1, 3, height, width)
+    if out is not None:
+        img_out = out
+    elif buffer_pool is not None:
+        img_out = buffer_pool.acquire(shape_out, dtype)
+    else:
+        img_out = np.empty(shape_out, dtype=dtype)
+    # swap channels + move channels to front + normalize + convert in one pass
+    # compute in (at least) single precision; the result is cast while being written to the output tensor
+    dtype_loop = np.promote_types(dtype, np.float32) if np.issubdtype(dtype, np.floating) else None
+    for i, c in enumerate((2, 1, 0) if bgr else (0, 1, 2)):
+        np.multiply(img_sml if gray else img_sml[..., c], scale, out=img_out[0, i], dtype=dtype_loop, casting="unsafe")
+
     logging.debug(f"prepare_image(): img_out.shape={img_out.shape}, img_out.dtype={img_out.dtype}")
     return img_out
 
 
+def _tile_starts(length: int, size: int, overlap: float) -> np.ndarray:
+    if length <= size:
+        return np.zeros(1, dtype=int)
+    step = max(int(size * (1 - overlap)), 1)
+    n = -(-(length - size) // step) + 1
+    # evenly distributed, i.e. neighbouring tiles overlap at least by `overlap`; the last tile ends at the border
+    return np.linspace(0, length - size, n).round().astype(int)
+
+
+@lru_cache(maxsize=32)
+def _get_tiles(shape: Tuple[int, int], tile_size: Tuple[int, int], overlap: float) -> np.ndarray:
+    height, width = min(tile_size[0], shape[0]), min(tile_size[1], shape[1])
+    y0, x0 = np.meshgrid(_tile_starts(shape[0], height, overlap), _tile_starts(shape[1], width, overlap), indexing="ij")
+    tiles = np.stack([x0.ravel(), y0.ravel(), x0.ravel() + width, y0.ravel() + height], axis=1)
+    tiles.setflags(write=False)
+    return tiles
+
+
+def get_tiles(shape: Tuple[int, int], tile_size: Tuple[int, int], overlap: float = 0.2) -> np.ndarray:
+    """
+    Tiles that cover an image for sliced inference (cached per image size).
+
+    Parameters:
+        shape (Tuple[int, int]): Size of the image (height, width).
+        tile_size (Tuple[int, int]): Size of a tile (height, width); limited to the image size.
+        overlap (float): Minimum overlap of neighbouring tiles as fraction of the tile size.
+
+    Returns:
+        np.ndarray: Read-only array of shape (tiles, 4) with the pixel regions [x0, y0, x1, y1] (row by row).
+    """
+    return _get_tiles(tuple(shape[:2]), tuple(tile_size), float(overlap))
+
+
+def get_tiles_with_content(img: np.ndarray, tiles: np.ndarray, min_std: float = 0.01, reduction: int = 8) -> np.ndarray:
+    """
+    Mask of the tiles whose pixels are not (almost) uniform, i.e. whose standard deviation is at least `min_std`
+    (fraction of the value range). The statistics of all tiles are computed at once from the integral images of a
+    thumbnail (1/`reduction` of the resolution).
+    """
+    height, width = img.shape[:2]
+    thumb = cv2.resize(img, (max(width // reduction, 1), max(height // reduction, 1)), interpolation=cv2.INTER_AREA)
+    if thumb.ndim == 3:
+        thumb = cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY)
+    scale = 1 / np.iinfo(img.dtype).max if np.issubdtype(img.dtype, np.integer) else 1.0
+    sums, sqsums = cv2.integral2(thumb.astype(np.float32) * scale, sdepth=cv2.CV_64F)
+
+    # tile regions in the thumbnail (at least one pixel)
+    fy, fx = thumb.shape[0] / height, thumb.shape[1] / width
+    x0 = np.minimum((tiles[:, 0] * fx).astype(int), thumb.shape[1] - 1)
+    y0 = np.minimum((tiles[:, 1] * fy).astype(int), thumb.shape[0] - 1)
+    x1 = np.maximum(np.round(tiles[:, 2] * fx).astype(int), x0 + 1)
+    y1 = np.maximum(np.round(tiles[:, 3] * fy).astype(int), y0 + 1)
+    n = (x1 - x0) * (y1 - y0)
+    mean = (sums[y1, x1] - sums[y0, x1] - sums[y1, x0] + sums[y0, x0]) / n
+    mean_sq = (sqsums[y1, x1] - sqsums[y0, x1] - sqsums[y1, x0] + sqsums[y0, x0]) / n
+    return np.sqrt(np.maximum(mean_sq - mean ** 2, 0)) >= min_std
+
+
 def precision_to_type(precision: Literal["fp64", "fp32", "fp16", "int8"]) -> type:
+    """Type of the model input for the precision of a model."""
     if precision.lower() == "fp64":
         return np.float64
     elif precision.lower() == "fp32":
@@ -120,7 +488,9 @@ def precision_to_type(precision: Literal["fp64", "fp32", "fp16", "int8"]) -> typ
     elif precision.lower() == "fp16":
         return np.float16
     elif precision.lower() == "int8":
-        return np.int8
+        # statically quantized models (QDQ or QOperator format) take the float input and quantize it in the graph
+        # (with the scale and zero point of the calibration), i.e. the input must not be cast to integers
+        return np.float32
     else:
         raise ValueError(f"Unknown precision: {precision}")
 
@@ -174,14 +544,163 @@ def scale_coordinates_to_image_size(
     return scaled_bboxs
 
 
+# layouts of the model output
+# - "yolov7_nms": end-to-end export with NMS, [# boxes, (nr batch, x, y, x, y, cls, score)]
+# - "yolov10": end-to-end (NMS-free) model, [batch, # boxes, (x, y, x, y, score, cls)]
+# - "yolov5": raw head with objectness (YOLOv5, YOLOv7 without NMS), [batch, anchors, (cx, cy, w, h, obj, cls...)]
+# - "yolov8": raw head without objectness (YOLOv8, YOLOv9, YOLO11), [batch, (cx, cy, w, h, cls...), anchors]
+# - "auto": distinguish "yolov7_nms" and "yolov10" by the shape of the output
+OUTPUT_FORMATS = ("auto", "yolov7_nms", "yolov10", "yolov5", "yolov8")
+RAW_OUTPUT_FORMATS = ("yolov5", "yolov8")
+# maximum number of boxes passed to NMS (highest scores)
+MAX_NMS_CANDIDATES = 30000
+
+
+class DetectionFilter:
+    """
+    Minimum score per class, classes to keep, and maximum number of boxes (highest scores) per image. The filter is
+    applied as mask to the detections, i.e. only boxes that the caller uses are rescaled and serialized. Scores equal
+    to the threshold are kept. Requested thresholds below `th_model` (threshold of the model) are raised to it, i.e. a
+    caller can only narrow down the detections of a model.
+    """
+    def __init__(
+            self,
+            th_score: float,
+            class_scores: Dict[int, float] = None,
+            classes: Iterable[int] = None,
+            top_k: int = None,
+            th_model: float = None
+    ):
+        th_model = float(th_model) if th_model is not None else -np.inf
+        self.th_score = max(float(th_score), th_model)
+        self.top_k = int(top_k) if top_k is not None else None
+
+        class_scores = {int(ky): max(float(vl), th_model) for ky, vl in (class_scores or dict()).items()}
+        classes = {int(el) for el in classes} if classes is not None else None
+        # threshold per class id (inf: class is not kept); class ids beyond the table fall back to th_default
+        self.th_default = np.inf if classes is not None else self.th_score
+        self.th_per_class = np.full(max([*class_scores, *(classes or []), -1]) + 1, self.th_default, dtype=np.float32)
+        if classes is not None:
+            self.th_per_class[list(classes)] = self.th_score
+        for ky, vl in class_scores.items():
+            if classes is None or ky in classes:
+                self.th_per_class[ky] = vl
+
+    @property
+    def th_min(self) -> float:
+        """Lowest threshold of all kept classes (to pre-select candidates)."""
+        return float(np.min(self.th_per_class, initial=self.th_default))
+
+    def mask(self, class_ids: np.ndarray, scores: np.ndarray) -> np.ndarray:
+        n = len(self.th_per_class)
+        if n == 0:
+            return scores >= self.th_score
+        th = np.where(class_ids < n, self.th_per_class[np.minimum(class_ids, n - 1)], self.th_default)
+        return scores >= th
+
+    def limit(self, max_detections: int) -> int:
+        return max_detections if self.top_k is None else min(max_detections, self.top_k)
+
+    def apply(
+            self,
+            bboxes: np.ndarray,
+            class_ids: np.ndarray,
+            scores: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        lg = self.mask(class_ids, scores)
+        bboxes, class_ids, scores = bboxes[lg], class_ids[lg], scores[lg]
+        if self.top_k is not None and len(scores) > self.top_k:
+            # boxes with the highest scores (in their original order)
+            idx = np.sort(np.argpartition(-scores, self.top_k - 1)[:self.top_k])
+            bboxes, class_ids, scores = bboxes[idx], class_ids[idx], scores[idx]
+        return bboxes, class_ids, scores
+
+
+def get_detection_filters(
+        th_score: Union[float, DetectionFilter, List[DetectionFilter]],
+        batch_size: int
+) -> List[DetectionFilter]:
+    """One DetectionFilter per image from a score threshold, a filter for all images, or a filter per image."""
+    if isinstance(th_score, (list, tuple)):
+        if len(th_score) != batch_size:
+            raise ValueError(f"{len(th_score)} detection filters for a batch of {batch_size} images.")
+        return list(th_score)
+    detection_filter = th_score if isinstance(th_score, DetectionFilter) else DetectionFilter(th_score)
+    return [detection_filter] * batch_size
+
+
+def is_yolov7_output(output: np.ndarray, output_format: str = "auto") -> bool:
+    if output_format != "auto":
+        return output_format == "yolov7_nms"
+    # YOLOv7 (end-to-end) output.shape = (# boxes, 7) ... [# boxes, (nr batch, x, y, x, y, cls, score)]
+    # YOLOv10 output.shape = (batch, 300, 6) ... [batch, # boxes, (x, y, x, y, score, cls)]
+    return output.shape[-1] > 6
+
+
+def split_batch_results(
+        results: List[np.ndarray],
+        batch_size: int,
+        output_format: str = "auto"
+) -> List[List[np.ndarray]]:
+    """
+    Split the raw output of a batched ONNX session call into the results of the individual images.
+    Each element has the same layout as the output of a session call with batch size 1.
+
+    Parameters:
+        results (List[np.ndarray]): Output of ONNX_SESSION.run(...) for a batch of images.
+        batch_size (int): Number of images in the batch.
+        output_format (str): Layout of the output (see OUTPUT_FORMATS).
+
+    Returns:
+        List[List[np.ndarray]]: Results per image (in input order).
+    """
+    output = results[0]
+    if is_yolov7_output(output, output_format):
+        # YOLOv7: all boxes of the batch are concatenated; column 0 holds the batch index
+        idx_batch = output[:, 0].astype(int)
+        return [[output[idx_batch == i]] for i in range(batch_size)]
+    else:
+        # YOLOv10 / raw heads: first axis is the batch axis
+        return [[output[i:(i + 1)]] for i in range(batch_size)]
+
+
+def postprocess_batch(
+        results: List[np.ndarray],
+        th_score: Union[float, DetectionFilter, List[DetectionFilter]],
+        batch_size: int,
+        output_format: str = "auto",
+        th_iou: float = 0.45,
+        max_detections: int = 300
+) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    # minimum score or detection filter(s): same for all images or one per image
+    detection_filters = get_detection_filters(th_score, batch_size)
+    if output_format in RAW_OUTPUT_FORMATS:
+        # score filtering and NMS for all images of the batch at once
+        return postprocess_raw(
+            results[0],
+            detection_filters,
+            th_iou,
+            max_detections,
+            objectness=(output_format == "yolov5")
+        )
+    return [
+        postprocess(res, flt, output_format)
+        for res, flt in zip(split_batch_results(results, batch_size, output_format), detection_filters)
+    ]
+
+
 def postprocess(
         results,
-        th_score
+        th_score: Union[float, DetectionFilter],
+        output_format: str = "auto"
 ):
-    # YOLOv7 results[0].shape = (1, 30, 7) ... [batch, # boxes, (nr batch, x, y, x, y, cls, score)]
+    if output_format in RAW_OUTPUT_FORMATS:
+        return postprocess_raw(results[0], th_score, objectness=(output_format == "yolov5"))[0]
+
+    # YOLOv7 results[0].shape = (30, 7) ... [# boxes, (nr batch, x, y, x, y, cls, score)]
     # YOLOv10n results[0].shape = (1, 300, 6) ... [batch, # boxes, (x, y, x, y, score, cls)]
     batch_i = results[0]
-    if batch_i.shape[1] > 6:
+    if is_yolov7_output(batch_i, output_format):
         # YOLOv7
         idx_xyxy = 1
         idx_cls = 5
@@ -197,8 +716,103 @@ def postprocess(
     class_ids = batch_i[:, idx_cls].astype(int)
     scores = batch_i[:, idx_score]
 
-    lg = scores > th_score
-    return bboxes_xyxy[lg, :], class_ids[lg], scores[lg]
+    detection_filter = th_score if isinstance(th_score, DetectionFilter) else DetectionFilter(th_score)
+    return detection_filter.apply(bboxes_xyxy, class_ids, scores)
+
+
+def postprocess_raw(
+        output: np.ndarray,
+        th_score: Union[float, DetectionFilter, List[DetectionFilter]],
+        th_iou: float = 0.45,
+        max_detections: int = 300,
+        objectness: bool = False
+) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Score filtering and class-aware non-maximum suppression for the raw head of a YOLO model (exported without NMS).
+    The scores of all images are filtered at once; the remaining boxes are shifted by an offset per image and class
+    so that a single NMS call handles the whole batch without suppressing boxes of other images or classes.
+
+    Parameters:
+        output (np.ndarray): [batch, anchors, (cx, cy, w, h, obj, cls...)] (objectness=True) or
+            [batch, (cx, cy, w, h, cls...), anchors] (objectness=False).
+        th_score (float, DetectionFilter, List[DetectionFilter]): Minimum score (objectness times class probability
+            if objectness=True) or detection filter(s) for all images or per image.
+        th_iou (float): Boxes of the same class that overlap more than this are suppressed.
+        max_detections (int): Maximum number of boxes per image.
+        objectness (bool): Output has an objectness column (YOLOv5 / YOLOv7 layout).
+
+    Returns:
+        List[Tuple[np.ndarray, np.ndarray, np.ndarray]]: (bboxes [x0, y0, x1, y1], class ids, scores) per image.
+    """
+    batch_size = output.shape[0]
+    detection_filters = get_detection_filters(th_score, batch_size)
+    # pre-select candidates by the lowest threshold of all images and classes
+    th_score = min(el.th_min for el in detection_filters)
+    if objectness:
+        # score = objectness * class probability <= objectness
+        idx_batch, idx_anchor = np.nonzero(output[..., 4] >= th_score)
+        candidates = output[idx_batch, idx_anchor]  # [K, 5 + C]
+        class_scores = candidates[:, 5:] * candidates[:, 4:5]
+    else:
+        # maximum class score per anchor (without transposing the whole output)
+        idx_batch, idx_anchor = np.nonzero(output[:, 4:, :].max(axis=1) >= th_score)
+        candidates = output[idx_batch, :, idx_anchor]  # [K, 4 + C]
+        class_scores = candidates[:, 4:]
+
+    class_ids = class_scores.argmax(axis=1)
+    scores = class_scores[np.arange(len(class_ids)), class_ids]
+    if all(el is detection_filters[0] for el in detection_filters):
+        lg = detection_filters[0].mask(class_ids, scores)
+    else:
+        lg = np.zeros(len(scores), dtype=bool)
+        for i, flt in enumerate(detection_filters):
+            lg_i = idx_batch == i
+            lg[lg_i] = flt.mask(class_ids[lg_i], scores[lg_i])
+    idx_batch, candidates, class_ids, scores = idx_batch[lg], candidates[lg], class_ids[lg], scores[lg]
+
+    if len(scores) > MAX_NMS_CANDIDATES:
+        idx = np.argpartition(-scores, MAX_NMS_CANDIDATES)[:MAX_NMS_CANDIDATES]
+        idx_batch, candidates, class_ids, scores = idx_batch[idx], candidates[idx], class_ids[idx], scores[idx]
+
+    # (cx, cy, w, h) -> (x0, y0, x1, y1)
+    bboxes = np.empty((len(scores), 4), dtype=np.float32)
+    bboxes[:, :2] = candidates[:, :2] - candidates[:, 2:4] / 2
+    bboxes[:, 2:] = candidates[:, :2] + candidates[:, 2:4] / 2
+
+    # class-aware NMS for all images in one call
+    # the scores were filtered above (cv2.dnn.NMSBoxes drops scores equal to its threshold)
+    keep = nms_class_aware(bboxes, class_ids, scores, th_iou, groups=idx_batch)
+
+    results = []
+    for i in range(batch_size):
+        idx = keep[idx_batch[keep] == i][:detection_filters[i].limit(max_detections)]
+        results.append((bboxes[idx], class_ids[idx].astype(int), scores[idx]))
+    return results
+
+
+def nms_class_aware(
+        bboxes: np.ndarray,
+        class_ids: np.ndarray,
+        scores: np.ndarray,
+        th_iou: float = 0.45,
+        groups: np.ndarray = None,
+        th_score: float = 0
+) -> np.ndarray:
+    """
+    Non-maximum suppression per class (and group, e.g. the image of a batch) in a single call: the boxes
+    [x0, y0, x1, y1] of different classes / groups are shifted apart so that they do not suppress each other.
+    Returns the indices of the kept boxes sorted by descending score.
+    """
+    if len(scores) == 0:
+        return np.zeros(0, dtype=int)
+    key = class_ids if groups is None else groups * (int(class_ids.max()) + 1) + class_ids
+    offset = key * (float(np.abs(bboxes).max()) * 2 + 1)
+    bboxes_nms = np.empty(bboxes.shape, dtype=np.float64)
+    bboxes_nms[:, :2] = bboxes[:, :2] + offset[:, np.newaxis]
+    bboxes_nms[:, 2:] = bboxes[:, 2:] - bboxes[:, :2]  # (x, y, w, h)
+    keep = cv2.dnn.NMSBoxes(bboxes_nms, scores.astype(np.float32), th_score, th_iou)
+    return np.asarray(keep, dtype=int).reshape(-1)
+
 
 if __name__ == "__main__":
     img = cv2.imread("../../BaslerCameraAdapter/test_images/20240813_120110.jpg")
@@ -0,0 +1,332 @@
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from threading import Lock, Thread
+import time
+from timeit import default_timer
+
+import yaml
+import onnxruntime as ort
+from prometheus_client import Counter, Gauge
+import numpy as np
+from pydantic import BaseModel
+
+from utils_onnx import create_inference_session, get_file_hash, SessionBinding, ONNX_TYPES
+from utils_image_cv2 import precision_to_type
+
+from typing import Union, Optional, Tuple, List, Dict, Any, Callable, Literal
+
+
+MODEL_LOADS = Counter(
+    name="model_loads",
+    documentation="Counts how often a model was loaded into memory.",
+    labelnames=["model"]
+)
+MODEL_EVICTIONS = Counter(
+    name="model_evictions",
+    documentation="Counts how often a model was evicted from memory (least recently used).",
+    labelnames=["model"]
+)
+MODEL_RESIDENT_BYTES = Gauge(
+    name="model_resident_bytes",
+    documentation="Approximate memory of a loaded model (size of the model file; 0 if not loaded).",
+    labelnames=["model"],
+    multiprocess_mode="mostrecent"
+)
+MODEL_RELOADS = Counter(
+    name="model_reloads",
+    documentation="Counts how often a loaded model was replaced by a new version of the model file.",
+    labelnames=["model"]
+)
+# (prometheus_client's Info is not supported with several worker processes; same series as Info("model"))
+MODEL_INFO = Gauge(
+    name="model_info",
+    documentation="Hash of the active version of a model (1: active, 0: replaced).",
+    labelnames=["model", "hash"],
+    multiprocess_mode="mostrecent"
+)
+MODEL_LOADED_TIMESTAMP = Gauge(
+    name="model_loaded_timestamp",
+    documentation="Unix timestamp when the active version of a model was loaded.",
+    labelnames=["model"],
+    multiprocess_mode="mostrecent"
+)
+MODEL_LOAD_TIME = Gauge(
+    name="model_load_time",
+    documentation="How long did loading (and optimizing) the model take?",
+    labelnames=["model"],
+    multiprocess_mode="mostrecent"
+)
+
+
+class ModelSettings(BaseModel):
+    name: str
+    filename: str
+    image_size: Tuple[int, int] = (640, 640)
+    precision: Optional[str] = "fp32"
+    th_score: float = 0.5
+    keep_aspect_ratio: bool = False
+    # layout of the model output (see utils_image_cv2.OUTPUT_FORMATS); NMS settings for raw heads
+    output_format: Literal["auto", "yolov7_nms", "yolov10", "yolov5", "yolov8"] = "auto"
+    th_iou: float = 0.45
+    max_detections: int = 300
+
+
+class LoadedModel:
+    def __init__(
+            self,
+            settings: ModelSettings,
+            path: Path,
+            session: ort.InferenceSession,
+            model_hash: str,
+            load_time: float,
+            file_stat: Tuple[float, int],
+            io_binding: bool = False
+    ):
+        self.settings = settings
+        self.path = path
+        self.session = session
+        self.model_hash = model_hash
+        self.load_time = load_time
+        self.datetime_loaded = datetime.now()
+        self.file_stat = file_stat  # (mtime, size) of the model file when it was read
+        self.size_bytes = self.file_stat[1]
+        # session metadata (resolved once)
+        self.input_name = session.get_inputs()[0].name
+        self.output_name = session.get_outputs()[0].name
+        self.input_type = session.get_inputs()[0].type
+        input_dtype = ONNX_TYPES.get(self.input_type)
+        if input_dtype is not None and input_dtype != precision_to_type(self.settings.precision or "fp64"):
+            logging.warning(
+                f"Model '{self.name}' expects {self.input_type} as input, but precision is '{self.settings.precision}'."
+            )
+        # preallocated outputs (optional)
+        self.binding = SessionBinding(session, self.input_name, self.output_name) if io_binding else None
+
+    @property
+    def name(self) -> str:
+        return self.settings.name
+
+    def run(self, input_tensor: np.ndarray) -> List[np.ndarray]:
+        """Runs the session. With IOBinding, the results are only valid until the next call in the same thread."""
+        if self.binding is not None:
+            return self.binding.run(input_tensor)
+        return self.session.run(output_names=[self.output_name], input_feed={self.input_name: input_tensor})
+
+    def warm_up(self) -> float:
+        """Runs the session once on a synthetic input (initializes ORT's lazy allocations); returns the duration."""
+        dtype = precision_to_type(self.settings.precision) if self.settings.precision else np.float64
+        img = np.zeros((1, 3, *self.settings.image_size), dtype=dtype)
+        t0 = default_timer()
+        self.run(img)
+        return default_timer() - t0
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "settings": self.settings.model_dump(),
+            "hash": self.model_hash,
+            "size_bytes": self.size_bytes,
+            "load_time_ms": round(self.load_time * 1000, 1),
+            "loaded": self.datetime_loaded
+        }
+
+
+def get_file_stat(path: Path) -> Tuple[float, int]:
+    stat = path.stat()
+    return stat.st_mtime, stat.st_size
+
+
+def load_model_settings(models: Union[str, Path, Dict[str, Dict[str, Any]], None]) -> Dict[str, Dict[str, Any]]:
+    """Per-model settings from a YAML file or a dictionary {name: {filename, image_size, precision, th_score, ...}}."""
+    if not models:
+        return dict()
+    if isinstance(models, dict):
+        return models
+
+    path_to_file = Path(models)
+    if path_to_file.is_file() and path_to_file.suffix.lower() in (".yaml", ".yml"):
+        with open(path_to_file, "r") as fid:
+            return yaml.safe_load(fid) or dict()
+    logging.warning(f"No model settings found at {models}.")
+    return dict()
+
+
+class ModelRegistry:
+    """
+    Keeps ONNX sessions of several models in memory. Models are identified by a name (stem of the ONNX file in
+    the model folder or a key of the per-model settings), loaded lazily, and evicted least-recently-used if more than
+    `max_models` models or more than `max_bytes` are loaded. Requests that still hold an evicted model finish on it.
+    """
+    def __init__(self, config: Dict[str, Any]):
+        self.config = config
+        self.folder = Path(config["MODEL_FOLDER_DATA"])
+        self.default_name = Path(config["MODEL_FILENAME"]).stem
+
+        self.max_models = max(int(config.get("REGISTRY_MAX_MODELS", 2)), 1)
+        self.max_bytes = int(config.get("REGISTRY_MAX_BYTES", 0))  # 0: no limit
+
+        self.overrides = load_model_settings(config.get("REGISTRY_MODELS", None))
+
+        self._models: OrderedDict[str, LoadedModel] = OrderedDict()
+        self._lock = Lock()
+        self._lock_load = Lock()
+
+        self._watcher: Thread = None
+        # called with the new model when a loaded model was replaced by another version
+        self._on_change: List[Callable[[LoadedModel], None]] = []
+
+    def available_models(self) -> List[str]:
+        # ONNX files in the model folder (excluding cached optimized graphs) and explicitly configured models
+        files = [
+            p.stem for p in self.folder.glob("*.onnx")
+            if ".optimized." not in p.name
+        ] if self.folder.is_dir() else []
+        return sorted(set(files) | set(self.overrides) | {self.default_name})
+
+    def get_settings(self, name: str) -> ModelSettings:
+        if name not in self.available_models():
+            raise KeyError(f"Unknown model '{name}'.")
+
+        # defaults from the [model] section
+        settings = {
+            "name": name,
+            "filename": self.config["MODEL_FILENAME"] if name == self.default_name else f"{name}.onnx",
+            "image_size": self.config["MODEL_IMAGE_SIZE"],
+            "precision": self.config["MODEL_PRECISION"],
+            "th_score": self.config["MODEL_TH_SCORE"],
+            "keep_aspect_ratio": self.config.get("MODEL_KEEP_ASPECT_RATIO", False),
+            "output_format": self.config.get("MODEL_OUTPUT_FORMAT", "auto"),
+            "th_iou": self.config.get("MODEL_TH_IOU", 0.45),
+            "max_detections": self.config.get("MODEL_MAX_DETECTIONS", 300),
+        }
+        return ModelSettings(**(settings | self.overrides.get(name, dict())))
+
+    def get_loaded(self, name: str = None) -> Union[LoadedModel, None]:
+        """Returns the model if it is already loaded (non-blocking), else None."""
+        name = name if name else self.default_name
+        with self._lock:
+            model = self._models.get(name)
+            if model is not None:
+                self._models.move_to_end(name)
+            return model
+
+    def get(self, name: str = None) -> LoadedModel:
+        """Returns the model and loads it if necessary (blocking)."""
+        name = name if name else self.default_name
+        model = self.get_loaded(name)
+        if model is not None:
+            return model
+
+        with self._lock_load:
+            # another thread may have loaded the model in the meantime
+            model = self.get_loaded(name)
+            if model is None:
+                model = self._load(name)
+                self._add(model)
+        return model
+
+    def reload(self, name: str = None) -> LoadedModel:
+        """
+        Builds and warms a new session from the (changed) model file and swaps it in atomically. Requests that
+        already hold the previous version finish on it. If the new version fails to load, the old one stays active.
+        """
+        name = name if name else self.default_name
+        with self._lock_load:
+            model = self._load(name)
+            model.warm_up()
+            replaced = self.get_loaded(name) is not None
+            self._add(model)
+        if replaced:
+            MODEL_RELOADS.labels(model=name).inc()
+            for callback in self._on_change:
+                callback(model)
+        logging.info(f"Model '{name}' {'reloaded' if replaced else 'loaded'} (hash {model.model_hash[:12]}).")
+        return model
+
+    def on_change(self, callback: Callable[[LoadedModel], None]) -> None:
+        """Registers a function that is called when a model is replaced by a new version (e.g. to clear caches)."""
+        self._on_change.append(callback)
+
+    def start_watching(self, interval: float) -> None:
+        """Polls the files of the loaded models every `interval` seconds and reloads a model if its file changed."""
+        if interval <= 0 or (self._watcher is not None and self._watcher.is_alive()):
+            return
+        self._watcher = Thread(target=self._watch, args=(interval,), name="model-watcher", daemon=True)
+        self._watcher.start()
+        logging.info(f"Watching model files for changes every {interval} s.")
+
+    def _watch(self, interval: float) -> None:
+        pending = dict()
+        while True:
+            time.sleep(interval)
+            for name, model in self.loaded_models().items():
+                try:
+                    stat = get_file_stat(model.path)
+                except FileNotFoundError:
+                    continue
+
+                if stat == model.file_stat:
+                    pending.pop(name, None)
+                elif pending.get(name) == stat:
+                    # file did not change since the last poll, i.e. it is completely written
+                    pending.pop(name)
+                    try:
+                        self.reload(name)
+                    except Exception as ex:
+                        logging.error(f"Reloading model '{name}' failed; keeping the active version: {ex}")
+                else:
+                    pending[name] = stat
+
+    def loaded_models(self) -> Dict[str, LoadedModel]:
+        with self._lock:
+            return dict(self._models)
+
+    def _load(self, name: str) -> LoadedModel:
+        settings = self.get_settings(name)
+        path_to_model = (self.folder / settings.filename).with_suffix(".onnx")
+        logging.info(f"Loading model '{name}' from {path_to_model} (file exists: {path_to_model.exists()})")
+
+        t0 = default_timer()
+        file_stat = get_file_stat(path_to_model)
+        model_hash = get_file_hash(path_to_model)
+        session = create_inference_session(path_to_model, self.config, model_hash)
+        dt = default_timer() - t0
+
+        model = LoadedModel(
+            settings,
+            path_to_model,
+            session,
+            model_hash,
+            dt,
+            file_stat,
+            io_binding=self.config.get("ONNX_IO_BINDING", True)
+        )
+        logging.debug(f"Model '{name}' input(s): {{{model.input_name}: {session.get_inputs()[0].shape}}}")
+
+        MODEL_LOADS.labels(model=name).inc()
+        MODEL_LOAD_TIME.labels(model=name).set(dt)
+        return model
+
+    def _add(self, model: LoadedModel) -> None:
+        with self._lock:
+            # (replaces a previous version of the model)
+            previous = self._models.get(model.name)
+            if previous is not None and previous.model_hash != model.model_hash:
+                MODEL_INFO.labels(model=model.name, hash=previous.model_hash).set(0)
+            self._models[model.name] = model
+            self._models.move_to_end(model.name)
+
+            MODEL_RESIDENT_BYTES.labels(model=model.name).set(model.size_bytes)
+            MODEL_INFO.labels(model=model.name, hash=model.model_hash).set(1)
+            MODEL_LOADED_TIMESTAMP.labels(model=model.name).set(model.datetime_loaded.timestamp())
+
+            # evict least recently used models (never the one that was just added)
+            while len(self._models) > 1 and (
+                    (len(self._models) > self.max_models) or
+                    (self.max_bytes > 0 and sum(el.size_bytes for el in self._models.values()) > self.max_bytes)
+            ):
+                name, _ = self._models.popitem(last=False)
+                logging.info(f"Evicted model '{name}'.")
+                MODEL_EVICTIONS.labels(model=name).inc()
+                MODEL_RESIDENT_BYTES.labels(model=name).set(0)
@@ -0,0 +1,222 @@
+import logging
+import hashlib
+import re
+import threading
+from pathlib import Path
+from timeit import default_timer
+
+import numpy as np
+import onnxruntime as ort
+
+from typing import Union, Tuple, List, Dict, Any
+
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+EXECUTION_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+
+
+def get_file_hash(path_to_file: Union[str, Path], chunk_size: int = 2 ** 20) -> str:
+    sha = hashlib.sha256()
+    with open(path_to_file, "rb") as fid:
+        while chunk := fid.read(chunk_size):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def get_providers(config: Dict[str, Any]) -> Union[list, None]:
+    # https://onnxruntime.ai/docs/execution-providers/
+    if "ONNX_PROVIDERS" in config:
+        return config["ONNX_PROVIDERS"]
+    elif "MODEL_ONNX_PROVIDERS" in config:
+        # legacy location of the option
+        return config["MODEL_ONNX_PROVIDERS"]
+    return None
+
+
+def get_session_options(config: Dict[str, Any]) -> ort.SessionOptions:
+    """
+    Builds the ONNX Runtime session options from the (flattened) config, i.e. the [onnx] section of
+    default_config.toml or the corresponding environment variables.
+    """
+    options = ort.SessionOptions()
+
+    level = str(config.get("ONNX_GRAPH_OPTIMIZATION_LEVEL", "all")).lower()
+    if level not in GRAPH_OPTIMIZATION_LEVELS:
+        raise ValueError(f"Unknown graph optimization level: {level}. Options: {list(GRAPH_OPTIMIZATION_LEVELS)}")
+    options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[level]
+
+    mode = str(config.get("ONNX_EXECUTION_MODE", "sequential")).lower()
+    if mode not in EXECUTION_MODES:
+        raise ValueError(f"Unknown execution mode: {mode}. Options: {list(EXECUTION_MODES)}")
+    options.execution_mode = EXECUTION_MODES[mode]
+
+    # 0 lets ONNX Runtime decide
+    options.intra_op_num_threads = int(config.get("ONNX_INTRA_OP_NUM_THREADS", 0))
+    options.inter_op_num_threads = int(config.get("ONNX_INTER_OP_NUM_THREADS", 0))
+
+    # memory
+    options.enable_cpu_mem_arena = bool(config.get("ONNX_ENABLE_CPU_MEM_ARENA", True))
+    options.enable_mem_pattern = bool(config.get("ONNX_ENABLE_MEM_PATTERN", True))
+    return options
+
+
+def get_path_to_optimized_model(
+        path_to_model: Union[str, Path],
+        config: Dict[str, Any],
+        model_hash: str = None
+) -> Path:
+    path_to_model = Path(path_to_model)
+    if model_hash is None:
+        model_hash = get_file_hash(path_to_model)
+
+    # the optimized graph depends on the model, the optimization level, the providers, and the ORT version
+    key = "|".join([
+        model_hash,
+        str(config.get("ONNX_GRAPH_OPTIMIZATION_LEVEL", "all")).lower(),
+        str(get_providers(config)),
+        ort.__version__
+    ])
+    suffix = ".ort" if str(config.get("ONNX_OPTIMIZED_MODEL_FORMAT", "onnx")).lower() == "ort" else ".onnx"
+
+    folder = Path(config["ONNX_OPTIMIZED_MODEL_FOLDER"]) if config.get("ONNX_OPTIMIZED_MODEL_FOLDER") \
+        else path_to_model.parent
+    return folder / f"{path_to_model.stem}.optimized.{hashlib.sha256(key.encode()).hexdigest()[:12]}{suffix}"
+
+
+def remove_stale_optimized_models(path_to_cache: Path) -> List[Path]:
+    """
+    Deletes the optimized graphs of the same model in the cache folder that were saved for another key (previous
+    model version, optimization level, providers, or ORT version). Returns the deleted files.
+    """
+    stem = path_to_cache.name.split(".optimized.")[0]
+    pattern = re.compile(re.escape(stem) + r"\.optimized\.[0-9a-f]{12}\.(onnx|ort)")
+    removed = []
+    for path in path_to_cache.parent.iterdir():
+        if path != path_to_cache and pattern.fullmatch(path.name):
+            try:
+                path.unlink()
+                removed.append(path)
+            except OSError as ex:
+                logging.warning(f"Stale optimized model {path} could not be deleted: {ex}")
+    if removed:
+        logging.info(f"Deleted stale optimized model(s): {[el.name for el in removed]}")
+    return removed
+
+
+def create_inference_session(
+        path_to_model: Union[str, Path],
+        config: Dict[str, Any],
+        model_hash: str = None
+) -> ort.InferenceSession:
+    """
+    Creates an ONNX session with the session options of the config. If ONNX_OPTIMIZED_MODEL_CACHE is enabled,
+    the optimized graph is saved to ONNX_OPTIMIZED_MODEL_FOLDER (default: next to the model file) on first start and
+    loaded on later starts, which skips the graph optimization. Saving a new graph deletes the stale graphs of the
+    model.
+    """
+    t0 = default_timer()
+    providers = get_providers(config)
+    options = get_session_options(config)
+
+    if not config.get("ONNX_OPTIMIZED_MODEL_CACHE", False):
+        session = ort.InferenceSession(path_to_model, sess_options=options, providers=providers)
+        logging.info(f"ONNX session created from {path_to_model} in {(default_timer() - t0) * 1000:.4g} ms.")
+        return session
+
+    path_to_cache = get_path_to_optimized_model(path_to_model, config, model_hash)
+    if path_to_cache.is_file():
+        try:
+            # graph is already optimized
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            session = ort.InferenceSession(path_to_cache, sess_options=options, providers=providers)
+            logging.info(f"ONNX session created from optimized model {path_to_cache} in {(default_timer() - t0) * 1000:.4g} ms.")
+            return session
+        except Exception as ex:
+            logging.warning(f"Failed to load optimized model {path_to_cache}: {ex}. Falling back to {path_to_model}.")
+            options = get_session_options(config)
+
+    # optimize the original model and save the optimized graph
+    try:
+        path_to_cache.parent.mkdir(parents=True, exist_ok=True)
+        options.optimized_model_filepath = path_to_cache.as_posix()
+        if path_to_cache.suffix == ".ort":
+            options.add_session_config_entry("session.save_model_format", "ORT")
+        session = ort.InferenceSession(path_to_model, sess_options=options, providers=providers)
+        logging.info(f"Optimized model saved to {path_to_cache}.")
+        remove_stale_optimized_models(path_to_cache)
+    except Exception as ex:
+        logging.warning(f"Optimized model could not be saved to {path_to_cache}: {ex}")
+        session = ort.InferenceSession(path_to_model, sess_options=get_session_options(config), providers=providers)
+
+    logging.info(f"ONNX session created from {path_to_model} in {(default_timer() - t0) * 1000:.4g} ms.")
+    return session
+
+
+ONNX_TYPES = {
+    "tensor(float)": np.float32,
+    "tensor(float16)": np.float16,
+    "tensor(double)": np.float64,
+    "tensor(int64)": np.int64,
+    "tensor(int32)": np.int32,
+}
+
+
+class SessionBinding:
+    """
+    Runs a session with IOBinding: the (preallocated) input tensor is bound without copy and, if the output shape is
+    determined by the input shape (e.g. [batch, 300, 6]), the output is written into a preallocated array that is
+    reused for every call with the same input shape. Bindings and output arrays are thread-local.
+    Note that the returned arrays are overwritten by the next call in the same thread, i.e. consume (copy) them
+    before running the session again.
+    """
+    def __init__(self, session: ort.InferenceSession, input_name: str = None, output_name: str = None):
+        self.session = session
+        self.input_name = input_name if input_name else session.get_inputs()[0].name
+        output = session.get_outputs()[0] if output_name is None else \
+            [el for el in session.get_outputs() if el.name == output_name][0]
+        self.output_name = output.name
+
+        # the output can be preallocated if all dimensions but the batch dimension are fixed and the first dimension
+        # is the batch dimension of the input (not e.g. the number of detections of an NMS output ["n", 7])
+        input_ = [el for el in session.get_inputs() if el.name == self.input_name][0]
+        self._output_shape = output.shape
+        self._output_dtype = ONNX_TYPES.get(output.type, None)
+        self.static_output = (self._output_dtype is not None) and \
+            len(output.shape) > 0 and len(input_.shape) > 0 and \
+            (output.shape[0] is not None) and (output.shape[0] == input_.shape[0]) and \
+            all(isinstance(el, int) for el in output.shape[1:])
+
+        self._local = threading.local()
+
+    def _get_binding(self, shape: Tuple[int, ...]) -> Tuple[ort.IOBinding, Union[np.ndarray, None]]:
+        if not hasattr(self._local, "bindings"):
+            self._local.bindings = dict()
+
+        if shape not in self._local.bindings:
+            binding = self.session.io_binding()
+            output = None
+            if self.static_output:
+                output = np.empty((shape[0], *self._output_shape[1:]), dtype=self._output_dtype)
+                binding.bind_ortvalue_output(self.output_name, ort.OrtValue.ortvalue_from_numpy(output))
+            else:
+                # dynamic output shape (e.g. number of detections): ORT allocates the output
+                binding.bind_output(self.output_name, "cpu")
+            self._local.bindings[shape] = (binding, output)
+        return self._local.bindings[shape]
+
+    def run(self, input_tensor: np.ndarray) -> List[np.ndarray]:
+        binding, output = self._get_binding(input_tensor.shape)
+        binding.bind_cpu_input(self.input_name, np.ascontiguousarray(input_tensor))
+        self.session.run_with_iobinding(binding)
+        if output is not None:
+            return [output]
+        return binding.copy_outputs_to_cpu()
@@ -0,0 +1,104 @@
+import hashlib
+import logging
+from collections import OrderedDict
+from threading import Lock
+import time
+
+import numpy as np
+from prometheus_client import Counter, Gauge
+
+from typing import Union, Tuple, Dict, Any, Hashable
+
+
+CACHE_HITS = Counter(
+    name="result_cache_hits",
+    documentation="Counts how often results were returned from the result cache (no decoding, no session call)."
+)
+CACHE_MISSES = Counter(
+    name="result_cache_misses",
+    documentation="Counts how often a request was not found in the result cache."
+)
+CACHE_EVICTIONS = Counter(
+    name="result_cache_evictions",
+    documentation="Counts how often results were removed from the result cache (memory budget, expired, model changed)."
+)
+CACHE_BYTES = Gauge(
+    name="result_cache_bytes",
+    documentation="Approximate memory of the results in the result cache.",
+    multiprocess_mode="sum"
+)
+
+Results = Tuple[np.ndarray, np.ndarray, np.ndarray]  # bboxes, class_ids, scores
+
+
+class ResultCache:
+    """
+    Least-recently-used cache of inference results keyed by a hash of the uploaded bytes and the identity of the
+    model (hash of the model file and its settings). Identical requests (e.g. a re-triggered static scene or a retry
+    after a timeout) are answered without decoding or running the session.
+    Entries expire after `ttl` seconds (0: never); the oldest entries are evicted if `max_bytes` is exceeded.
+    """
+    # approximate overhead of an entry (key, tuple, arrays, dictionary)
+    BYTES_PER_ENTRY = 512
+
+    def __init__(self, max_bytes: int = 2 ** 24, ttl: float = 0):
+        self.max_bytes = int(max_bytes)
+        self.ttl = float(ttl)
+
+        self._entries: OrderedDict[Hashable, Tuple[float, str, Results, int]] = OrderedDict()
+        self._bytes = 0
+        self._lock = Lock()
+
+    @staticmethod
+    def make_key(data: bytes, *identity: Hashable) -> Tuple[Hashable, ...]:
+        # hashlib releases the GIL, i.e. call it in an executor for large images
+        return hashlib.sha256(data).digest(), *identity
+
+    def get(self, key: Hashable) -> Union[Results, None]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl > 0 and (time.monotonic() - entry[0]) > self.ttl:
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                CACHE_MISSES.inc()
+                return None
+            self._entries.move_to_end(key)
+        CACHE_HITS.inc()
+        return entry[2]
+
+    def put(self, key: Hashable, model_name: str, results: Results) -> None:
+        size = sum(el.nbytes for el in results) + self.BYTES_PER_ENTRY
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                # (concurrent identical request)
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = (time.monotonic(), model_name, results, size)
+            self._bytes += size
+            # evict least recently used entries
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+            CACHE_BYTES.set(self._bytes)
+
+    def invalidate(self, model_name: str = None) -> None:
+        """Removes the results of a model (all results if no name is given)."""
+        with self._lock:
+            keys = [ky for ky, vl in self._entries.items() if model_name is None or vl[1] == model_name]
+            for ky in keys:
+                self._remove(ky)
+        logging.debug(f"ResultCache: removed {len(keys)} results of model '{model_name}'.")
+
+    def info(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes, "ttl": self.ttl}
+
+    def _remove(self, key: Hashable) -> None:
+        """Removes an entry (call with the lock held) and updates the memory gauge."""
+        _, _, _, size = self._entries.pop(key)
+        self._bytes -= size
+        CACHE_EVICTIONS.inc()
+        CACHE_BYTES.set(self._bytes)
@@ -0,0 +1,51 @@
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+
+from typing import Dict
+
+# the services import their modules from their own folder and the shared modules from the project root
+ROOT = Path(__file__).resolve().parents[1]
+for folder in (ROOT, ROOT / "Inference", ROOT / "Backend"):
+    if str(folder) not in sys.path:
+        sys.path.insert(0, str(folder))
+
+
+def load_service(name: str, folder: Path, env: Dict[str, str]):
+    """
+    Imports main.py of a service (folder of its default_config.toml) as module `name`, configured by the environment
+    variables `env` (read on import only).
+    """
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(folder)
+        for ky, vl in env.items():
+            mp.setenv(ky, str(vl))
+        spec = importlib.util.spec_from_file_location(name, folder / "main.py")
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope="session")
+def tiny_model_bytes() -> bytes:
+    """Tiny YOLOv8-like ONNX model (raw head, dynamic batch axis) for an input of 64x64 pixels."""
+    from tools.benchmark_pipeline import tiny_model
+    return tiny_model((64, 64), n_classes=4)
+
+
+@pytest.fixture(scope="session")
+def inference(tmp_path_factory, tiny_model_bytes):
+    """Inference service (main.py) with the tiny model."""
+    folder = tmp_path_factory.mktemp("models")
+    (folder / "model.onnx").write_bytes(tiny_model_bytes)
+    return load_service("inference_main", ROOT / "Inference", {
+        "IF_MODEL_FOLDER_DATA": str(folder),
+        "IF_MODEL_IMAGE_SIZE": "[64, 64]",
+        "IF_MODEL_OUTPUT_FORMAT": "yolov8",
+        "IF_ONNX_OPTIMIZED_MODEL_CACHE": "false",
+        "IF_WARMUP_ENABLED": "false",
+        "IF_CACHE_ENABLED": "true",
+    })
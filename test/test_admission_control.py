@@ -0,0 +1,129 @@
+import asyncio
+import itertools
+
+import pytest
+
+from utils_fastapi import AdmissionControl
+
+
+NAMES = (f"test_admission_{i}" for i in itertools.count())
+
+
+def admission_control(**kwargs) -> AdmissionControl:
+    # (every instance registers its own metrics)
+    return AdmissionControl(next(NAMES), **kwargs)
+
+
+def rejected(admission: AdmissionControl, reason: str) -> float:
+    return admission.metrics["rejected"].labels(reason=reason)._value.get()
+
+
+def assert_idle(admission: AdmissionControl) -> None:
+    assert admission.in_flight == 0
+    assert admission.queue_depth == 0
+    assert admission.metrics["in_flight"]._value.get() == 0
+    assert admission.metrics["queue_depth"]._value.get() == 0
+
+
+def test_queue_full_rejection():
+    admission = admission_control(max_in_flight=1, max_queue=1, max_queue_wait=1)
+
+    async def run():
+        assert await admission.acquire()
+        waiter = asyncio.ensure_future(admission.acquire())
+        await asyncio.sleep(0)
+        assert admission.queue_depth == 1
+        # queue is full: rejected right away
+        assert not await admission.acquire()
+        admission.release()
+        assert await waiter
+        admission.release()
+
+    asyncio.run(run())
+    assert rejected(admission, "queue_full") == 1
+    assert_idle(admission)
+
+
+def test_queue_timeout_rejection():
+    admission = admission_control(max_in_flight=1, max_queue=2, max_queue_wait=0.05)
+
+    async def run():
+        assert await admission.acquire()
+        assert not await admission.acquire()
+        assert admission.queue_depth == 0
+        admission.release()
+
+    asyncio.run(run())
+    assert rejected(admission, "queue_timeout") == 1
+    assert_idle(admission)
+
+
+def test_fifo_hand_over():
+    admission = admission_control(max_in_flight=1, max_queue=3, max_queue_wait=1)
+    order = []
+
+    async def request(i: int):
+        assert await admission.acquire()
+        order.append(i)
+        await asyncio.sleep(0.01)
+        admission.release()
+
+    async def run():
+        assert await admission.acquire()
+        tasks = []
+        for i in range(3):
+            tasks.append(asyncio.ensure_future(request(i)))
+            await asyncio.sleep(0)
+        assert admission.queue_depth == 3
+        admission.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert order == [0, 1, 2]
+    assert_idle(admission)
+
+
+def test_waiter_cancelled_after_it_got_a_slot():
+    admission = admission_control(max_in_flight=1, max_queue=2, max_queue_wait=1)
+
+    async def run():
+        assert await admission.acquire()
+        first = asyncio.ensure_future(admission.acquire())
+        second = asyncio.ensure_future(admission.acquire())
+        await asyncio.sleep(0)
+        assert admission.queue_depth == 2
+
+        # the slot is handed over to the first waiter, which is cancelled before it resumes: it passes the slot on
+        # (or keeps it if asyncio.wait_for returns the result despite the cancellation, Python < 3.12)
+        admission.release()
+        first.cancel()
+        try:
+            got_slot = await first
+        except asyncio.CancelledError:
+            got_slot = False
+        if got_slot:
+            assert not second.done()
+            admission.release()
+        assert await second
+        assert admission.in_flight == 1
+        admission.release()
+
+    asyncio.run(run())
+    assert_idle(admission)
+
+
+def test_waiter_cancelled_while_queued():
+    admission = admission_control(max_in_flight=1, max_queue=1, max_queue_wait=1)
+
+    async def run():
+        assert await admission.acquire()
+        waiter = asyncio.ensure_future(admission.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert admission.queue_depth == 0
+        admission.release()
+
+    asyncio.run(run())
+    assert_idle(admission)
@@ -0,0 +1,70 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+from conftest import ROOT, load_service
+
+
+IMAGE = next((ROOT / "test" / "test_images").glob("*.jpg")).read_bytes()
+
+
+class SlowInference(BaseHTTPRequestHandler):
+    """Inference server that takes 0.5 s per request."""
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(0.5)
+        body = json.dumps({"bboxes": [[1, 2, 30, 40]], "class_ids": [0], "scores": [0.9]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def backend(tmp_path_factory):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowInference)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    module = load_service("backend_main", ROOT / "Backend", {
+        "BE_INFERENCE_URL": f"http://127.0.0.1:{server.server_port}/inference",
+        "BE_INFERENCE_BINARY_RESULTS": "false",
+        "BE_GENERAL_SAVE_IMAGES": "no",
+        "BE_PATTERN_FILE": str(tmp_path_factory.mktemp("patterns")),
+        "BE_ADMISSION_MAX_IN_FLIGHT": 1,
+        "BE_ADMISSION_MAX_QUEUE": 1,
+        "BE_ADMISSION_MAX_QUEUE_WAIT": 0.1,
+        "BE_ADMISSION_RETRY_AFTER": 2,
+    })
+    yield module
+    server.shutdown()
+
+
+def test_concurrent_requests_are_rejected_while_main_is_busy(backend):
+    async def run():
+        transport = httpx.ASGITransport(app=backend.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://backend", timeout=10) as client:
+            def request():
+                return client.request(
+                    "GET", "/main", params={"format": "jpeg"}, files={"image": ("a.jpg", IMAGE, "image/jpeg")}
+                )
+            return await asyncio.gather(*[request() for _ in range(4)])
+
+    t0 = time.monotonic()
+    responses = asyncio.run(run())
+    duration = time.monotonic() - t0
+
+    statuses = sorted(el.status_code for el in responses)
+    # one request is processed, one waits in the queue (and times out), two find the queue full
+    assert statuses == [200, 503, 503, 503]
+    assert all(el.headers["Retry-After"] == "2" for el in responses if el.status_code == 503)
+    # the rejections did not wait for the request in flight
+    assert duration < 1.5
+    assert backend.ADMISSION.in_flight == 0 and backend.ADMISSION.queue_depth == 0
@@ -0,0 +1,30 @@
+import numpy as np
+
+from utils_image_cv2 import DetectionFilter, postprocess_raw
+
+
+def test_requested_threshold_does_not_undercut_model_threshold():
+    flt = DetectionFilter(0.3, class_scores={1: 0.2, 2: 0.7}, th_model=0.5)
+    class_ids = np.array([0, 1, 2, 2])
+    scores = np.array([0.4, 0.45, 0.6, 0.7], dtype=np.float32)
+    np.testing.assert_array_equal(flt.mask(class_ids, scores), [False, False, False, True])
+
+
+def test_threshold_is_inclusive():
+    flt = DetectionFilter(0.5, classes=[0])
+    class_ids = np.array([0, 0, 1])
+    scores = np.array([0.5, 0.49, 0.9], dtype=np.float32)
+    np.testing.assert_array_equal(flt.mask(class_ids, scores), [True, False, False])
+
+
+def test_postprocess_raw_keeps_score_equal_to_threshold():
+    # [batch, (cx, cy, w, h, cls0, cls1), anchors]: two separate boxes
+    output = np.zeros((1, 6, 2), dtype=np.float32)
+    output[0, :4, 0] = [10, 10, 4, 4]
+    output[0, :4, 1] = [50, 50, 4, 4]
+    output[0, 4, 0] = 0.5  # class 0 exactly at the threshold
+    output[0, 5, 1] = 0.45  # class 1 below the threshold of the model
+    (bboxes, class_ids, scores), = postprocess_raw(output, DetectionFilter(0.4, th_model=0.5))
+    np.testing.assert_array_equal(class_ids, [0])
+    np.testing.assert_allclose(scores, [0.5])
+    np.testing.assert_allclose(bboxes, [[8, 8, 12, 12]])
@@ -0,0 +1,68 @@
+import asyncio
+import time
+
+import httpx
+
+from conftest import ROOT
+
+
+IMAGE = next((ROOT / "test" / "test_images").glob("*.jpg")).read_bytes()
+
+
+def post_batch(inference, images):
+    async def run():
+        transport = httpx.ASGITransport(app=inference.app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://inference") as client:
+            files = [("images", (f"{i}.jpg", el, "image/jpeg")) for i, el in enumerate(images)]
+            return await client.post("/inference/batch", files=files)
+    return asyncio.run(run())
+
+
+def free_buffers(inference, batch_size: int) -> int:
+    shape = (batch_size, 3, 64, 64)
+    return sum(len(vl) for ky, vl in inference.BUFFER_POOL._free.items() if ky[0] == shape)
+
+
+def test_batch(inference):
+    response = post_batch(inference, [IMAGE, IMAGE])
+    assert response.status_code == 200
+    first, second = response.json()
+    assert first == second
+    assert free_buffers(inference, 2) == 1
+
+
+def test_batch_with_corrupt_image_releases_buffer(inference):
+    n_free = free_buffers(inference, 3)
+    response = post_batch(inference, [IMAGE, b"not an image", IMAGE])
+    assert response.status_code != 200
+    # the tensor of the batch went back to the pool, i.e. the next batch reuses it
+    assert free_buffers(inference, 3) == max(n_free, 1)
+    assert post_batch(inference, [IMAGE] * 3).status_code == 200
+    assert free_buffers(inference, 3) == max(n_free, 1)
+
+
+def test_batch_buffer_is_released_after_all_images(inference, monkeypatch):
+    decode_and_prepare_image = inference.decode_and_prepare_image
+    events = []
+
+    def decode_slowly(image_bytes, model, out=None):
+        if image_bytes != IMAGE:
+            raise ValueError("Image could not be decoded.")
+        time.sleep(0.2)
+        result = decode_and_prepare_image(image_bytes, model, out)
+        events.append("prepared")
+        return result
+
+    release = inference.BUFFER_POOL.release
+
+    def release_recorded(buffer):
+        events.append("released")
+        release(buffer)
+
+    monkeypatch.setattr(inference, "decode_and_prepare_image", decode_slowly)
+    monkeypatch.setattr(inference.BUFFER_POOL, "release", release_recorded)
+
+    response = post_batch(inference, [b"not an image", IMAGE])
+    assert response.status_code != 200
+    # the image that was still being prepared into the batch tensor finished before the tensor was released
+    assert events == ["prepared", "released"]
@@ -0,0 +1,24 @@
+import numpy as np
+
+from utils_image_cv2 import LetterboxTransform
+
+
+def test_letterbox_gray_image():
+    img = np.full((100, 200), 7, dtype=np.uint8)
+    transform = LetterboxTransform(img.shape, (64, 64), keep_ratio=True)
+    out = transform.apply(img)
+    assert out.shape == (64, 64)
+    top, bottom, _, _ = transform.border
+    assert top > 0 and bottom > 0
+    assert (out[:top] == 114).all() and (out[out.shape[0] - bottom:] == 114).all()
+    assert (out[top:out.shape[0] - bottom] == 7).all()
+
+
+def test_letterbox_color_is_scaled_to_dtype():
+    img = np.zeros((200, 100, 3), dtype=np.uint16)
+    transform = LetterboxTransform(img.shape, (64, 64), keep_ratio=True)
+    out = transform.apply(img)
+    _, _, left, _ = transform.border
+    assert left > 0
+    assert (out[:, :left] == 114 * 257).all()
+    assert (out[:, left:left + transform.size_unpad[0]] == 0).all()
@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+
+import utils_image_cv2
+from utils_image_cv2 import postprocess_raw, postprocess_batch, nms_class_aware, split_batch_results
+
+
+N_CLASSES = 3
+
+
+def yolov8_head(boxes_per_image, n_anchors: int = 16) -> np.ndarray:
+    """Raw head [batch, (cx, cy, w, h, cls...), anchors] from boxes (cx, cy, w, h, class id, score) per image."""
+    output = np.zeros((len(boxes_per_image), 4 + N_CLASSES, n_anchors), dtype=np.float32)
+    for i, boxes in enumerate(boxes_per_image):
+        for j, (cx, cy, w, h, cls, score) in enumerate(boxes):
+            output[i, :4, j] = [cx, cy, w, h]
+            output[i, 4 + cls, j] = score
+    return output
+
+
+def yolov5_head(boxes_per_image, n_anchors: int = 16) -> np.ndarray:
+    """Raw head [batch, anchors, (cx, cy, w, h, obj, cls...)]; score = objectness * class probability."""
+    output = np.zeros((len(boxes_per_image), n_anchors, 5 + N_CLASSES), dtype=np.float32)
+    for i, boxes in enumerate(boxes_per_image):
+        for j, (cx, cy, w, h, cls, score) in enumerate(boxes):
+            output[i, j, :5] = [cx, cy, w, h, 0.5]
+            output[i, j, 5 + cls] = score / 0.5
+    return output
+
+
+# image 0: overlapping boxes of classes 0 and 1 (both kept), a box of class 0 that overlaps the first one (suppressed)
+# and a box below the threshold; image 1: a box at the same location as in image 0 (not suppressed by image 0)
+BOXES = [
+    [(50, 50, 20, 20, 0, 0.9), (50, 50, 20, 20, 1, 0.4), (52, 50, 20, 20, 0, 0.7), (10, 10, 4, 4, 2, 0.1)],
+    [(50, 50, 20, 20, 0, 0.6)],
+]
+
+
+@pytest.mark.parametrize("head, objectness", [(yolov8_head, False), (yolov5_head, True)])
+def test_postprocess_raw_batch(head, objectness):
+    (bboxes0, class_ids0, scores0), (bboxes1, class_ids1, scores1) = \
+        postprocess_raw(head(BOXES), 0.25, th_iou=0.45, objectness=objectness)
+
+    # sorted by descending score
+    np.testing.assert_array_equal(class_ids0, [0, 1])
+    np.testing.assert_allclose(scores0, [0.9, 0.4], rtol=1e-6)
+    np.testing.assert_allclose(bboxes0, [[40, 40, 60, 60], [40, 40, 60, 60]])
+
+    np.testing.assert_array_equal(class_ids1, [0])
+    np.testing.assert_allclose(scores1, [0.6], rtol=1e-6)
+    np.testing.assert_allclose(bboxes1, [[40, 40, 60, 60]])
+
+
+def test_postprocess_raw_empty():
+    # no box above the threshold
+    for bboxes, class_ids, scores in postprocess_raw(yolov8_head([[(50, 50, 20, 20, 0, 0.1)], []]), 0.25):
+        assert bboxes.shape == (0, 4) and class_ids.shape == (0,) and scores.shape == (0,)
+    # no anchors
+    results = postprocess_raw(np.zeros((2, 4 + N_CLASSES, 0), dtype=np.float32), 0.25)
+    assert [len(el[2]) for el in results] == [0, 0]
+
+
+def test_postprocess_raw_max_detections():
+    boxes = [(20 * j + 10, 10, 8, 8, 0, 0.3 + 0.1 * j) for j in range(5)]
+    results = postprocess_raw(yolov8_head([boxes, boxes]), 0.25, max_detections=3)
+    for _, _, scores in results:
+        np.testing.assert_allclose(scores, [0.7, 0.6, 0.5], rtol=1e-6)
+
+
+def test_postprocess_raw_candidates_are_truncated(monkeypatch):
+    monkeypatch.setattr(utils_image_cv2, "MAX_NMS_CANDIDATES", 2)
+    boxes = [(20 * j + 10, 10, 8, 8, 0, 0.3 + 0.1 * j) for j in range(5)]
+    # the highest scores of the whole batch are passed to NMS
+    (_, _, scores0), (_, _, scores1) = postprocess_raw(yolov8_head([boxes, boxes[:2]]), 0.25)
+    np.testing.assert_allclose(scores0, [0.7, 0.6], rtol=1e-6)
+    assert len(scores1) == 0
+
+
+def test_postprocess_batch_raw_format():
+    results = postprocess_batch([yolov8_head(BOXES)], 0.25, 2, output_format="yolov8")
+    assert [len(el[2]) for el in results] == [2, 1]
+
+
+def test_nms_class_aware_groups():
+    bboxes = np.array([[0, 0, 10, 10], [1, 0, 11, 10], [0, 0, 10, 10], [0, 0, 10, 10]], dtype=np.float32)
+    class_ids = np.array([0, 0, 1, 0])
+    scores = np.array([0.9, 0.8, 0.7, 0.6], dtype=np.float32)
+    groups = np.array([0, 0, 0, 1])
+    # box 1 is suppressed by box 0 (same class and group); box 2 (other class) and box 3 (other group) are kept
+    np.testing.assert_array_equal(nms_class_aware(bboxes, class_ids, scores, 0.45, groups=groups), [0, 2, 3])
+    np.testing.assert_array_equal(nms_class_aware(bboxes, class_ids, scores, 0.45), [0, 2])
+    assert len(nms_class_aware(np.zeros((0, 4)), np.zeros(0, dtype=int), np.zeros(0))) == 0
+
+
+def test_split_batch_results():
+    # YOLOv7 (exported with NMS): [# boxes, (batch index, x0, y0, x1, y1, class id, score)]
+    output = np.array([[1, 0, 0, 5, 5, 0, 0.9], [0, 1, 1, 6, 6, 1, 0.8], [1, 2, 2, 7, 7, 2, 0.7]], dtype=np.float32)
+    image0, image1, image2 = split_batch_results([output], 3, "yolov7_nms")
+    np.testing.assert_array_equal(image0[0], output[[1]])
+    np.testing.assert_array_equal(image1[0], output[[0, 2]])
+    assert image2[0].shape == (0, 7)
+
+    # YOLOv10 / raw heads: batch axis
+    output = np.arange(2 * 300 * 6, dtype=np.float32).reshape(2, 300, 6)
+    image0, image1 = split_batch_results([output], 2, "yolov10")
+    np.testing.assert_array_equal(image1[0], output[1:2])
@@ -0,0 +1,97 @@
+import struct
+
+import cv2
+import numpy as np
+import pytest
+
+from conftest import ROOT
+from utils_image_cv2 import get_jpeg_size, get_decoding_reduction, decode_image_reduced, get_letterbox_transform
+
+
+# (the test images contain EXIF (APP1) or IPTC (APP13) segments before the frame header)
+IMAGES = sorted((ROOT / "test" / "test_images").glob("*.jpg"))
+IMAGE = np.random.default_rng(0).integers(0, 255, (480, 640, 3), dtype=np.uint8)
+
+
+def with_orientation(image_bytes: bytes, orientation: int) -> bytes:
+    """Inserts an EXIF segment (APP1) with the orientation tag after the start of image."""
+    ifd = struct.pack(">H", 1) + struct.pack(">HHIHH", 0x0112, 3, 1, orientation, 0) + struct.pack(">I", 0)
+    exif = b"Exif\x00\x00" + b"MM\x00\x2a" + struct.pack(">I", 8) + ifd
+    return image_bytes[:2] + b"\xff\xe1" + struct.pack(">H", len(exif) + 2) + exif + image_bytes[2:]
+
+
+def assert_covers(img: np.ndarray, shape_src, shape_dst, keep_ratio: bool) -> None:
+    """
+    The decoded image is at least as large as the resized image of the letterbox transformation (or decoded at full
+    resolution if the image is upscaled).
+    """
+    width, height = get_letterbox_transform(shape_src, shape_dst, keep_ratio).size_unpad
+    assert img.shape[0] >= min(height, shape_src[0]) and img.shape[1] >= min(width, shape_src[1])
+
+
+@pytest.mark.parametrize("path", IMAGES, ids=lambda el: el.name)
+def test_get_jpeg_size(path):
+    assert get_jpeg_size(path.read_bytes()) == cv2.imread(str(path)).shape[:2]
+
+
+def test_get_jpeg_size_progressive():
+    image_bytes = cv2.imencode(".jpg", IMAGE, [cv2.IMWRITE_JPEG_PROGRESSIVE, 1])[1].tobytes()
+    assert b"\xff\xc2" in image_bytes  # SOF2
+    assert get_jpeg_size(image_bytes) == (480, 640)
+    assert get_jpeg_size(with_orientation(image_bytes, 1)) == (480, 640)
+
+
+def test_get_jpeg_size_no_jpeg():
+    assert get_jpeg_size(cv2.imencode(".png", IMAGE)[1].tobytes()) is None
+    assert get_jpeg_size(b"") is None
+    # truncated before the frame header
+    assert get_jpeg_size(IMAGES[0].read_bytes()[:100]) is None
+
+
+@pytest.mark.parametrize("shape_src, shape_dst, keep_ratio, factor", [
+    ((480, 640), (640, 640), False, 1),
+    ((480, 640), (240, 240), False, 2),
+    # (also covers the model input if the image is rotated according to its EXIF data)
+    ((480, 640), (240, 320), False, 1),
+    ((480, 640), (64, 64), False, 4),
+    ((480, 640), (64, 64), True, 8),
+    ((4000, 6000), (640, 640), True, 8),
+    ((100, 100), (640, 640), True, 1),
+])
+def test_get_decoding_reduction(shape_src, shape_dst, keep_ratio, factor):
+    assert get_decoding_reduction(shape_src, shape_dst, keep_ratio) == factor
+
+
+@pytest.mark.parametrize("shape_dst", [(64, 64), (200, 320), (427, 640), (640, 640)])
+@pytest.mark.parametrize("keep_ratio", [False, True])
+def test_decode_image_reduced_covers_model_input(shape_dst, keep_ratio):
+    for path in IMAGES:
+        img, shape_src = decode_image_reduced(path.read_bytes(), shape_dst, keep_ratio)
+        assert shape_src == cv2.imread(str(path)).shape[:2]
+        assert_covers(img, shape_src, shape_dst, keep_ratio)
+
+
+def test_decode_image_reduced_progressive():
+    image_bytes = cv2.imencode(".jpg", IMAGE, [cv2.IMWRITE_JPEG_PROGRESSIVE, 1])[1].tobytes()
+    img, shape_src = decode_image_reduced(image_bytes, (64, 64), keep_ratio=True)
+    assert shape_src == (480, 640)
+    assert img.shape == (60, 80, 3)
+
+
+def test_decode_image_reduced_exif_rotation():
+    image_bytes = with_orientation(cv2.imencode(".jpg", IMAGE)[1].tobytes(), 6)
+    # the frame header holds the stored size, the image is decoded rotated by 90°
+    assert get_jpeg_size(image_bytes) == (480, 640)
+    for shape_dst in ((64, 64), (200, 200), (480, 480)):
+        img, shape_src = decode_image_reduced(image_bytes, shape_dst)
+        assert shape_src == (640, 480)
+        assert_covers(img, shape_src, shape_dst, False)
+
+
+def test_decode_image_reduced_falls_back_to_full_resolution():
+    img, shape_src = decode_image_reduced(cv2.imencode(".png", IMAGE)[1].tobytes(), (64, 64), rgb=False)
+    assert shape_src == (480, 640)
+    np.testing.assert_array_equal(img, IMAGE)
+
+    with pytest.raises(ValueError):
+        decode_image_reduced(b"no image", (64, 64))
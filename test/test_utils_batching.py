@@ -0,0 +1,124 @@
+import asyncio
+import time
+
+import numpy as np
+import pytest
+
+from utils_batching import MicroBatchScheduler
+from utils_fastapi import Deadline, RequestCancelled
+
+
+class RecordingBatch:
+    """run_batch that returns (batch index, option) per image and records the batch sizes."""
+    def __init__(self):
+        self.batch_sizes = []
+
+    def __call__(self, images: np.ndarray, options: list) -> list:
+        self.batch_sizes.append(len(images))
+        return [(float(img.flat[0]), opt) for img, opt in zip(images, options)]
+
+
+def image(value: float) -> np.ndarray:
+    return np.full((1, 3, 2, 2), value, dtype=np.float32)
+
+
+def test_expired_requests_do_not_take_a_batch_slot():
+    run_batch = RecordingBatch()
+
+    async def disconnected() -> bool:
+        return True
+
+    async def run():
+        scheduler = MicroBatchScheduler(run_batch, max_batch_size=4, max_wait_ms=100)
+        try:
+            return await asyncio.gather(
+                scheduler.submit(image(0), "a", Deadline(0.01)),
+                scheduler.submit(image(1), "b", Deadline(is_disconnected=disconnected)),
+                scheduler.submit(image(2), "c", Deadline(10)),
+                return_exceptions=True
+            )
+        finally:
+            await scheduler.stop()
+
+    expired, abandoned, result = asyncio.run(run())
+    assert isinstance(expired, RequestCancelled) and expired.reason == "deadline"
+    assert isinstance(abandoned, RequestCancelled) and abandoned.reason == "disconnected"
+    assert result == (2, "c")
+    assert run_batch.batch_sizes == [1]
+
+
+def test_all_requests_cancelled_skips_session_call():
+    run_batch = RecordingBatch()
+
+    async def run():
+        scheduler = MicroBatchScheduler(run_batch, max_batch_size=4, max_wait_ms=20)
+        try:
+            with pytest.raises(RequestCancelled):
+                await scheduler.submit(image(0), None, Deadline(0.001))
+        finally:
+            await scheduler.stop()
+
+    asyncio.run(run())
+    assert run_batch.batch_sizes == []
+
+
+def test_batch_is_formed_at_max_batch_size():
+    run_batch = RecordingBatch()
+
+    async def run():
+        # a long waiting time: the batches are closed because they are full
+        scheduler = MicroBatchScheduler(run_batch, max_batch_size=3, max_wait_ms=10000)
+        try:
+            return await asyncio.wait_for(
+                asyncio.gather(*[scheduler.submit(image(i), i) for i in range(6)]),
+                timeout=5
+            )
+        finally:
+            await scheduler.stop()
+
+    results = asyncio.run(run())
+    assert run_batch.batch_sizes == [3, 3]
+    # every caller receives the result of its own image
+    assert results == [(i, i) for i in range(6)]
+
+
+def test_batch_is_formed_after_max_wait():
+    run_batch = RecordingBatch()
+
+    async def run():
+        scheduler = MicroBatchScheduler(run_batch, max_batch_size=8, max_wait_ms=20)
+        try:
+            t0 = time.monotonic()
+            results = await asyncio.gather(scheduler.submit(image(0), "a"), scheduler.submit(image(1), "b"))
+            # the batch is not full: it was closed after the waiting time
+            assert time.monotonic() - t0 >= 0.015
+            # a later request forms a batch of its own
+            results.append(await scheduler.submit(image(2), "c"))
+            return results
+        finally:
+            await scheduler.stop()
+
+    results = asyncio.run(run())
+    assert run_batch.batch_sizes == [2, 1]
+    assert results == [(0, "a"), (1, "b"), (2, "c")]
+
+
+def test_exception_is_propagated_to_every_caller_of_the_batch():
+    def run_batch(images, options):
+        raise RuntimeError("session failed")
+
+    async def run():
+        scheduler = MicroBatchScheduler(run_batch, max_batch_size=2, max_wait_ms=50)
+        try:
+            results = await asyncio.gather(
+                scheduler.submit(image(0)), scheduler.submit(image(1)), return_exceptions=True
+            )
+            # the scheduler keeps running
+            with pytest.raises(RuntimeError):
+                await scheduler.submit(image(2))
+            return results
+        finally:
+            await scheduler.stop()
+
+    results = asyncio.run(run())
+    assert all(isinstance(el, RuntimeError) and str(el) == "session failed" for el in results)
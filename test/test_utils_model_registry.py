@@ -0,0 +1,108 @@
+import os
+
+import numpy as np
+import pytest
+
+from utils_model_registry import ModelRegistry
+
+
+def registry(folder, **config) -> ModelRegistry:
+    return ModelRegistry({
+        "MODEL_FOLDER_DATA": str(folder),
+        "MODEL_FILENAME": "a.onnx",
+        "MODEL_IMAGE_SIZE": (64, 64),
+        "MODEL_PRECISION": "fp32",
+        "MODEL_TH_SCORE": 0.5,
+        "MODEL_OUTPUT_FORMAT": "yolov8",
+        "ONNX_OPTIMIZED_MODEL_CACHE": False,
+        "ONNX_IO_BINDING": False,
+        **config
+    })
+
+
+@pytest.fixture
+def folder(tmp_path, tiny_model_bytes):
+    for name in ("a", "b", "c"):
+        (tmp_path / f"{name}.onnx").write_bytes(tiny_model_bytes)
+    return tmp_path
+
+
+def test_available_models(folder):
+    (folder / "a.optimized.0123.onnx").write_bytes(b"")
+    assert registry(folder).available_models() == ["a", "b", "c"]
+    with pytest.raises(KeyError):
+        registry(folder).get("d")
+
+
+def test_lru_eviction_by_max_models(folder):
+    models = registry(folder, REGISTRY_MAX_MODELS=2)
+    a = models.get()
+    models.get("b")
+    # a is used again: b is the least recently used model
+    assert models.get_loaded("a") is a
+    models.get("c")
+    assert list(models.loaded_models()) == ["a", "c"]
+    assert models.get_loaded("b") is None
+
+    # a request that still holds an evicted model finishes on it
+    models.get("b")
+    assert list(models.loaded_models()) == ["c", "b"]
+    assert a.run(np.zeros((1, 3, 64, 64), dtype=np.float32))[0].shape[0] == 1
+
+
+def test_lru_eviction_by_max_bytes(folder):
+    size = os.path.getsize(folder / "a.onnx")
+    models = registry(folder, REGISTRY_MAX_MODELS=3, REGISTRY_MAX_BYTES=2 * size)
+    for name in ("a", "b", "c"):
+        models.get(name)
+    assert list(models.loaded_models()) == ["b", "c"]
+
+    # a single model is kept even if it exceeds the limit
+    models = registry(folder, REGISTRY_MAX_MODELS=3, REGISTRY_MAX_BYTES=size // 2)
+    models.get("a")
+    models.get("b")
+    assert list(models.loaded_models()) == ["b"]
+
+
+def test_reload_swaps_version(folder):
+    from tools.benchmark_pipeline import tiny_model
+
+    models = registry(folder)
+    changed = []
+    models.on_change(changed.append)
+
+    # loading a model that was not loaded before is no change
+    old = models.reload("b")
+    assert changed == []
+    assert models.get("b") is old
+
+    (folder / "b.onnx").write_bytes(tiny_model((64, 64), n_classes=2))
+    new = models.reload("b")
+    assert new is not old and new.model_hash != old.model_hash
+    assert models.get("b") is new
+    assert changed == [new]
+
+    # both versions can be used (requests in flight finish on the old one)
+    img = np.zeros((1, 3, 64, 64), dtype=np.float32)
+    assert old.run(img)[0].shape[1] == 4 + 4
+    assert new.run(img)[0].shape[1] == 4 + 2
+
+
+def test_failed_reload_keeps_active_version(folder):
+    models = registry(folder)
+    model = models.get("b")
+    (folder / "b.onnx").write_bytes(b"no model")
+    with pytest.raises(Exception):
+        models.reload("b")
+    assert models.get("b") is model
+
+
+def test_reload_invalidates_result_cache(inference):
+    model = inference.REGISTRY.get()
+    key = inference.RESULT_CACHE.make_key(b"image", model.name)
+    results = (np.zeros((0, 4)), np.zeros(0, dtype=int), np.zeros(0))
+    inference.RESULT_CACHE.put(key, model.name, results)
+    assert inference.RESULT_CACHE.get(key) is not None
+
+    inference.REGISTRY.reload()
+    assert inference.RESULT_CACHE.get(key) is None
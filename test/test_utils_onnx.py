@@ -0,0 +1,70 @@
+import numpy as np
+import onnx
+import onnxruntime as ort
+from onnx import helper, TensorProto, numpy_helper
+
+from utils_onnx import SessionBinding, create_inference_session, get_path_to_optimized_model
+
+
+def make_session(output_shape, reshape) -> ort.InferenceSession:
+    """Input [batch, 14] reshaped to `reshape` (e.g. [-1, 7]) and declared as output of shape `output_shape`."""
+    graph = helper.make_graph(
+        [helper.make_node("Reshape", ["images", "shape"], ["output"])],
+        "reshape",
+        [helper.make_tensor_value_info("images", TensorProto.FLOAT, ["batch", 14])],
+        [helper.make_tensor_value_info("output", TensorProto.FLOAT, output_shape)],
+        [numpy_helper.from_array(np.array(reshape, dtype=np.int64), "shape")]
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    return ort.InferenceSession(model.SerializeToString(), providers=["CPUExecutionProvider"])
+
+
+def test_output_with_batch_dimension_is_preallocated():
+    binding = SessionBinding(make_session(["batch", 2, 7], [-1, 2, 7]))
+    assert binding.static_output
+
+    x = np.arange(3 * 14, dtype=np.float32).reshape(3, 14)
+    output, = binding.run(x)
+    np.testing.assert_array_equal(output, x.reshape(3, 2, 7))
+
+
+def test_dynamic_first_dimension_that_is_not_the_batch():
+    # e.g. YOLOv7 exported with NMS: ["n", 7] (number of detections)
+    binding = SessionBinding(make_session(["n", 7], [-1, 7]))
+    assert not binding.static_output
+
+    for batch_size in (1, 3):
+        x = np.arange(batch_size * 14, dtype=np.float32).reshape(batch_size, 14)
+        output, = binding.run(x)
+        np.testing.assert_array_equal(output, x.reshape(-1, 7))
+
+
+def test_optimized_model_cache(tmp_path, tiny_model_bytes):
+    from tools.benchmark_pipeline import tiny_model
+
+    folder_models, folder_cache = tmp_path / "data", tmp_path / "cache"
+    folder_models.mkdir()
+    path_to_model = folder_models / "model.onnx"
+    path_to_model.write_bytes(tiny_model_bytes)
+    # graph of another model in the same cache folder
+    folder_cache.mkdir()
+    path_other = folder_cache / "other.optimized.0123456789ab.onnx"
+    path_other.write_bytes(b"")
+    config = {"ONNX_OPTIMIZED_MODEL_CACHE": True, "ONNX_OPTIMIZED_MODEL_FOLDER": str(folder_cache)}
+
+    create_inference_session(path_to_model, config)
+    path_to_cache = get_path_to_optimized_model(path_to_model, config)
+    assert path_to_cache.is_file() and path_to_cache.parent == folder_cache
+    # nothing is written to the model folder
+    assert list(folder_models.iterdir()) == [path_to_model]
+    # loaded from the cache
+    create_inference_session(path_to_model, config)
+    assert path_to_cache.is_file()
+
+    # a new version of the model replaces the stale graph
+    path_to_model.write_bytes(tiny_model((64, 64), n_classes=2))
+    create_inference_session(path_to_model, config)
+    assert not path_to_cache.exists()
+    assert sorted(el.name for el in folder_cache.glob("*.onnx")) == \
+        sorted([get_path_to_optimized_model(path_to_model, config).name, path_other.name])
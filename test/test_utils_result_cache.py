@@ -0,0 +1,33 @@
+import time
+
+import numpy as np
+
+from utils_result_cache import ResultCache, CACHE_BYTES
+
+
+def results(n: int):
+    return np.zeros((n, 4), dtype=np.float32), np.zeros(n, dtype=np.int32), np.zeros(n, dtype=np.float32)
+
+
+def test_expired_entry_updates_memory_gauge():
+    cache = ResultCache(max_bytes=2 ** 20, ttl=0.05)
+    key = ResultCache.make_key(b"image", "model")
+    cache.put(key, "model", results(10))
+    assert CACHE_BYTES._value.get() == cache.info()["bytes"] > 0
+
+    time.sleep(0.1)
+    assert cache.get(key) is None
+    assert cache.info()["bytes"] == 0
+    assert CACHE_BYTES._value.get() == 0
+
+
+def test_lru_eviction_and_invalidation_update_memory_gauge():
+    size = sum(el.nbytes for el in results(10)) + ResultCache.BYTES_PER_ENTRY
+    cache = ResultCache(max_bytes=2 * size)
+    for i in range(3):
+        cache.put(ResultCache.make_key(bytes([i]), "model"), "model", results(10))
+    assert cache.info()["entries"] == 2
+    assert CACHE_BYTES._value.get() == 2 * size
+
+    cache.invalidate("model")
+    assert CACHE_BYTES._value.get() == 0
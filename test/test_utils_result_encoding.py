@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from utils_result_encoding import (
+    HEADER,
+    MEDIA_TYPE_RESULTS,
+    accepts_binary_results,
+    encode_results,
+    encode_results_list,
+    decode_results,
+    decode_results_list
+)
+
+
+def results(n: int):
+    rng = np.random.default_rng(n)
+    return (
+        rng.uniform(0, 640, (n, 4)).astype(np.float32),
+        rng.integers(0, 80, n).astype(np.int64),
+        rng.uniform(0, 1, n).astype(np.float32)
+    )
+
+
+@pytest.mark.parametrize("n", [0, 1, 7])
+def test_round_trip(n):
+    bboxes, class_ids, scores = results(n)
+    data = encode_results(bboxes, class_ids, scores)
+    assert len(data) == HEADER.size + n * 24
+
+    (bboxes_, class_ids_, scores_), offset = decode_results(data)
+    assert offset == len(data)
+    assert bboxes_.shape == (n, 4) and class_ids_.shape == (n,) and scores_.shape == (n,)
+    np.testing.assert_array_equal(bboxes_, bboxes)
+    np.testing.assert_array_equal(class_ids_, class_ids)
+    np.testing.assert_array_equal(scores_, scores)
+
+
+def test_round_trip_list():
+    batch = [results(3), results(0), results(2)]
+    decoded = decode_results_list(encode_results_list(batch))
+    assert [len(el[2]) for el in decoded] == [3, 0, 2]
+    for (bboxes, class_ids, scores), (bboxes_, class_ids_, scores_) in zip(batch, decoded):
+        np.testing.assert_array_equal(bboxes_, bboxes)
+        np.testing.assert_array_equal(class_ids_, class_ids)
+        np.testing.assert_array_equal(scores_, scores)
+
+
+@pytest.mark.parametrize("header", [b"XX\x01\x00", b"IR\x02\x00"])
+def test_unknown_magic_or_version(header):
+    data = bytearray(encode_results(*results(2)))
+    data[:4] = header
+    with pytest.raises(ValueError, match="Unknown binary encoding"):
+        decode_results(bytes(data))
+
+
+@pytest.mark.parametrize("length", [0, 3, HEADER.size, HEADER.size + 24])
+def test_truncated_payload(length):
+    data = encode_results(*results(2))[:length]
+    with pytest.raises(ValueError, match="Truncated"):
+        decode_results(data)
+
+
+def test_accepts_binary_results():
+    assert accepts_binary_results(f"application/json, {MEDIA_TYPE_RESULTS};q=0.9")
+    assert not accepts_binary_results("application/json")
+    assert not accepts_binary_results(None)
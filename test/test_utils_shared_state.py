@@ -0,0 +1,42 @@
+import time
+from threading import Event
+
+from utils_shared_state import SharedState
+
+
+def wait_for(state: SharedState, key: str, expected: bytes, timeout: float = 5) -> bytes:
+    t_end = time.monotonic() + timeout
+    while time.monotonic() < t_end:
+        value = state.get(key)
+        if value == expected:
+            break
+        time.sleep(0.01)
+    return value
+
+
+def test_shared_state_last_write_wins(tmp_path):
+    state = SharedState(tmp_path)
+    release = Event()
+    serialized = []
+
+    def serialize(value):
+        serialized.append(value)
+        if value == 1:
+            release.wait(5)
+        return str(value).encode()
+
+    state.set("image", 1, serialize=serialize)
+    while not serialized:
+        time.sleep(0.01)
+    # written while the writer is busy: only the latest value is serialized
+    state.set("image", 2, serialize=serialize)
+    state.set("image", 3, serialize=serialize)
+    release.set()
+
+    assert wait_for(state, "image", b"3") == b"3"
+    assert serialized == [1, 3]
+
+
+def test_shared_state_counter(tmp_path):
+    state = SharedState(tmp_path)
+    assert [state.increment("counter") for _ in range(3)] == [0, 1, 2]
@@ -0,0 +1,290 @@
+import json
+import os
+import platform
+import sys
+from argparse import ArgumentParser
+from datetime import datetime
+from pathlib import Path
+from timeit import default_timer
+
+import cv2
+import numpy as np
+import onnxruntime as ort
+from onnx import helper, numpy_helper, TensorProto
+
+from typing import List, Tuple, Dict, Any
+
+from Inference.utils_image_cv2 import (
+    decode_image_reduced,
+    prepare_image,
+    precision_to_type,
+    postprocess_batch,
+    get_letterbox_transform,
+    BufferPool
+)
+from Inference.utils_onnx import SessionBinding
+from tools.benchmark_raw_input import synthetic_image
+
+
+STAGES = ["decode", "preprocess", "onnx", "postprocess", "rescale", "total"]
+# typical camera resolutions (height, width, channels)
+CAMERA_RESOLUTIONS = [(1080, 1440, 3), (1080, 1920, 3), (2048, 2448, 3)]
+
+
+def tiny_model(image_size: Tuple[int, int], n_classes: int = 80) -> bytes:
+    """
+    Tiny YOLOv8-like ONNX graph with random (seeded) weights: strided convolutions and a raw head
+    [batch, 4 + classes, anchors] on three scales (8400 anchors for 640x640). The batch axis is dynamic.
+    """
+    rng = np.random.default_rng(0)
+    nodes, initializers = [], []
+
+    def conv(name: str, x: str, c_in: int, c_out: int, stride: int, bias: np.ndarray = None) -> str:
+        w = rng.normal(0, 1 / np.sqrt(c_in * 9), (c_out, c_in, 3, 3)).astype(np.float32)
+        b = np.zeros(c_out, dtype=np.float32) if bias is None else bias
+        initializers.extend([numpy_helper.from_array(w, f"{name}.w"), numpy_helper.from_array(b, f"{name}.b")])
+        nodes.append(helper.make_node(
+            "Conv",
+            [x, f"{name}.w", f"{name}.b"],
+            [name],
+            name=name,
+            kernel_shape=[3, 3],
+            strides=[stride] * 2,
+            pads=[1] * 4
+        ))
+        return name
+
+    # low class scores (background) with some candidates above typical thresholds
+    bias_head = np.concatenate([np.zeros(4), np.full(n_classes, -2)]).astype(np.float32)
+    x = conv("stem", "images", 3, 16, 8)
+    heads = []
+    for i in range(3):
+        if i > 0:
+            x = conv(f"down{i}", x, 16, 16, 2)
+        x_act = f"act{i}"
+        nodes.append(helper.make_node("Relu", [x], [x_act], name=x_act))
+        head = conv(f"head{i}", x_act, 16, 4 + n_classes, 1, bias=bias_head)
+        nodes.append(helper.make_node("Reshape", [head, "shape_head"], [f"{head}.flat"], name=f"{head}.flat"))
+        heads.append(f"{head}.flat")
+    nodes.extend([
+        helper.make_node("Concat", heads, ["raw"], name="concat", axis=2),
+        helper.make_node("Sigmoid", ["raw"], ["sigmoid"], name="sigmoid"),
+        # (cx, cy) in pixels, (w, h) up to 1/4 of the image, class scores in [0, 1]
+        helper.make_node("Mul", ["sigmoid", "scale"], ["output"], name="scale"),
+    ])
+    height, width = image_size
+    scale = np.ones((1, 4 + n_classes, 1), dtype=np.float32)
+    scale[0, :4, 0] = [width, height, width / 4, height / 4]
+    initializers.extend([
+        numpy_helper.from_array(np.array([0, 4 + n_classes, -1], dtype=np.int64), "shape_head"),
+        numpy_helper.from_array(scale, "scale"),
+    ])
+
+    graph = helper.make_graph(
+        nodes,
+        "tiny_yolo",
+        [helper.make_tensor_value_info("images", TensorProto.FLOAT, ["batch", 3, height, width])],
+        [helper.make_tensor_value_info("output", TensorProto.FLOAT, ["batch", 4 + n_classes, "anchors"])],
+        initializers
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    return model.SerializeToString()
+
+
+def load_image_sets(folder: Path, resolutions: List[Tuple[int, ...]], quality: int = 90) -> Dict[str, List[bytes]]:
+    """Encoded images per set: the images of `folder` and synthetic frames per camera resolution."""
+    image_sets = dict()
+    files = sorted(fl for fl in folder.glob("*") if fl.suffix.lower() in (".jpg", ".jpeg", ".png"))
+    if files:
+        image_sets[folder.name] = [fl.read_bytes() for fl in files]
+    for shape in resolutions:
+        img = synthetic_image(shape)
+        image_sets["x".join(str(el) for el in shape[:2])] = [
+            cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+        ]
+    return image_sets
+
+
+def run_pipeline(
+        session: ort.InferenceSession,
+        images: List[bytes],
+        image_size: Tuple[int, int],
+        batch_size: int,
+        repeats: int,
+        warmup: int = 3,
+        io_binding: bool = True,
+        output_format: str = "yolov8",
+        th_score: float = 0.25,
+        th_iou: float = 0.45,
+        precision: str = "fp32"
+) -> Dict[str, np.ndarray]:
+    """Durations (seconds) of each stage per batch; the images are cycled in order (reproducible batches)."""
+    binding = SessionBinding(session) if io_binding else None
+    input_name = session.get_inputs()[0].name
+    pool = BufferPool()
+    durations = {el: [] for el in STAGES}
+
+    for i in range(warmup + repeats):
+        batch = [images[(i * batch_size + j) % len(images)] for j in range(batch_size)]
+        t = [default_timer()]
+        # as Inference/main.py: reduced decoding, letterbox into a pooled batch tensor, session, postprocessing
+        decoded = [decode_image_reduced(el, image_size, rgb=False) for el in batch]
+        t.append(default_timer())
+        img_mdl = pool.acquire((batch_size, 3, *image_size), precision_to_type(precision))
+        for j, (img, _) in enumerate(decoded):
+            prepare_image(img, image_size, precision, bgr=True, out=img_mdl[j:(j + 1)])
+        t.append(default_timer())
+        output = binding.run(img_mdl) if binding is not None else session.run(None, {input_name: img_mdl})
+        t.append(default_timer())
+        results = postprocess_batch(output, th_score, batch_size, output_format, th_iou=th_iou)
+        t.append(default_timer())
+        for (img, shape_src), (bboxes, _, _) in zip(decoded, results):
+            bboxes = get_letterbox_transform(img.shape[:2], image_size).inverse(bboxes)
+            bboxes *= np.tile([shape_src[1] / img.shape[1], shape_src[0] / img.shape[0]], 2).astype(np.float32)
+        t.append(default_timer())
+        pool.release(img_mdl)
+
+        if i >= warmup:
+            for stage, dt in zip(STAGES, np.diff(t)):
+                durations[stage].append(dt)
+            durations["total"].append(t[-1] - t[0])
+    return {ky: np.asarray(vl) for ky, vl in durations.items()}
+
+
+def summarize(durations: Dict[str, np.ndarray], batch_size: int) -> Dict[str, Dict[str, float]]:
+    """Percentiles (ms per batch) and throughput (images/s) per stage."""
+    return {
+        stage: {
+            "p50_ms": float(np.percentile(dt, 50) * 1000),
+            "p95_ms": float(np.percentile(dt, 95) * 1000),
+            "p99_ms": float(np.percentile(dt, 99) * 1000),
+            "images_per_second": float(batch_size / dt.mean())
+        }
+        for stage, dt in durations.items()
+    }
+
+
+def result_key(result: Dict[str, Any]) -> str:
+    return f"{result['images']} | batch {result['batch_size']} | threads {result['threads']}"
+
+
+def compare_to_baseline(
+        results: List[Dict[str, Any]],
+        baseline: List[Dict[str, Any]],
+        tolerance: float,
+        metric: str = "p50_ms"
+) -> List[str]:
+    """Regressions: stages whose `metric` is more than `tolerance` (fraction) slower than in the baseline."""
+    baseline = {result_key(el): el for el in baseline}
+    regressions = []
+    for res in results:
+        base = baseline.get(result_key(res))
+        if base is None:
+            continue
+        for stage, stats in res["stages"].items():
+            if stage not in base["stages"]:
+                continue
+            ratio = stats[metric] / max(base["stages"][stage][metric], 1e-9)
+            if ratio > 1 + tolerance:
+                regressions.append(
+                    f"{result_key(res)} | {stage}: {metric} {stats[metric]:.4g} vs. "
+                    f"{base['stages'][stage][metric]:.4g} (+{ratio - 1:.0%})"
+                )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Per-stage benchmark of the inference pipeline (decode, preprocess, ONNX session, postprocess, "
+                    "rescale) with a tiny generated model; compares against a stored baseline."
+    )
+    parser.add_argument("--images", type=str, default="test/test_images", help="folder of test images")
+    parser.add_argument(
+        "--resolutions",
+        type=str,
+        nargs="*",
+        default=["x".join(str(vl) for vl in el[:2]) for el in CAMERA_RESOLUTIONS],
+        help="synthetic frames (height x width), e.g. 2048x2448"
+    )
+    parser.add_argument("--model", type=str, default=None, help="ONNX model (default: tiny generated model)")
+    parser.add_argument("--image-size", type=int, nargs=2, default=[640, 640], help="model input (height width)")
+    parser.add_argument("--output-format", type=str, default="yolov8", help="see [model] output_format")
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4], help="intra-op threads of ONNX Runtime")
+    parser.add_argument("--repeats", type=int, default=30, help="batches per configuration")
+    parser.add_argument("--warmup", type=int, default=3, help="batches per configuration that are not measured")
+    parser.add_argument("--no-io-binding", action="store_true")
+    parser.add_argument("--output", type=str, default=None, help="write the results as JSON")
+    parser.add_argument("--baseline", type=str, default=None, help="JSON of a previous run to compare against")
+    parser.add_argument("--update-baseline", action="store_true", help="write the results to --baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slow-down (fraction) per stage")
+    parser.add_argument("--metric", type=str, default="p50_ms", choices=["p50_ms", "p95_ms", "p99_ms"])
+    args = parser.parse_args()
+
+    image_size = tuple(args.image_size)
+    resolutions = [(*(int(el) for el in res.split("x")), 3) for res in args.resolutions]
+    image_sets = load_image_sets(Path(args.images), resolutions)
+    model = Path(args.model).read_bytes() if args.model else tiny_model(image_size)
+
+    results = []
+    for threads in args.threads:
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        session = ort.InferenceSession(model, sess_options=options, providers=["CPUExecutionProvider"])
+        for batch_size in args.batch_size:
+            for name, images in image_sets.items():
+                durations = run_pipeline(
+                    session,
+                    images,
+                    image_size,
+                    batch_size,
+                    args.repeats,
+                    warmup=args.warmup,
+                    io_binding=not args.no_io_binding,
+                    output_format=args.output_format
+                )
+                res = {
+                    "images": name,
+                    "batch_size": batch_size,
+                    "threads": threads,
+                    "stages": summarize(durations, batch_size)
+                }
+                results.append(res)
+                print(result_key(res))
+                for stage, stats in res["stages"].items():
+                    print(
+                        f"    {stage:<12} p50 {stats['p50_ms']:8.3f} ms | p95 {stats['p95_ms']:8.3f} ms | "
+                        f"p99 {stats['p99_ms']:8.3f} ms | {stats['images_per_second']:9.1f} images/s"
+                    )
+
+    report = {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "model": args.model or "tiny generated model",
+            "image_size": image_size,
+            "repeats": args.repeats,
+            "io_binding": not args.no_io_binding,
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "onnxruntime": ort.__version__,
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+        },
+        "results": results
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+    if args.baseline and args.update_baseline:
+        Path(args.baseline).write_text(json.dumps(report, indent=2))
+        print(f"Baseline written to {args.baseline}.")
+    elif args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        regressions = compare_to_baseline(results, baseline["results"], args.tolerance, args.metric)
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%} compared with {args.baseline}:")
+            print("\n".join(f"    {el}" for el in regressions))
+            sys.exit(1)
+        print(f"No regression beyond {args.tolerance:.0%} compared with {args.baseline}.")
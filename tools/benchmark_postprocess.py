@@ -0,0 +1,114 @@
+from argparse import ArgumentParser
+from timeit import default_timer
+
+import numpy as np
+from onnx import helper, numpy_helper, TensorProto
+import onnxruntime as ort
+
+from typing import Callable
+
+from Inference.utils_image_cv2 import postprocess_raw
+
+
+def synthetic_raw_output(batch_size: int, n_classes: int, n_anchors: int, n_objects: int = 20) -> np.ndarray:
+    """Raw YOLOv8 head [batch, 4 + classes, anchors]: low background scores and clusters of boxes around objects."""
+    rng = np.random.default_rng(0)
+    output = np.zeros((batch_size, 4 + n_classes, n_anchors), dtype=np.float32)
+    output[:, :2] = rng.uniform(0, 640, (batch_size, 2, n_anchors))
+    output[:, 2:4] = rng.uniform(8, 200, (batch_size, 2, n_anchors))
+    output[:, 4:] = rng.uniform(0, 0.05, (batch_size, n_classes, n_anchors))
+    for b in range(batch_size):
+        for _ in range(n_objects):
+            # ~30 anchors per object with jittered boxes
+            idx = rng.choice(n_anchors, 30, replace=False)
+            output[b, :4, idx] = rng.uniform(50, 500, 4) + rng.normal(0, 3, (30, 4))
+            output[b, 4 + rng.integers(n_classes), idx] = rng.uniform(0.3, 0.95, 30)
+    return output
+
+
+def nms_model(n_classes: int, th_score: float, th_iou: float, max_detections: int) -> bytes:
+    """
+    ONNX graph with the NMS of an end-to-end export: raw head -> NonMaxSuppression -> selected boxes.
+    (ONNX's NMS is multi-label, i.e. an anchor may be selected for several classes; postprocess_raw keeps the best
+    class per anchor.)
+    """
+    nodes = [
+        helper.make_node("Transpose", ["output"], ["output_t"], perm=[0, 2, 1]),
+        helper.make_node("Slice", ["output_t", "zero", "four", "two"], ["boxes"]),
+        helper.make_node("Slice", ["output", "four", "end", "one"], ["scores"]),
+        helper.make_node(
+            "NonMaxSuppression",
+            ["boxes", "scores", "max_output", "iou_threshold", "score_threshold"],
+            ["selected"],
+            center_point_box=1
+        ),
+        # boxes of the selected indices (batch, anchor)
+        helper.make_node("Gather", ["selected", "idx_batch_anchor"], ["selected_ba"], axis=1),
+        helper.make_node("GatherND", ["boxes", "selected_ba"], ["bboxes"]),
+    ]
+    initializers = [
+        numpy_helper.from_array(np.array([0], np.int64), "zero"),
+        numpy_helper.from_array(np.array([1], np.int64), "one"),
+        numpy_helper.from_array(np.array([2], np.int64), "two"),
+        numpy_helper.from_array(np.array([4], np.int64), "four"),
+        numpy_helper.from_array(np.array([4 + n_classes], np.int64), "end"),
+        numpy_helper.from_array(np.array([max_detections], np.int64), "max_output"),
+        numpy_helper.from_array(np.array([th_iou], np.float32), "iou_threshold"),
+        numpy_helper.from_array(np.array([th_score], np.float32), "score_threshold"),
+        numpy_helper.from_array(np.array([0, 2], np.int64), "idx_batch_anchor"),
+    ]
+    graph = helper.make_graph(
+        nodes,
+        "nms",
+        [helper.make_tensor_value_info("output", TensorProto.FLOAT, ["batch", 4 + n_classes, "anchors"])],
+        [
+            helper.make_tensor_value_info("selected", TensorProto.INT64, ["n", 3]),
+            helper.make_tensor_value_info("bboxes", TensorProto.FLOAT, ["n", 4]),
+        ],
+        initializers
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    return model.SerializeToString()
+
+
+def measure(func: Callable, n_repeats: int) -> float:
+    func()  # warm-up
+    t0 = default_timer()
+    for _ in range(n_repeats):
+        func()
+    return (default_timer() - t0) / n_repeats
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="NumPy/OpenCV postprocessing of raw YOLO heads vs. NMS in the ONNX graph.")
+    parser.add_argument("--classes", type=int, default=80)
+    parser.add_argument("--anchors", type=int, default=8400, help="8400 for 640x640 (YOLOv8)")
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--th-score", type=float, default=0.25)
+    parser.add_argument("--th-iou", type=float, default=0.45)
+    parser.add_argument("--threads", type=int, default=1, help="intra-op threads of ONNX Runtime")
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = args.threads
+    session = ort.InferenceSession(
+        nms_model(args.classes, args.th_score, args.th_iou, 300),
+        sess_options=options,
+        providers=["CPUExecutionProvider"]
+    )
+
+    for batch_size in args.batch_size:
+        output = synthetic_raw_output(batch_size, args.classes, args.anchors)
+
+        dt_graph = measure(lambda: session.run(None, {"output": output}), args.repeats)
+        dt_numpy = measure(lambda: postprocess_raw(output, args.th_score, args.th_iou, 300), args.repeats)
+        n_graph = len(session.run(None, {"output": output})[0])
+        n_numpy = sum(len(el[2]) for el in postprocess_raw(output, args.th_score, args.th_iou, 300))
+
+        print(
+            f"batch size {batch_size}, [{batch_size}, {4 + args.classes}, {args.anchors}]: "
+            f"in-graph NMS {dt_graph * 1000:.3g} ms ({n_graph} boxes), "
+            f"postprocess_raw {dt_numpy * 1000:.3g} ms ({n_numpy} boxes)"
+        )
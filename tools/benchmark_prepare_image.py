@@ -0,0 +1,63 @@
+import tracemalloc
+from argparse import ArgumentParser
+from timeit import default_timer
+
+import cv2
+import numpy as np
+
+from typing import Callable, Tuple
+
+from Inference.utils_image_cv2 import letterbox, prepare_image, precision_to_type, BufferPool
+
+
+def prepare_image_legacy(image: np.ndarray, shape: Tuple[int, int], precision: str = None) -> np.ndarray:
+    # previous implementation: RGB conversion, letterbox, moveaxis, division by 255.0 (float64), batch axis, cast
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    img_sml = letterbox(image, new_shape=shape, stride=32)[0]
+    img_mdl = np.moveaxis(img_sml, (2, 0, 1), (0, 1, 2))
+    img_nrm = img_mdl / 255.0
+    img_btc = img_nrm[np.newaxis, ...]
+    return img_btc.astype(precision_to_type(precision)) if precision is not None else img_btc
+
+
+def measure(func: Callable, n_repeats: int) -> Tuple[float, float]:
+    # warm-up (allocates thread-local and pooled buffers)
+    func()
+    # timing
+    t0 = default_timer()
+    for _ in range(n_repeats):
+        func()
+    dt = (default_timer() - t0) / n_repeats
+    # peak memory of a single call (numpy reports its allocations to tracemalloc)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return dt, peak
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Microbenchmark of the image preprocessing (prepare_image).")
+    parser.add_argument("--model-size", type=int, nargs=2, default=(640, 640), help="model input (height width)")
+    parser.add_argument("--precision", type=str, default="fp32")
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+
+    pool = BufferPool()
+
+    def fused(img_: np.ndarray):
+        pool.release(prepare_image(img_, args.model_size, args.precision, bgr=True, buffer_pool=pool))
+
+    # 640x640 and typical full camera resolutions (height, width)
+    for resolution in [(640, 640), (1080, 1440), (1944, 2592), (2048, 2448)]:
+        img = np.random.randint(0, 255, (*resolution, 3), dtype=np.uint8)
+
+        dt_legacy, mem_legacy = measure(lambda: prepare_image_legacy(img, args.model_size, args.precision), args.repeats)
+        dt_fused, mem_fused = measure(lambda: fused(img), args.repeats)
+
+        print(
+            f"{resolution[1]}x{resolution[0]} -> {args.model_size[1]}x{args.model_size[0]} ({args.precision}): "
+            f"legacy {dt_legacy * 1000:.3g} ms / {mem_legacy / 2 ** 20:.3g} MiB, "
+            f"fused {dt_fused * 1000:.3g} ms / {mem_fused / 2 ** 20:.3g} MiB "
+            f"(saved {(dt_legacy - dt_fused) * 1000:.3g} ms, {(mem_legacy - mem_fused) / 2 ** 20:.3g} MiB per frame)"
+        )
@@ -0,0 +1,67 @@
+from argparse import ArgumentParser
+from timeit import default_timer
+
+import cv2
+import numpy as np
+
+from typing import Callable, Tuple
+
+from Inference.utils_image_cv2 import bytes_to_image_array, raw_to_image_array
+
+
+def measure(func: Callable, n_repeats: int) -> float:
+    func()  # warm-up
+    t0 = default_timer()
+    for _ in range(n_repeats):
+        func()
+    return (default_timer() - t0) / n_repeats
+
+
+def synthetic_image(shape: Tuple[int, ...]) -> np.ndarray:
+    # smooth gradients + noise: compresses like a camera image rather than like pure noise
+    height, width = shape[:2]
+    y, x = np.mgrid[0:height, 0:width]
+    img = (127 + 60 * np.sin(x / 37) * np.cos(y / 53) + np.random.normal(0, 8, (height, width))).clip(0, 255)
+    img = img.astype(np.uint8)
+    return np.repeat(img[..., np.newaxis], shape[2], axis=2) if len(shape) == 3 else img
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Cost of sending a frame JPEG-encoded (encode + transfer + decode) vs. uncompressed "
+                    "(transfer only) and the link speed at which both break even."
+    )
+    parser.add_argument("--image", type=str, default=None, help="image file (default: synthetic images)")
+    parser.add_argument("--quality", type=int, nargs="+", default=[100, 90, 75], help="JPEG quality")
+    parser.add_argument("--bandwidth", type=float, nargs="+", default=[100, 1000, 10000], help="link speed in Mbit/s")
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.image:
+        images = [cv2.imread(args.image, cv2.IMREAD_UNCHANGED)]
+    else:
+        # typical camera resolutions (height, width, channels)
+        images = [synthetic_image(el) for el in [(1080, 1440), (1080, 1440, 3), (2048, 2448), (2048, 2448, 3)]]
+
+    for img in images:
+        raw_bytes = img.tobytes()
+        t_wrap = measure(lambda: raw_to_image_array(raw_bytes, img.shape, img.dtype), args.repeats)
+        for quality in args.quality:
+            jpg_bytes = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+            t_encode = measure(lambda: cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality]), args.repeats)
+            t_decode = measure(lambda: bytes_to_image_array(jpg_bytes, rgb=False), args.repeats)
+
+            # bandwidth (bytes/s) at which the transfer of the additional bytes takes as long as encoding + decoding
+            crossover = (len(raw_bytes) - len(jpg_bytes)) / (t_encode + t_decode - t_wrap)
+
+            print(
+                f"{'x'.join(str(el) for el in img.shape)}, quality {quality}: "
+                f"raw {len(raw_bytes) / 2 ** 20:.3g} MiB, JPEG {len(jpg_bytes) / 2 ** 20:.3g} MiB; "
+                f"encode {t_encode * 1000:.3g} ms + decode {t_decode * 1000:.3g} ms "
+                f"(wrap raw {t_wrap * 1e6:.3g} us) => raw is faster above {crossover * 8 / 1e6:.4g} Mbit/s"
+            )
+            for bw in args.bandwidth:
+                bytes_per_second = bw * 1e6 / 8
+                t_jpg = t_encode + len(jpg_bytes) / bytes_per_second + t_decode
+                t_raw = len(raw_bytes) / bytes_per_second + t_wrap
+                print(f"    {bw:g} Mbit/s: JPEG {t_jpg * 1000:.3g} ms, raw {t_raw * 1000:.3g} ms")
@@ -0,0 +1,66 @@
+import json
+from argparse import ArgumentParser
+from timeit import default_timer
+
+import numpy as np
+from fastapi.responses import JSONResponse
+
+from typing import Callable
+
+from utils_result_encoding import encode_results, decode_results
+
+
+def measure(func: Callable, n_repeats: int) -> float:
+    func()  # warm-up
+    t0 = default_timer()
+    for _ in range(n_repeats):
+        func()
+    return (default_timer() - t0) / n_repeats
+
+
+def serialize_json(bboxes: np.ndarray, class_ids: np.ndarray, scores: np.ndarray) -> bytes:
+    # as Inference/main.py: package_results(...) + JSONResponse
+    content = {
+        "bboxes": bboxes.round(1).tolist(),
+        "class_ids": class_ids.tolist(),
+        "scores": scores.round(3).tolist()
+    }
+    return JSONResponse(content=content).body
+
+
+def parse_json(body: bytes):
+    # as Backend/main.py: response.json() + NumPy arrays
+    result = json.loads(body)
+    return (
+        np.asarray(result["bboxes"], dtype=np.float32).reshape(-1, 4),
+        np.asarray(result["class_ids"], dtype=int),
+        np.asarray(result["scores"], dtype=np.float32)
+    )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Serialization and parse time of the inference results: JSON vs. binary.")
+    parser.add_argument("--boxes", type=int, nargs="+", default=[10, 300])
+    parser.add_argument("--repeats", type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    for n in args.boxes:
+        xy = rng.uniform(0, 1000, (n, 2)).astype(np.float32)
+        bboxes = np.concatenate([xy, xy + rng.uniform(10, 200, (n, 2)).astype(np.float32)], axis=1)
+        class_ids = rng.integers(0, 80, n)
+        scores = rng.uniform(0.25, 1, n).astype(np.float32)
+
+        body_json = serialize_json(bboxes, class_ids, scores)
+        body_binary = encode_results(bboxes, class_ids, scores)
+
+        t_json_ser = measure(lambda: serialize_json(bboxes, class_ids, scores), args.repeats)
+        t_json_parse = measure(lambda: parse_json(body_json), args.repeats)
+        t_bin_ser = measure(lambda: encode_results(bboxes, class_ids, scores), args.repeats)
+        t_bin_parse = measure(lambda: decode_results(body_binary), args.repeats)
+
+        print(
+            f"{n} boxes: JSON {len(body_json)} bytes, serialize {t_json_ser * 1e6:.4g} us, "
+            f"parse {t_json_parse * 1e6:.4g} us | binary {len(body_binary)} bytes, "
+            f"serialize {t_bin_ser * 1e6:.4g} us, parse {t_bin_parse * 1e6:.4g} us"
+        )
@@ -0,0 +1,85 @@
+import os
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from timeit import default_timer
+
+import numpy as np
+import requests
+
+from typing import List, Tuple
+
+
+def start_service(folder: Path, prefix: str, port: int, workers: int) -> subprocess.Popen:
+    # the service reads its configuration from environment variables with the prefix of its default_config.toml
+    env = os.environ | {f"{prefix}_SERVER_WORKERS": str(workers), f"{prefix}_SERVER_PORT": str(port)}
+    # shared modules (utils, utils_fastapi, ...) are located in the root of the repository
+    env["PYTHONPATH"] = os.pathsep.join([Path(__file__).parents[1].as_posix(), env.get("PYTHONPATH", "")])
+    return subprocess.Popen([sys.executable, "main.py"], cwd=folder, env=env)
+
+
+def wait_until_ready(url: str, timeout: float = 60) -> None:
+    t_deadline = default_timer() + timeout
+    while default_timer() < t_deadline:
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return
+        except requests.exceptions.ConnectionError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"Service at {url} did not start within {timeout} s.")
+
+
+def generate_load(url: str, image: bytes, concurrency: int, duration: float) -> Tuple[int, List[float]]:
+    t_end = default_timer() + duration
+
+    def client() -> List[float]:
+        latencies = []
+        with requests.Session() as session:
+            while default_timer() < t_end:
+                t0 = default_timer()
+                response = session.post(url, files={"image": ("image.jpg", image, "image/jpeg")}, timeout=30)
+                response.raise_for_status()
+                latencies.append(default_timer() - t0)
+        return latencies
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = [el for lst in executor.map(lambda _: client(), range(concurrency)) for el in lst]
+    return len(latencies), latencies
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Throughput of a service (default: Inference) with an increasing number of worker processes."
+    )
+    parser.add_argument("--image", type=str, required=True, help="image file that is sent with every request")
+    parser.add_argument("--service", type=str, default="Inference", help="folder of the service (main.py)")
+    parser.add_argument("--prefix", type=str, default="IF", help="prefix of the environment variables")
+    parser.add_argument("--entrypoint", type=str, default="/inference")
+    parser.add_argument("--port", type=int, default=5152)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=16, help="number of parallel clients")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of load per worker count")
+    args = parser.parse_args()
+
+    image_bytes = Path(args.image).read_bytes()
+    address = f"http://localhost:{args.port}"
+
+    for n_workers in args.workers:
+        process = start_service(Path(args.service), args.prefix, args.port, n_workers)
+        try:
+            wait_until_ready(address + "/health")
+            # warm-up (lazy allocations of all workers)
+            generate_load(address + args.entrypoint, image_bytes, args.concurrency, 2)
+
+            n, latencies = generate_load(address + args.entrypoint, image_bytes, args.concurrency, args.duration)
+            print(
+                f"workers={n_workers}: {n / args.duration:.4g} requests/s; latency "
+                f"p50={np.percentile(latencies, 50) * 1000:.4g} ms, p95={np.percentile(latencies, 95) * 1000:.4g} ms"
+            )
+        finally:
+            process.terminate()
+            process.wait()
@@ -0,0 +1,282 @@
+import itertools
+import json
+import random
+import tarfile
+import threading
+import time
+import zipfile
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from timeit import default_timer
+
+import numpy as np
+import requests
+
+from typing import Union, List, Tuple, Dict, Any, Iterator
+
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+# method and whether an image is uploaded (multipart field "image")
+ENDPOINTS = {
+    "/inference": ("POST", True),  # Inference service
+    "/main": ("GET", True),  # Backend: uploaded image
+    "/main/with-camera": ("GET", False),  # Backend: triggers the camera
+}
+
+
+def load_images(source: Union[str, Path], max_images: int = None) -> List[Tuple[str, bytes]]:
+    """(name, bytes) of the images in a folder (e.g. the saved images of the Backend) or a .zip / .tar(.gz) archive."""
+    source = Path(source)
+    if source.is_dir():
+        files = sorted(fl for fl in source.rglob("*") if fl.suffix.lower() in IMAGE_EXTENSIONS)[:max_images]
+        images = [(fl.relative_to(source).as_posix(), fl.read_bytes()) for fl in files]
+    elif zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            names = sorted(el for el in archive.namelist() if Path(el).suffix.lower() in IMAGE_EXTENSIONS)[:max_images]
+            images = [(el, archive.read(el)) for el in names]
+    elif tarfile.is_tarfile(source):
+        with tarfile.open(source) as archive:
+            members = sorted(
+                (el for el in archive.getmembers() if el.isfile() and Path(el.name).suffix.lower() in IMAGE_EXTENSIONS),
+                key=lambda el: el.name
+            )[:max_images]
+            images = [(el.name, archive.extractfile(el).read()) for el in members]
+    else:
+        raise ValueError(f"{source} is neither a folder nor a .zip / .tar archive.")
+    if len(images) == 0:
+        raise FileNotFoundError(f"No images found in {source}.")
+    return images
+
+
+def load_replay(path: Union[str, Path], images: Dict[str, bytes] = None) -> List[Dict[str, Any]]:
+    """
+    Requests from a JSON Lines file, one request per line (the format of --records):
+    {"endpoint": "/main", "offset": 0.25, "image": "<file>", "params": {"pattern_key": "..."}}
+    "offset" (seconds since the start) is optional; "image" is a path or a name of the image source.
+    """
+    items = []
+    with open(path, "r") as fid:
+        for ln in fid:
+            if not ln.strip():
+                continue
+            item = json.loads(ln)
+            name = item.get("image")
+            if name and images is not None and name in images:
+                item["image_bytes"] = images[name]
+            elif name:
+                item["image_bytes"] = Path(name).read_bytes()
+            items.append(item)
+    return items
+
+
+class LoadGenerator:
+    """
+    Sends requests to a service and records latency and status of every request.
+    Closed loop: `concurrency` clients send their next request as soon as the previous one returned.
+    Open loop: requests arrive at a fixed rate (or Poisson-distributed) regardless of the responses; if more than
+    `max_in_flight` requests are pending, arriving requests are dropped (recorded with status "dropped").
+    """
+    def __init__(self, url: str, timeout: float = 10, token: str = None):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.headers = {"Authorization": f"Bearer {token}"} if token else dict()
+        self.records: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._t_start = default_timer()
+
+    def _session(self) -> requests.Session:
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _record(self, item: Dict[str, Any], t0: float, latency: Union[float, None], status: Union[int, str]) -> None:
+        record = {
+            "endpoint": item["endpoint"],
+            "offset": round(t0 - self._t_start, 6),
+            "image": item.get("image"),
+            "params": item.get("params", dict()),
+            "latency": latency,
+            "status": status
+        }
+        with self._lock:
+            self.records.append(record)
+
+    def send(self, item: Dict[str, Any]) -> None:
+        method, with_image = ENDPOINTS.get(item["endpoint"], ("POST" if item.get("image_bytes") else "GET", True))
+        files = {"image": (Path(item.get("image") or "image.jpg").name, item["image_bytes"], "image/jpeg")} \
+            if with_image and item.get("image_bytes") is not None else None
+        t0 = default_timer()
+        try:
+            response = self._session().request(
+                method,
+                self.url + item["endpoint"],
+                params=item.get("params"),
+                files=files,
+                headers=self.headers,
+                timeout=self.timeout
+            )
+            status = response.status_code
+        except requests.exceptions.Timeout:
+            status = "timeout"
+        except requests.exceptions.ConnectionError:
+            status = "connection error"
+        self._record(item, t0, default_timer() - t0, status)
+
+    def run_closed_loop(self, items: Iterator[Dict[str, Any]], concurrency: int, duration: float) -> float:
+        self._t_start = default_timer()
+        t_end = self._t_start + duration
+        lock = threading.Lock()
+
+        def client():
+            while default_timer() < t_end:
+                with lock:
+                    item = next(items, None)
+                if item is None:
+                    return
+                self.send(item)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for _ in range(concurrency):
+                executor.submit(client)
+        return default_timer() - self._t_start
+
+    def run_open_loop(
+            self,
+            items: Iterator[Dict[str, Any]],
+            rate: float = None,
+            duration: float = 60,
+            max_in_flight: int = 64,
+            poisson: bool = False,
+            speed: float = 1
+    ) -> float:
+        """Arrivals at `rate` per second, or at the offsets of the items (replay, scaled by `speed`) if rate is None."""
+        in_flight = threading.BoundedSemaphore(max_in_flight)
+
+        def send(item_: Dict[str, Any]):
+            try:
+                self.send(item_)
+            finally:
+                in_flight.release()
+
+        self._t_start = default_timer()
+        t_next = self._t_start
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            for item in items:
+                if rate is not None:
+                    t_next += random.expovariate(rate) if poisson else 1 / rate
+                else:
+                    t_next = self._t_start + float(item.get("offset", 0)) / speed
+                if t_next - self._t_start > duration:
+                    break
+                time.sleep(max(t_next - default_timer(), 0))
+
+                if in_flight.acquire(blocking=False):
+                    executor.submit(send, item)
+                else:
+                    # the service does not keep up with the arrival rate
+                    self._record(item, default_timer(), None, "dropped")
+        return default_timer() - self._t_start
+
+
+def summarize(records: List[Dict[str, Any]], duration: float) -> Dict[str, Any]:
+    latencies = np.array([el["latency"] for el in records if el["status"] == 200])
+    statuses = dict()
+    for el in records:
+        statuses[str(el["status"])] = statuses.get(str(el["status"]), 0) + 1
+    return {
+        "requests": len(records),
+        "ok": len(latencies),
+        "error_rate": 1 - len(latencies) / len(records) if records else 0.0,
+        "throughput": len(latencies) / max(duration, 1e-9),  # successful requests per second
+        "status": statuses,
+        **{
+            f"p{q}_ms": float(np.percentile(latencies, q) * 1000) if len(latencies) else None
+            for q in (50, 90, 95, 99)
+        },
+        "max_ms": float(latencies.max() * 1000) if len(latencies) else None
+    }
+
+
+def timeline(records: List[Dict[str, Any]], duration: float, interval: float) -> List[Dict[str, Any]]:
+    """Summary per time window of `interval` seconds (by the start of the requests)."""
+    windows = []
+    for t0 in np.arange(0, duration, interval):
+        window = [el for el in records if t0 <= el["offset"] < t0 + interval]
+        windows.append({"t": float(t0), **summarize(window, min(interval, duration - t0))})
+    return windows
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Load test of the Inference service (/inference) or the Backend (/main, /main/with-camera) with "
+                    "closed-loop concurrency, an open-loop arrival rate, or a replay of recorded requests."
+    )
+    parser.add_argument("--url", type=str, default="http://localhost:5051", help="address of the service")
+    parser.add_argument("--endpoint", type=str, default="/main", help=", ".join(ENDPOINTS))
+    parser.add_argument("--images", type=str, default="test/test_images", help="folder or .zip / .tar archive")
+    parser.add_argument("--max-images", type=int, default=None)
+    parser.add_argument("--replay", type=str, default=None, help="JSON Lines file of requests (format of --records)")
+    parser.add_argument("--speed", type=float, default=1, help="replay: time scale of the recorded offsets")
+    parser.add_argument(
+        "--params", type=str, nargs="*", default=[], help="query parameters, e.g. pattern_key=A (replay: added)"
+    )
+    parser.add_argument("--concurrency", type=int, default=None, help="closed loop: number of parallel clients")
+    parser.add_argument("--rate", type=float, default=None, help="open loop: requests per second")
+    parser.add_argument("--poisson", action="store_true", help="open loop: exponential inter-arrival times")
+    parser.add_argument("--max-in-flight", type=int, default=64, help="open loop: pending requests before dropping")
+    parser.add_argument("--duration", type=float, default=60, help="seconds")
+    parser.add_argument("--timeout", type=float, default=10, help="seconds per request")
+    parser.add_argument("--token", type=str, default=None, help="access token of the service")
+    parser.add_argument("--interval", type=float, default=5, help="seconds per window of the timeline")
+    parser.add_argument("--output", type=str, default=None, help="write summary and timeline as JSON")
+    parser.add_argument("--records", type=str, default=None, help="write every request as JSON Lines (replayable)")
+    args = parser.parse_args()
+
+    params = dict(el.split("=", 1) for el in args.params)
+    images = load_images(args.images, args.max_images) if args.images and ENDPOINTS.get(args.endpoint, ("", True))[1] \
+        else [(None, None)]
+    generator = LoadGenerator(args.url, args.timeout, args.token)
+
+    if args.replay:
+        replay = load_replay(args.replay, dict(images) if args.images else None)
+        items = iter({**el, "params": {**el.get("params", dict()), **params}} for el in replay)
+        if args.concurrency:
+            duration = generator.run_closed_loop(items, args.concurrency, args.duration)
+        else:
+            duration = generator.run_open_loop(
+                items, args.rate, args.duration, args.max_in_flight, args.poisson, args.speed
+            )
+    else:
+        items = (
+            {"endpoint": args.endpoint, "image": name, "image_bytes": data, "params": params}
+            for name, data in itertools.cycle(images)
+        )
+        if args.rate:
+            duration = generator.run_open_loop(items, args.rate, args.duration, args.max_in_flight, args.poisson)
+        else:
+            duration = generator.run_closed_loop(items, args.concurrency or 1, args.duration)
+
+    records = sorted(generator.records, key=lambda el: el["offset"])
+    summary = summarize(records, duration)
+    windows = timeline(records, duration, args.interval)
+
+    for win in windows:
+        print(
+            f"{win['t']:7.1f} s: {win['requests']:5d} requests, {win['throughput']:7.2f} ok/s, "
+            f"p50 {win['p50_ms'] or float('nan'):8.2f} ms, p95 {win['p95_ms'] or float('nan'):8.2f} ms, "
+            f"errors {win['error_rate']:.1%} {dict((ky, vl) for ky, vl in win['status'].items() if ky != '200')}"
+        )
+    print(
+        f"Total: {summary['requests']} requests in {duration:.3g} s, {summary['throughput']:.3g} ok/s; "
+        f"p50 {summary['p50_ms'] or float('nan'):.4g} ms, p90 {summary['p90_ms'] or float('nan'):.4g} ms, "
+        f"p95 {summary['p95_ms'] or float('nan'):.4g} ms, p99 {summary['p99_ms'] or float('nan'):.4g} ms; "
+        f"error rate {summary['error_rate']:.2%}, status {summary['status']}"
+    )
+
+    if args.output:
+        Path(args.output).write_text(json.dumps({"summary": summary, "timeline": windows}, indent=2))
+    if args.records:
+        with open(args.records, "w") as fid:
+            fid.writelines(json.dumps(el) + "\n" for el in records)
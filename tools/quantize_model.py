@@ -0,0 +1,282 @@
+import tempfile
+from argparse import ArgumentParser
+from pathlib import Path
+from timeit import default_timer
+
+import cv2
+import numpy as np
+import onnx
+import onnxruntime as ort
+from onnxruntime.quantization import (
+    CalibrationDataReader,
+    CalibrationMethod,
+    QuantFormat,
+    QuantType,
+    quantize_static
+)
+from onnxruntime.quantization.shape_inference import quant_pre_process
+
+from typing import Union, List, Tuple, Dict, Iterable
+
+from Inference.utils_image_cv2 import prepare_image, postprocess_batch, get_letterbox_transform
+from Backend.check_boxes import load_patterns, check_boxes
+
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+
+Results = Tuple[np.ndarray, np.ndarray, np.ndarray]  # bboxes, class_ids, scores
+
+
+def find_images(folders: Iterable[Union[str, Path]], max_images: int = None) -> List[Path]:
+    files = sorted(fl for folder in folders for fl in Path(folder).rglob("*") if fl.suffix.lower() in IMAGE_EXTENSIONS)
+    return files[:max_images] if max_images else files
+
+
+def load_model_input(
+        path: Path,
+        image_size: Tuple[int, int],
+        keep_ratio: bool = False
+) -> Tuple[np.ndarray, Tuple[int, int]]:
+    # same preprocessing as the Inference service (BGR image, letterbox, float32 CHW tensor)
+    img = cv2.imread(path.as_posix(), cv2.IMREAD_COLOR)
+    return prepare_image(img, image_size, "fp32", bgr=True, keep_ratio=keep_ratio), img.shape[:2]
+
+
+class ImageCalibrationDataReader(CalibrationDataReader):
+    """Model inputs of a list of images for the calibration of the activation ranges."""
+    def __init__(self, files: List[Path], input_name: str, image_size: Tuple[int, int], keep_ratio: bool = False):
+        self.input_name = input_name
+        self.image_size = image_size
+        self.keep_ratio = keep_ratio
+        self._files = iter(files)
+
+    def get_next(self) -> Union[Dict[str, np.ndarray], None]:
+        path = next(self._files, None)
+        if path is None:
+            return None
+        return {self.input_name: load_model_input(path, self.image_size, self.keep_ratio)[0]}
+
+
+def get_head_nodes(path_to_model: Path) -> List[str]:
+    """
+    Nodes after the last convolution (decoding of the head). Boxes in pixels and scores in [0, 1] often share one
+    tensor there, i.e. a common quantization scale would round the scores to zero.
+    """
+    nodes = onnx.load(path_to_model.as_posix()).graph.node  # (topologically sorted)
+    idx_conv = [i for i, el in enumerate(nodes) if el.op_type == "Conv"]
+    return [el.name for el in nodes[(idx_conv[-1] + 1 if idx_conv else len(nodes)):] if el.name]
+
+
+def quantize_model(
+        path_to_model: Path,
+        path_to_output: Path,
+        files: List[Path],
+        image_size: Tuple[int, int],
+        keep_ratio: bool = False,
+        quant_format: str = "qdq",
+        per_channel: bool = True,
+        calibrate_method: str = "MinMax",
+        preprocess: bool = True,
+        quantize_head: bool = False,
+        nodes_to_exclude: List[str] = None
+) -> List[str]:
+    """
+    Static int8 quantization (uint8 activations, int8 weights) calibrated on `files`. Returns the names of the nodes
+    that were kept in float.
+    """
+    input_name = ort.InferenceSession(path_to_model.as_posix(), providers=["CPUExecutionProvider"]).get_inputs()[0].name
+    with tempfile.TemporaryDirectory() as folder:
+        path_to_input = path_to_model
+        if preprocess:
+            # symbolic shape inference and graph optimization (recommended before quantization)
+            path_to_input = Path(folder) / path_to_model.name
+            try:
+                quant_pre_process(path_to_model.as_posix(), path_to_input.as_posix())
+            except ImportError as ex:
+                # symbolic shape inference requires sympy
+                print(f"{ex} Skipping symbolic shape inference.")
+                quant_pre_process(path_to_model.as_posix(), path_to_input.as_posix(), skip_symbolic_shape=True)
+
+        nodes_to_exclude = list(nodes_to_exclude or [])
+        if not quantize_head:
+            nodes_to_exclude += get_head_nodes(path_to_input)
+
+        quantize_static(
+            path_to_input.as_posix(),
+            path_to_output.as_posix(),
+            ImageCalibrationDataReader(files, input_name, image_size, keep_ratio),
+            quant_format=QuantFormat.QDQ if quant_format.lower() == "qdq" else QuantFormat.QOperator,
+            per_channel=per_channel,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            calibrate_method=CalibrationMethod[calibrate_method],
+            nodes_to_exclude=nodes_to_exclude
+        )
+    return nodes_to_exclude
+
+
+def run_model(
+        path_to_model: Path,
+        inputs: List[Tuple[np.ndarray, Tuple[int, int]]],
+        image_size: Tuple[int, int],
+        keep_ratio: bool,
+        output_format: str,
+        th_score: float,
+        th_iou: float,
+        repeats: int,
+        threads: int = 0
+) -> Tuple[List[float], List[Results]]:
+    """Median latency of the session call and results (boxes in pixels of the image) per input."""
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = threads
+    session = ort.InferenceSession(path_to_model.as_posix(), sess_options=options, providers=["CPUExecutionProvider"])
+    input_name = session.get_inputs()[0].name
+
+    latencies, results = [], []
+    for img_mdl, shape in inputs:
+        output = session.run(None, {input_name: img_mdl})  # warm-up
+        dts = []
+        for _ in range(repeats):
+            t0 = default_timer()
+            session.run(None, {input_name: img_mdl})
+            dts.append(default_timer() - t0)
+        latencies.append(float(np.median(dts)))
+
+        (bboxes, class_ids, scores), = postprocess_batch(output, th_score, 1, output_format, th_iou=th_iou)
+        bboxes = get_letterbox_transform(shape, image_size, keep_ratio).inverse(bboxes)
+        results.append((bboxes, class_ids, scores))
+    return latencies, results
+
+
+def box_iou(bboxes_a: np.ndarray, bboxes_b: np.ndarray) -> np.ndarray:
+    """Pairwise IoU of boxes [x0, y0, x1, y1]: [len(a), len(b)]."""
+    lt = np.maximum(bboxes_a[:, np.newaxis, :2], bboxes_b[np.newaxis, :, :2])
+    rb = np.minimum(bboxes_a[:, np.newaxis, 2:], bboxes_b[np.newaxis, :, 2:])
+    inter = np.prod(np.clip(rb - lt, 0, None), axis=2)
+    area_a = np.prod(bboxes_a[:, 2:] - bboxes_a[:, :2], axis=1)
+    area_b = np.prod(bboxes_b[:, 2:] - bboxes_b[:, :2], axis=1)
+    return inter / np.maximum(area_a[:, np.newaxis] + area_b[np.newaxis, :] - inter, 1e-9)
+
+
+def match_detections(reference: Results, other: Results, th_iou: float = 0.5) -> Tuple[int, List[float], List[float]]:
+    """Greedy matching (highest scores first) of boxes of the same class; returns #matches, IoUs, score deltas."""
+    iou = box_iou(reference[0], other[0]) * (reference[1][:, np.newaxis] == other[1][np.newaxis, :])
+    ious, deltas = [], []
+    for i in np.argsort(-reference[2]):
+        if iou.shape[1] == 0:
+            break
+        j = int(np.argmax(iou[i]))
+        if iou[i, j] >= th_iou:
+            ious.append(float(iou[i, j]))
+            deltas.append(float(other[2][j] - reference[2][i]))
+            iou[:, j] = 0
+    return len(ious), ious, deltas
+
+
+def pattern_decision(results: Results, shape: Tuple[int, int], pattern: dict) -> bool:
+    # as Backend/main.py: normalized boxes; all boxes of the best matching pattern variant found
+    height, width = shape
+    bboxes = results[0] / np.array([width, height, width, height], dtype=np.float32)
+    _, lg = check_boxes(bboxes.tolist(), results[1].tolist(), pattern)
+    return (len(lg) > 1) and all(lg)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Static int8 quantization of an ONNX model calibrated on a folder of images; compares latency, "
+                    "detections, and pattern decisions with the original model."
+    )
+    parser.add_argument("--model", type=str, required=True, help="fp32 ONNX model")
+    parser.add_argument("--images", type=str, nargs="+", default=["test/test_images"], help="calibration images")
+    parser.add_argument("--eval-images", type=str, nargs="+", default=None, help="default: calibration images")
+    parser.add_argument("--output", type=str, default=None, help="quantized model (default: <model>_int8.onnx)")
+    parser.add_argument("--image-size", type=int, nargs=2, default=[640, 640], help="height width")
+    parser.add_argument("--keep-aspect-ratio", action="store_true")
+    parser.add_argument("--format", type=str, default="qdq", choices=["qdq", "qoperator"])
+    parser.add_argument("--per-tensor", action="store_true", help="per-tensor instead of per-channel weights")
+    parser.add_argument("--calibration", type=str, default="MinMax", choices=["MinMax", "Entropy", "Percentile"])
+    parser.add_argument("--no-preprocess", action="store_true", help="skip shape inference and optimization")
+    parser.add_argument("--quantize-head", action="store_true", help="quantize the nodes after the last convolution")
+    parser.add_argument("--exclude-nodes", type=str, nargs="+", default=None, help="names of nodes to keep in float")
+    parser.add_argument("--max-images", type=int, default=200, help="maximum number of calibration images")
+    parser.add_argument("--output-format", type=str, default="auto", help="see [model] output_format")
+    parser.add_argument("--th-score", type=float, default=0.5)
+    parser.add_argument("--th-iou", type=float, default=0.45)
+    parser.add_argument("--patterns", type=str, default=None, help="pattern file or folder of the Backend")
+    parser.add_argument("--repeats", type=int, default=10, help="session calls per image to measure the latency")
+    parser.add_argument("--threads", type=int, default=0, help="intra-op threads of ONNX Runtime (0: default)")
+    args = parser.parse_args()
+
+    path_to_model = Path(args.model)
+    path_to_output = Path(args.output) if args.output else path_to_model.with_name(f"{path_to_model.stem}_int8.onnx")
+    image_size = tuple(args.image_size)
+
+    files_calibration = find_images(args.images, args.max_images)
+    if len(files_calibration) == 0:
+        raise FileNotFoundError(f"No images found in {args.images}.")
+    t0 = default_timer()
+    excluded = quantize_model(
+        path_to_model,
+        path_to_output,
+        files_calibration,
+        image_size,
+        args.keep_aspect_ratio,
+        quant_format=args.format,
+        per_channel=not args.per_tensor,
+        calibrate_method=args.calibration,
+        preprocess=not args.no_preprocess,
+        quantize_head=args.quantize_head,
+        nodes_to_exclude=args.exclude_nodes
+    )
+    print(
+        f"Quantized model written to {path_to_output} ({len(files_calibration)} calibration images, "
+        f"{default_timer() - t0:.3g} s): {path_to_model.stat().st_size / 2 ** 20:.3g} MiB -> "
+        f"{path_to_output.stat().st_size / 2 ** 20:.3g} MiB; kept in float: {', '.join(excluded) or '-'}"
+    )
+
+    # comparison
+    files_eval = find_images(args.eval_images) if args.eval_images else files_calibration
+    inputs = [load_model_input(fl, image_size, args.keep_aspect_ratio) for fl in files_eval]
+    settings = dict(
+        image_size=image_size,
+        keep_ratio=args.keep_aspect_ratio,
+        output_format=args.output_format,
+        th_score=args.th_score,
+        th_iou=args.th_iou,
+        repeats=args.repeats,
+        threads=args.threads
+    )
+    latencies_ref, results_ref = run_model(path_to_model, inputs, **settings)
+    latencies_q, results_q = run_model(path_to_output, inputs, **settings)
+
+    t_ref, t_q = np.median(latencies_ref), np.median(latencies_q)
+    print(f"Latency (median of {len(inputs)} images): fp32 {t_ref * 1000:.4g} ms, int8 {t_q * 1000:.4g} ms "
+          f"(speedup {t_ref / t_q:.3g}x)")
+
+    n_ref = sum(len(el[2]) for el in results_ref)
+    n_q = sum(len(el[2]) for el in results_q)
+    matches = [match_detections(ref, q) for ref, q in zip(results_ref, results_q)]
+    n_matched = sum(el[0] for el in matches)
+    ious = [vl for el in matches for vl in el[1]]
+    deltas = [vl for el in matches for vl in el[2]]
+    print(
+        f"Detections (th_score {args.th_score}): fp32 {n_ref}, int8 {n_q}; matched {n_matched} "
+        f"(IoU >= 0.5, same class): {n_matched / max(n_ref, 1):.1%} of fp32, {n_matched / max(n_q, 1):.1%} of int8; "
+        f"mean IoU {np.mean(ious) if ious else float('nan'):.3f}, "
+        f"score change {np.mean(deltas) if deltas else float('nan'):+.4f} "
+        f"(mean absolute {np.mean(np.abs(deltas)) if deltas else float('nan'):.4f})"
+    )
+
+    if args.patterns:
+        patterns = load_patterns(args.patterns)
+        for key, pattern in patterns.items():
+            decisions = [
+                (pattern_decision(ref, shape, pattern), pattern_decision(q, shape, pattern))
+                for ref, q, (_, shape) in zip(results_ref, results_q, inputs)
+            ]
+            changed = [fl.name for fl, (d_ref, d_q) in zip(files_eval, decisions) if d_ref != d_q]
+            print(
+                f"Pattern '{key}': {sum(el[0] for el in decisions)} / {len(decisions)} images OK with fp32, "
+                f"{sum(el[1] for el in decisions)} with int8; changed decisions: {len(changed)}"
+                + (f" ({', '.join(changed)})" if changed else "")
+            )
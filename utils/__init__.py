@@ -8,7 +8,7 @@ from .env_vars import (
     get_logging_level,
     setup_logging
 )
-from .rest import create_auth_headers
+from .rest import create_auth_headers, create_deadline_headers, get_deadline_timeout, HEADER_DEADLINE
 # config
 from .config import get_config
 from .mapping import get_dict_from_file_or_envs, read_mappings_from_csv
@@ -27,5 +27,8 @@ __all__ = [
     "get_dict_from_file_or_envs",
     "read_mappings_from_csv",
     # REST api
-    "create_auth_headers"
+    "create_auth_headers",
+    "create_deadline_headers",
+    "get_deadline_timeout",
+    "HEADER_DEADLINE"
 ]
\ No newline at end of file
@@ -1,4 +1,8 @@
-from typing import Dict
+from typing import Dict, Mapping, Union
+
+
+# remaining time budget of a request in milliseconds (relative, i.e. the clocks of the hosts need not be synchronized)
+HEADER_DEADLINE = "X-Deadline-Ms"
 
 
 def create_auth_headers(token: str = None) -> Dict[str, str] | None:
@@ -9,4 +13,18 @@ def create_auth_headers(token: str = None) -> Dict[str, str] | None:
         }
     else:
         headers = None
-    return headers
\ No newline at end of file
+    return headers
+
+
+def create_deadline_headers(timeout: float = None) -> Dict[str, str]:
+    """Header with the time (seconds) after which the caller gives up on the request."""
+    return {HEADER_DEADLINE: str(max(int(timeout * 1000), 0))} if timeout is not None else dict()
+
+
+def get_deadline_timeout(headers: Mapping[str, str]) -> Union[float, None]:
+    """Remaining time (seconds) of a request from its header X-Deadline-Ms; None if not given or invalid."""
+    value = headers.get(HEADER_DEADLINE)
+    try:
+        return max(float(value), 0) / 1000 if value is not None else None
+    except ValueError:
+        return None
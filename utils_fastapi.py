@@ -1,21 +1,47 @@
 import fastapi
 from fastapi import FastAPI
-from fastapi import HTTPException, Depends, Response
+from fastapi import HTTPException, Depends, Request, Response, WebSocket, WebSocketException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.openapi.docs import get_swagger_ui_html
+from fastapi.responses import JSONResponse
 # from fastapi_offline import FastAPIOffline as FastAPI
-from prometheus_client import make_asgi_app, Counter, Gauge, generate_latest
+from prometheus_client import (
+    make_asgi_app,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    CollectorRegistry,
+    REGISTRY,
+    multiprocess
+)
+import uvicorn
 from datetime import datetime
+from pathlib import Path
+from collections import deque
+from contextlib import contextmanager
+import asyncio
+import threading
+import tempfile
+import logging
+import os
+import re
+from timeit import default_timer
 # versions / info
 import sys
 
-from utils import get_env_variable, set_env_variable
+from utils import get_env_variable, set_env_variable, default_from_env, get_deadline_timeout
 
 
-from typing import Union, Tuple, List, Dict, Any, Optional
+from typing import Union, Tuple, List, Dict, Any, Optional, Callable, Sequence, Mapping, Awaitable
 
 
 DATETIME_INIT = datetime.now()
+# upper bounds (seconds) of the latency histograms
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# prometheus_client's multiprocess mode writes to this folder as soon as the first metric is created
+if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+    Path(os.environ["PROMETHEUS_MULTIPROC_DIR"]).mkdir(parents=True, exist_ok=True)
 # List of correct access tokens
 ACCESS_TOKENS = get_env_variable("ACCESS_TOKENS", [])
 ACCESS_TOKENS = [ACCESS_TOKENS] if isinstance(ACCESS_TOKENS, str) else ACCESS_TOKENS
@@ -32,6 +58,17 @@ async def check_access_token(token: Optional[str] = Depends(auth_scheme)):
 AccessToken: Optional[str] = Depends(check_access_token) if len(ACCESS_TOKENS) > 0 else None
 
 
+# WebSocket connections: browsers cannot set headers, i.e. the token may also be passed as query parameter "token"
+async def check_websocket_access_token(websocket: WebSocket):
+    scheme, _, credentials = websocket.headers.get("authorization", "").partition(" ")
+    token = credentials if scheme.lower() == "bearer" else websocket.query_params.get("token")
+    if (len(ACCESS_TOKENS) > 0) and (token not in ACCESS_TOKENS):
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid access token")
+
+
+WebSocketAccessToken: Optional[str] = Depends(check_websocket_access_token) if len(ACCESS_TOKENS) > 0 else None
+
+
 def default_fastapi_setup(
         title: str = None,
         summary: str = None,
@@ -39,7 +76,9 @@ def default_fastapi_setup(
         license_info: Union[str, Dict[str, Any]] = None,
         contact: Union[str, Dict[str, Any]] = None,
         lifespan=None,
-        root_path=None
+        root_path=None,
+        home_info: Callable[[], Dict[str, Any]] = None,
+        readiness: Callable[[], bool] = None
 ):
     if license_info is None:
         license_info = {
@@ -78,12 +117,19 @@ def default_fastapi_setup(
             "License": license_info,
             "Impress": contact,
             "Startup date": DATETIME_INIT
-        }
+        } | (home_info() if home_info is not None else dict())
 
     @app.get("/health")
     async def health_check(token = AccessToken):
         return {"status": "ok"}
 
+    # ----- readiness (e.g. warm-up finished): route traffic only to ready servers; /health only reports liveness
+    @app.get("/ready")
+    def ready_check(token = AccessToken):
+        if readiness is None or readiness():
+            return {"status": "ready"}
+        return JSONResponse(status_code=503, content={"status": "not ready"})
+
     # ----- SWAGGER
     @app.get("/docs", include_in_schema=False)
     async def custom_swagger_ui(token = AccessToken):
@@ -95,12 +141,13 @@ def default_fastapi_setup(
 
 def setup_prometheus_metrics(
         app: FastAPI,
-        entrypoints_to_track: list
-) -> Tuple[Dict[str, Counter], Dict[str, Counter], Dict[str, Gauge]]:
+        entrypoints_to_track: list,
+        buckets: Sequence[float] = None
+) -> Tuple[Dict[str, Counter], Dict[str, Counter], Dict[str, Histogram]]:
     # set up /metrics endpoint for prometheus
     @app.get("/metrics")
     async def metrics(token = AccessToken):
-        return Response(generate_latest(), media_type="text/plain")
+        return Response(generate_latest(get_metrics_registry()), media_type="text/plain")
 
     # set up custom metrics
     execution_counter, exception_counter, execution_timing = dict(), dict(), dict()
@@ -114,8 +161,411 @@ def setup_prometheus_metrics(
             name=name + "_exception",
             documentation=f"Counts how often the entry point {ep} raises an exception."
         )
-        execution_timing[ep] = Gauge(
+        execution_timing[ep] = Histogram(
             name=name + "_execution_time",
-            documentation=f"Latest execution time of the entry point {ep}."
+            documentation=f"Execution time of the entry point {ep} in seconds.",
+            buckets=buckets or DEFAULT_LATENCY_BUCKETS
         )
     return execution_counter, exception_counter, execution_timing
+
+
+# threads that run synthetic requests (e.g. warm-up) do not record into the request metrics
+_METRICS_SUPPRESSED = threading.local()
+
+
+@contextmanager
+def request_metrics_suppressed():
+    """Observations of RequestMetric objects in this thread are dropped within this context."""
+    _METRICS_SUPPRESSED.active = True
+    try:
+        yield
+    finally:
+        _METRICS_SUPPRESSED.active = False
+
+
+class RequestMetric:
+    """Histogram, counter, or gauge of real requests: drops observations within request_metrics_suppressed()."""
+    def __init__(self, metric):
+        self.metric = metric
+
+    @staticmethod
+    def suppressed() -> bool:
+        return getattr(_METRICS_SUPPRESSED, "active", False)
+
+    def observe(self, value: float) -> None:
+        if not self.suppressed():
+            self.metric.observe(value)
+
+    def inc(self, value: float = 1) -> None:
+        if not self.suppressed():
+            self.metric.inc(value)
+
+    @contextmanager
+    def time(self):
+        t0 = default_timer()
+        try:
+            yield
+        finally:
+            self.observe(default_timer() - t0)
+
+
+def setup_stage_metrics(
+        name: str,
+        stages: List[str],
+        buckets: Sequence[float] = None
+) -> Dict[str, RequestMetric]:
+    """
+    One histogram family `<name>_stage_duration_seconds` with the label "stage" for the processing stages of a
+    request (e.g. decode, inference). Returns the histogram of each stage; use `.time()` or `.observe(seconds)`.
+    Synthetic requests (warm-up) run within request_metrics_suppressed() and are not recorded.
+    """
+    histogram = Histogram(
+        name=f"{name}_stage_duration_seconds",
+        documentation=f"Duration of the processing stages of a request ({', '.join(stages)}) in seconds.",
+        labelnames=["stage"],
+        buckets=buckets or DEFAULT_LATENCY_BUCKETS
+    )
+    return {el: RequestMetric(histogram.labels(stage=el)) for el in stages}
+
+
+class AdmissionControl:
+    """
+    Bounds the number of requests that are processed at once (`max_in_flight`, per worker process). Further requests
+    wait in a bounded FIFO queue (`max_queue`) for at most `max_queue_wait` seconds; requests beyond are rejected
+    right away with `status_code` (503 or 429) and the header Retry-After instead of queueing without limit in the
+    server until the caller has timed out. Runs on the event loop, i.e. needs no locks.
+    Metrics: <name>_admission_in_flight, _queue_depth, _utilization (in flight / max_in_flight), _rejected (label
+    "reason": "queue_full", "queue_timeout"), and _queue_wait_seconds.
+    """
+    def __init__(
+            self,
+            name: str,
+            max_in_flight: int,
+            max_queue: int = 0,
+            max_queue_wait: float = 1,
+            retry_after: int = 1,
+            status_code: int = 503,
+            buckets: Sequence[float] = None
+    ):
+        self.max_in_flight = max(int(max_in_flight), 1)
+        self.max_queue = max(int(max_queue), 0)
+        self.max_queue_wait = max_queue_wait
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+        self.in_flight = 0
+        self._waiters = deque()
+
+        self.metrics = {
+            "in_flight": Gauge(
+                name=f"{name}_admission_in_flight",
+                documentation="Number of requests that are processed.",
+                multiprocess_mode="livesum"
+            ),
+            "queue_depth": Gauge(
+                name=f"{name}_admission_queue_depth",
+                documentation="Number of requests that wait for admission.",
+                multiprocess_mode="livesum"
+            ),
+            "utilization": Gauge(
+                name=f"{name}_admission_utilization",
+                documentation="Requests in flight relative to the maximum (most loaded worker process).",
+                multiprocess_mode="livemax"
+            ),
+            "rejected": Counter(
+                name=f"{name}_admission_rejected",
+                documentation="Counts the requests that were rejected because the server is saturated.",
+                labelnames=["reason"]
+            ),
+            "queue_wait": Histogram(
+                name=f"{name}_admission_queue_wait_seconds",
+                documentation="Time that admitted requests waited in the queue in seconds.",
+                buckets=buckets or DEFAULT_LATENCY_BUCKETS
+            )
+        }
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def _update_metrics(self) -> None:
+        self.metrics["in_flight"].set(self.in_flight)
+        self.metrics["queue_depth"].set(len(self._waiters))
+        self.metrics["utilization"].set(self.in_flight / self.max_in_flight)
+
+    def _reject(self, reason: str) -> bool:
+        self.metrics["rejected"].labels(reason=reason).inc()
+        logging.debug(
+            f"Request rejected ({reason}): {self.in_flight} requests in flight, {len(self._waiters)} queued."
+        )
+        return False
+
+    async def acquire(self) -> bool:
+        """True if the request is admitted (call release() once it is finished), False if it is rejected."""
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            self._update_metrics()
+            return True
+        if len(self._waiters) >= self.max_queue:
+            return self._reject("queue_full")
+
+        t0 = asyncio.get_running_loop().time()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._update_metrics()
+        try:
+            # release() hands its slot over to the first waiter
+            await asyncio.wait_for(waiter, self.max_queue_wait if self.max_queue_wait else None)
+        except BaseException as ex:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over while timing out or being cancelled: pass it on
+                self.release()
+            if isinstance(ex, asyncio.TimeoutError):
+                return self._reject("queue_timeout")
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            self._update_metrics()
+        self.metrics["queue_wait"].observe(asyncio.get_running_loop().time() - t0)
+        return True
+
+    def release(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+        self._update_metrics()
+
+    def rejection_response(self) -> JSONResponse:
+        return JSONResponse(
+            status_code=self.status_code,
+            content={"detail": "Server is saturated, retry later."},
+            headers={"Retry-After": str(self.retry_after)}
+        )
+
+
+class AdmissionMiddleware:
+    """ASGI middleware: HTTP requests to the `paths` (templates like /models/{name}/inference) pass AdmissionControl."""
+    def __init__(self, app, admission: AdmissionControl, paths: Sequence[str]):
+        self.app = app
+        self.admission = admission
+        self.pattern = re.compile("|".join(
+            re.sub(r"\\{[^}]+\\}", "[^/]+", re.escape(el)) for el in paths
+        ) or "(?!)")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        path, root_path = scope["path"], scope.get("root_path", "")
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        if not self.pattern.fullmatch(path.rstrip("/") or "/"):
+            return await self.app(scope, receive, send)
+
+        if not await self.admission.acquire():
+            return await self.admission.rejection_response()(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.admission.release()
+
+
+def setup_admission_control(
+        app: FastAPI,
+        name: str,
+        paths: Sequence[str],
+        max_in_flight: int = 0,
+        max_queue: int = 0,
+        max_queue_wait: float = 1,
+        retry_after: int = 1,
+        status_code: int = 503,
+        buckets: Sequence[float] = None
+) -> Union[AdmissionControl, None]:
+    """Admission control of the entry points `paths` (see AdmissionControl); disabled if max_in_flight is 0."""
+    if not max_in_flight:
+        return None
+    admission = AdmissionControl(name, max_in_flight, max_queue, max_queue_wait, retry_after, status_code, buckets)
+    app.add_middleware(AdmissionMiddleware, admission=admission, paths=paths)
+    return admission
+
+
+class RequestCancelled(Exception):
+    """The remaining work of a request was dropped because its deadline passed or its client disconnected."""
+    def __init__(self, stage: str, reason: str):
+        super().__init__(
+            f"Request cancelled before stage '{stage}': "
+            f"{'deadline exceeded' if reason == 'deadline' else 'client disconnected'}."
+        )
+        self.stage = stage
+        self.reason = reason
+
+
+class Deadline:
+    """
+    Deadline of a request on the clock of this process, from the remaining time that the caller sent in the header
+    X-Deadline-Ms (no deadline without the header). Call check() before expensive stages: it raises RequestCancelled
+    if the deadline passed or the client disconnected, i.e. nobody waits for the result anymore.
+    """
+    def __init__(
+            self,
+            timeout: float = None,
+            cancellation: "Cancellation" = None,
+            is_disconnected: Callable[[], Awaitable[bool]] = None
+    ):
+        self.t_end = default_timer() + timeout if timeout is not None else None
+        self.cancellation = cancellation
+        self.is_disconnected = is_disconnected
+        # time at which the stages were started
+        self.checkpoints: Dict[str, float] = dict()
+
+    def remaining(self, default: float = None) -> Union[float, None]:
+        """Remaining time in seconds, at most `default` (e.g. the timeout of a request to another service)."""
+        if self.t_end is None:
+            return default
+        remaining = max(self.t_end - default_timer(), 0)
+        return remaining if default is None else min(remaining, default)
+
+    def expired(self) -> bool:
+        return self.t_end is not None and default_timer() >= self.t_end
+
+    def check(self, stage: str, disconnected: bool = False) -> None:
+        """Raises RequestCancelled if the deadline passed or `disconnected`; thread-safe, i.e. also in executors."""
+        if self.expired() or disconnected:
+            reason = "deadline" if self.expired() else "disconnected"
+            if self.cancellation is not None:
+                self.cancellation.cancelled(self, stage, reason)
+            raise RequestCancelled(stage, reason)
+        self.checkpoints[stage] = default_timer()
+
+    async def check_async(self, stage: str) -> None:
+        """As check(); additionally checks whether the client disconnected (after the request body was read)."""
+        self.check(stage, self.is_disconnected is not None and await self.is_disconnected())
+
+    def finished(self) -> None:
+        """The request was processed completely."""
+        if self.cancellation is not None:
+            self.cancellation.finished(self)
+
+
+class Cancellation:
+    """
+    Metrics of the requests whose remaining work was dropped: <name>_cancelled_requests (labels "stage" and "reason":
+    "deadline", "disconnected") and <name>_cancelled_saved_seconds, an estimate of the processing time that was
+    saved, i.e. the moving average of the time that completed requests still took after the same stage had started.
+    """
+    def __init__(self, name: str, smoothing: float = 0.1):
+        self.smoothing = smoothing
+        # stage -> average processing time of completed requests from the start of the stage until the response
+        self._remaining: Dict[str, float] = dict()
+
+        self.counter = Counter(
+            name=f"{name}_cancelled_requests",
+            documentation="Counts the requests that were dropped because their deadline passed or their client "
+                          "disconnected.",
+            labelnames=["stage", "reason"]
+        )
+        self.saved = Counter(
+            name=f"{name}_cancelled_saved_seconds",
+            documentation="Estimated processing time in seconds that was saved by dropping requests."
+        )
+
+    def deadline(self, headers: Mapping[str, str], is_disconnected: Callable[[], Awaitable[bool]] = None) -> Deadline:
+        """Deadline of a request (header X-Deadline-Ms); pass `is_disconnected` (e.g. request.is_disconnected)."""
+        return Deadline(get_deadline_timeout(headers), self, is_disconnected)
+
+    def finished(self, deadline: Deadline) -> None:
+        t = default_timer()
+        for stage, t0 in deadline.checkpoints.items():
+            previous = self._remaining.get(stage)
+            self._remaining[stage] = (t - t0) if previous is None else \
+                previous + self.smoothing * ((t - t0) - previous)
+
+    def cancelled(self, deadline: Deadline, stage: str, reason: str) -> None:
+        self.counter.labels(stage=stage, reason=reason).inc()
+        self.saved.inc(self._remaining.get(stage, 0))
+        logging.debug(f"Request cancelled before stage '{stage}' ({reason}).")
+
+
+def setup_cancellation(app: FastAPI, name: str) -> Cancellation:
+    """
+    Requests that raise RequestCancelled are answered with 504 (deadline exceeded) or 499 (client disconnected; the
+    response is not read anyway). Returns the Cancellation whose deadline(...) creates the deadline of a request.
+    """
+    cancellation = Cancellation(name)
+
+    @app.exception_handler(RequestCancelled)
+    async def request_cancelled(request: Request, ex: RequestCancelled):
+        return JSONResponse(status_code=504 if ex.reason == "deadline" else 499, content={"detail": str(ex)})
+
+    return cancellation
+
+
+def get_metrics_registry() -> CollectorRegistry:
+    # several worker processes: aggregate the metrics of all workers (prometheus_client's multiprocess mode)
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def get_number_of_workers(workers: Union[int, str, None]) -> int:
+    """Number of server processes: an integer or "auto" (number of CPU cores available to the process)."""
+    if isinstance(workers, str) and workers.lower() == "auto":
+        return len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    return max(int(workers), 1) if workers else 1
+
+
+def setup_multiprocess_metrics() -> Path:
+    """
+    Prepares the folder in which the worker processes store their metrics (environment variable
+    PROMETHEUS_MULTIPROC_DIR; a temporary folder if not set). Must be called before the workers are started.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="prometheus_")
+    folder = Path(os.environ["PROMETHEUS_MULTIPROC_DIR"])
+    folder.mkdir(parents=True, exist_ok=True)
+    # remove metrics of previous runs
+    for p in folder.glob("*.db"):
+        p.unlink()
+    return folder
+
+
+def _server_kwargs(port: int) -> Dict[str, Any]:
+    return dict(
+        port=port,
+        host="0.0.0.0",
+        access_log=True,
+        log_config=None,  # Uses the logging configuration in the application
+        ssl_keyfile=default_from_env("SSL_KEYFILE", None),  # "server.key"
+        ssl_certfile=default_from_env("SSL_CERTIFICATE", None),  # "server.crt"
+    )
+
+
+def start_workers(app_import_string: str, port: int, workers: Union[int, str] = 1) -> None:
+    """
+    With several workers, replaces the calling process by uvicorn whose worker processes import the app by
+    `app_import_string` (e.g. "main:app"); /metrics aggregates the metrics of all workers. Call it at the top of the
+    script, before models are loaded or threads are started. Returns only if a single worker is configured.
+    """
+    workers = get_number_of_workers(workers)
+    if workers == 1:
+        return
+
+    folder = setup_multiprocess_metrics()
+    logging.info(f"Starting {workers} worker processes (metrics are collected in {folder}).")
+    # replace this process by an interpreter that only runs uvicorn: the (spawned) worker processes would otherwise
+    # execute the calling script again in addition to importing the app
+    kwargs = _server_kwargs(port) | dict(app=app_import_string, workers=workers)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.execv(sys.executable, [sys.executable, "-c", f"import uvicorn; uvicorn.run(**{kwargs!r})"])
+
+
+def run_server(app: FastAPI, port: int):
+    """Runs the app with uvicorn in this process (several workers: see start_workers)."""
+    uvicorn.run(app=app, **_server_kwargs(port))
@@ -0,0 +1,68 @@
+import struct
+
+import numpy as np
+
+from typing import Union, Tuple, List
+
+
+# compact binary encoding of inference results (alternative to JSON; requested by the HTTP header "Accept")
+MEDIA_TYPE_RESULTS = "application/x-inference-results"
+# header: magic bytes, version, (reserved), number of boxes (little endian)
+HEADER = struct.Struct("<2sBxI")
+MAGIC = b"IR"
+VERSION = 1
+# body: bboxes float32 [n, 4] (x0, y0, x1, y1), class ids int32 [n], scores float32 [n]
+BYTES_PER_BOX = 4 * 4 + 4 + 4
+
+Results = Tuple[np.ndarray, np.ndarray, np.ndarray]  # bboxes, class_ids, scores
+
+
+def accepts_binary_results(accept: Union[str, None]) -> bool:
+    """True if the value of an HTTP header "Accept" asks for the binary encoding (JSON otherwise)."""
+    return bool(accept) and any(el.split(";")[0].strip() == MEDIA_TYPE_RESULTS for el in accept.split(","))
+
+
+def encode_results(bboxes: np.ndarray, class_ids: np.ndarray, scores: np.ndarray) -> bytes:
+    n = len(scores)
+    return b"".join([
+        HEADER.pack(MAGIC, VERSION, n),
+        np.ascontiguousarray(bboxes, dtype="<f4").reshape(n, 4).tobytes(),
+        np.ascontiguousarray(class_ids, dtype="<i4").tobytes(),
+        np.ascontiguousarray(scores, dtype="<f4").tobytes(),
+    ])
+
+
+def encode_results_list(results: List[Results]) -> bytes:
+    """Results of several images: the encoded results are concatenated (in order)."""
+    return b"".join(encode_results(*el) for el in results)
+
+
+def decode_results(buffer: Union[bytes, memoryview], offset: int = 0) -> Tuple[Results, int]:
+    """
+    Decodes the results at `offset` without copying: the arrays are read-only views of `buffer`.
+    Returns the results and the offset of the next message.
+    """
+    if len(buffer) < offset + HEADER.size:
+        raise ValueError(f"Truncated inference results: {len(buffer) - offset} bytes received (header: {HEADER.size}).")
+    magic, version, n = HEADER.unpack_from(buffer, offset)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Unknown binary encoding of inference results (magic {magic!r}, version {version}).")
+    if len(buffer) < offset + HEADER.size + n * BYTES_PER_BOX:
+        raise ValueError(f"Truncated inference results: {n} boxes announced, {len(buffer) - offset} bytes received.")
+
+    offset += HEADER.size
+    bboxes = np.frombuffer(buffer, dtype="<f4", count=n * 4, offset=offset).reshape(n, 4)
+    offset += n * 16
+    class_ids = np.frombuffer(buffer, dtype="<i4", count=n, offset=offset)
+    offset += n * 4
+    scores = np.frombuffer(buffer, dtype="<f4", count=n, offset=offset)
+    offset += n * 4
+    return (bboxes, class_ids, scores), offset
+
+
+def decode_results_list(buffer: Union[bytes, memoryview]) -> List[Results]:
+    results, offset = [], 0
+    while offset < len(buffer):
+        res, offset = decode_results(buffer, offset)
+        results.append(res)
+    return results